@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Connect-to-first-event benchmark for the Socket.IO endpoint.
+
+Starts a worker in the default mode (long-polling, then upgrade) and one
+with SOCKETIO_WEBSOCKET_ONLY=True, and times how long python-socketio
+clients take from calling connect() until the server's first event (the
+namespace connect) arrives, over a number of sequential connections.
+
+    python benchmarks/connect.py --connections 50
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from startup import BACKEND_DIR, free_port
+
+def start_worker(port: int, websocket_only: bool) -> subprocess.Popen:
+    env = dict(os.environ, SOCKETIO_WEBSOCKET_ONLY=str(websocket_only), WORKERS="1")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:socket_app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    started = time.monotonic()
+    while time.monotonic() - started < 30:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Worker did not start within 30s")
+
+async def time_connects(url: str, transports, connections: int):
+    timings = []
+    for _ in range(connections):
+        client = socketio.AsyncClient(reconnection=False)
+        connected = asyncio.Event()
+        client.on("connect", lambda: connected.set())
+        started = time.perf_counter()
+        await client.connect(url, transports=transports, wait=False)
+        await asyncio.wait_for(connected.wait(), timeout=10)
+        timings.append((time.perf_counter() - started) * 1000)
+        await client.disconnect()
+    return timings
+
+def summarize(label: str, timings) -> None:
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<36} median {statistics.median(ordered):7.2f}ms  p95 {p95:7.2f}ms  min {ordered[0]:7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Socket.IO connect-to-first-event latency")
+    parser.add_argument("--connections", type=int, default=50)
+    args = parser.parse_args()
+    
+    for websocket_only in (False, True):
+        port = free_port()
+        process = start_worker(port, websocket_only)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            if websocket_only:
+                timings = asyncio.run(time_connects(url, ["websocket"], args.connections))
+                summarize("websocket only", timings)
+            else:
+                timings = asyncio.run(time_connects(url, ["polling", "websocket"], args.connections))
+                summarize("polling + upgrade (default)", timings)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+if __name__ == "__main__":
+    main()
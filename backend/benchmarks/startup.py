@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Time-to-first-request benchmark for the backend.
+
+Starts a fresh uvicorn worker on a free port for every run, polls GET /
+until it answers and reports the spread over runs, then prints the
+worker's own startup report (GET /api/debug/startup) from the last run.
+
+    python benchmarks/startup.py --runs 5
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def get(url: str, timeout: float = 1.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def run_once(timeout: float):
+    """Seconds from spawning the worker until GET / succeeds, and its startup report"""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:socket_app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker exited with code {process.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"No response within {timeout}s")
+            try:
+                get(base + "/")
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        return elapsed, get(base + "/api/debug/startup?top=10")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to first request of a fresh worker")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+    
+    timings = []
+    report = None
+    for _ in range(args.runs):
+        elapsed, report = run_once(args.timeout)
+        timings.append(elapsed * 1000)
+    
+    summary = {
+        "runs": args.runs,
+        "minMs": round(min(timings), 1),
+        "medianMs": round(statistics.median(timings), 1),
+        "maxMs": round(max(timings), 1),
+        "startup": report
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    
+    print(f"Time to first request over {args.runs} runs: "
+          f"min {summary['minMs']}ms, median {summary['medianMs']}ms, max {summary['maxMs']}ms")
+    print(f"Last worker: ready after {report['readyMs']}ms, {report['importMs']}ms in {report['modulesImported']} imports")
+    print("Slowest packages:")
+    for name, ms in report["packages"].items():
+        print(f"  {name:<32} {ms:>8.1f}ms")
+    print("Initialization:")
+    for name, ms in report["phases"].items():
+        print(f"  {name:<32} {ms:>8.1f}ms")
+
+if __name__ == "__main__":
+    main()
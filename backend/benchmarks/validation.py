@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Per-event validation cost of the signaling models.
+
+Times parsing each hot event payload with its Pydantic model (as the
+handlers did before) and with the slotted fast-path class they use now,
+and building a VideoRoom from a Redis hash by parsing its fields in
+Python first (as get_room did) and by validating the hash directly.
+
+    python benchmarks/validation.py --number 100000
+"""
+
+import os
+import sys
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import (
+    RoomStatus, VideoRoom, OfferEvent, AnswerEvent, CandidateEvent, StatsEvent,
+    FastOfferEvent, FastAnswerEvent, FastCandidateEvent, FastStatsEvent
+)
+
+ROOM_ID = "0b6f3f5e-8c53-4d3a-9a0e-3f1c2b7d9e41"
+# A typical audio+video offer is a few KB of SDP
+SDP = "v=0\r\no=- 4611731400430051336 2 IN IP4 127.0.0.1\r\ns=-\r\nt=0 0\r\n" + "a=rtpmap:96 VP8/90000\r\n" * 150
+
+PAYLOADS = {
+    "offer": ({"roomId": ROOM_ID, "from": "user-1", "sdp": SDP}, OfferEvent, FastOfferEvent),
+    "answer": ({"roomId": ROOM_ID, "from": "companion-1", "sdp": SDP}, AnswerEvent, FastAnswerEvent),
+    "candidate": ({"roomId": ROOM_ID, "from": "user-1", "candidate": {
+        "candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 49203 typ srflx raddr 0.0.0.0 rport 0",
+        "sdpMid": "0",
+        "sdpMLineIndex": 0
+    }}, CandidateEvent, FastCandidateEvent),
+    "stats": ({"roomId": ROOM_ID, "from": "user-1", "rttMs": 42.5, "packetLoss": 0.01,
+               "availableBitrateKbps": 1800}, StatsEvent, FastStatsEvent)
+}
+
+def per_call_ns(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+def room_hash():
+    now = datetime.utcnow()
+    return {
+        "roomId": ROOM_ID,
+        "companionId": "companion-1",
+        "userId": "user-1",
+        "expiresAt": (now + timedelta(minutes=60)).isoformat(),
+        "status": "created",
+        "createdAt": now.isoformat()
+    }
+
+def room_fields(data):
+    return dict(
+        roomId=data["roomId"],
+        companionId=data["companionId"],
+        userId=data["userId"],
+        expiresAt=datetime.fromisoformat(data["expiresAt"]),
+        status=RoomStatus(data["status"]),
+        createdAt=datetime.fromisoformat(data["createdAt"])
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Pydantic and fast-path event parsing")
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+    
+    print(f"{'event':<12} {'pydantic':>12} {'fast path':>12} {'speedup':>9}")
+    for name, (payload, model, fast) in PAYLOADS.items():
+        before = per_call_ns(lambda: model(**payload), args.number)
+        after = per_call_ns(lambda: fast.parse(payload), args.number)
+        print(f"{name:<12} {before:>10.0f}ns {after:>10.0f}ns {before / after:>8.1f}x")
+    
+    data = room_hash()
+    before = per_call_ns(lambda: VideoRoom(**room_fields(data)), args.number)
+    after = per_call_ns(lambda: VideoRoom.model_validate(data), args.number)
+    print(f"{'get_room':<12} {before:>10.0f}ns {after:>10.0f}ns {before / after:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
 from typing import List, Optional
-from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,15 +21,171 @@ class Settings:
     TURN_SERVER_URL: str = os.getenv("TURN_SERVER_URL", "turn:global.turn.twilio.com:3478")
     TURN_USERNAME: str = os.getenv("TURN_USERNAME", "")
     TURN_CREDENTIAL: str = os.getenv("TURN_CREDENTIAL", "")
+    # Shared secret for time-limited TURN credentials (TURN REST API); overrides the static pair
+    TURN_SHARED_SECRET: str = os.getenv("TURN_SHARED_SECRET", "")
+    TURN_CREDENTIAL_TTL_SECONDS: int = int(os.getenv("TURN_CREDENTIAL_TTL_SECONDS", "3600"))
+    TURN_CREDENTIAL_REFRESH_MARGIN_SECONDS: int = int(os.getenv("TURN_CREDENTIAL_REFRESH_MARGIN_SECONDS", "300"))
+    TURN_CREDENTIAL_CACHE_SIZE: int = int(os.getenv("TURN_CREDENTIAL_CACHE_SIZE", "10000"))
+    
+    # Regional ICE servers as JSON: [{"region": "eu", "urls": ["stun:..."], "username": ..., "credential": ...}]
+    ICE_SERVERS: str = os.getenv("ICE_SERVERS", "")
+    ICE_PROBE_INTERVAL_SECONDS: float = float(os.getenv("ICE_PROBE_INTERVAL_SECONDS", "30"))
+    ICE_PROBE_TIMEOUT_SECONDS: float = float(os.getenv("ICE_PROBE_TIMEOUT_SECONDS", "1.0"))
+    ICE_PROBE_MAX_FAILURES: int = int(os.getenv("ICE_PROBE_MAX_FAILURES", "2"))
+    ICE_MAX_STUN_SERVERS: int = int(os.getenv("ICE_MAX_STUN_SERVERS", "2"))
+    ICE_MAX_TURN_SERVERS: int = int(os.getenv("ICE_MAX_TURN_SERVERS", "2"))
+    
+    # Adaptive Media
+    MEDIA_STATS_WINDOW: int = int(os.getenv("MEDIA_STATS_WINDOW", "16"))
+    MEDIA_UPGRADE_HOLD_SAMPLES: int = int(os.getenv("MEDIA_UPGRADE_HOLD_SAMPLES", "8"))
+    MEDIA_STATS_IDLE_SECONDS: float = float(os.getenv("MEDIA_STATS_IDLE_SECONDS", "300"))
+    
+    # Call-Quality Telemetry
+    TELEMETRY_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("TELEMETRY_FLUSH_INTERVAL_SECONDS", "10"))
+    TELEMETRY_IDLE_SECONDS: float = float(os.getenv("TELEMETRY_IDLE_SECONDS", "300"))
+    
+    # SDP Munging (offers/answers; empty allowlist keeps every header extension, 0 means no cap)
+    SDP_PIPELINE_ENABLED: bool = os.getenv("SDP_PIPELINE_ENABLED", "false").lower() == "true"
+    SDP_PREFERRED_VIDEO_CODECS: str = os.getenv("SDP_PREFERRED_VIDEO_CODECS", "VP8")
+    SDP_PREFERRED_AUDIO_CODECS: str = os.getenv("SDP_PREFERRED_AUDIO_CODECS", "opus")
+    SDP_STRIP_CODECS: bool = os.getenv("SDP_STRIP_CODECS", "true").lower() == "true"
+    SDP_ALLOWED_EXTMAPS: str = os.getenv("SDP_ALLOWED_EXTMAPS", "")
+    SDP_VIDEO_MAX_KBPS: int = int(os.getenv("SDP_VIDEO_MAX_KBPS", "0"))
+    SDP_AUDIO_MAX_KBPS: int = int(os.getenv("SDP_AUDIO_MAX_KBPS", "0"))
+    SDP_COMPRESS_HISTORY: bool = os.getenv("SDP_COMPRESS_HISTORY", "false").lower() == "true"
+    
+    # Tracing (sample rate 0 disables; exporter: memory, stdout or file)
+    TRACING_SAMPLE_RATE: float = float(os.getenv("TRACING_SAMPLE_RATE", "0"))
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "memory")
+    TRACING_EXPORT_PATH: str = os.getenv("TRACING_EXPORT_PATH", "traces.jsonl")
+    TRACING_RING_SIZE: int = int(os.getenv("TRACING_RING_SIZE", "2048"))
     
     # External API
     PERSONA_FETCHER_API_URL: str = os.getenv("PERSONA_FETCHER_API_URL", "https://persona-fetcher-api.up.railway.app/personas")
     
+    # Persona API Client
+    UPSTREAM_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SECONDS", "2.0"))
+    UPSTREAM_READ_TIMEOUT_SECONDS: float = float(os.getenv("UPSTREAM_READ_TIMEOUT_SECONDS", "5.0"))
+    UPSTREAM_DEADLINE_SECONDS: float = float(os.getenv("UPSTREAM_DEADLINE_SECONDS", "8.0"))
+    UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    UPSTREAM_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY_SECONDS", "30.0"))
+    UPSTREAM_RETRIES: int = int(os.getenv("UPSTREAM_RETRIES", "1"))
+    UPSTREAM_RETRY_BACKOFF_SECONDS: float = float(os.getenv("UPSTREAM_RETRY_BACKOFF_SECONDS", "0.2"))
+    UPSTREAM_HEDGE_DELAY_SECONDS: float = float(os.getenv("UPSTREAM_HEDGE_DELAY_SECONDS", "0"))
+    UPSTREAM_BREAKER_FAILURES: int = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+    UPSTREAM_BREAKER_RESET_SECONDS: float = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30.0"))
+    UPSTREAM_BREAKER_HALF_OPEN_CALLS: int = int(os.getenv("UPSTREAM_BREAKER_HALF_OPEN_CALLS", "1"))
+    
+    # Companion Catalog
+    COMPANION_CACHE_TTL_SECONDS: int = int(os.getenv("COMPANION_CACHE_TTL_SECONDS", "300"))
+    COMPANION_PAGE_SIZE: int = int(os.getenv("COMPANION_PAGE_SIZE", "20"))
+    COMPANION_MAX_PAGE_SIZE: int = int(os.getenv("COMPANION_MAX_PAGE_SIZE", "100"))
+    COMPANION_SNAPSHOT_PATH: str = os.getenv("COMPANION_SNAPSHOT_PATH", ".cache/companion_catalog.json.gz")
+    COMPANION_REVALIDATE_JITTER_SECONDS: float = float(os.getenv("COMPANION_REVALIDATE_JITTER_SECONDS", "5.0"))
+    
+    # Companion Replies (provider: auto, gemini, local or off; auto picks gemini when GOOGLE_API_KEY is set)
+    COMPANION_REPLY_PROVIDER: str = os.getenv("COMPANION_REPLY_PROVIDER", "auto")
+    COMPANION_REPLY_MODEL: str = os.getenv("COMPANION_REPLY_MODEL", "gemini-1.5-flash")
+    COMPANION_REPLY_CONCURRENCY: int = int(os.getenv("COMPANION_REPLY_CONCURRENCY", "8"))
+    COMPANION_REPLY_QUEUE_MAX: int = int(os.getenv("COMPANION_REPLY_QUEUE_MAX", "64"))
+    COMPANION_REPLY_TIMEOUT_SECONDS: float = float(os.getenv("COMPANION_REPLY_TIMEOUT_SECONDS", "30"))
+    COMPANION_PROMPT_CACHE_SIZE: int = int(os.getenv("COMPANION_PROMPT_CACHE_SIZE", "256"))
+    COMPANION_LOCAL_TOKEN_DELAY_SECONDS: float = float(os.getenv("COMPANION_LOCAL_TOKEN_DELAY_SECONDS", "0"))
+    
+    # Companion Speech (provider: auto, elevenlabs, local or off; auto picks elevenlabs when ELEVENLABS_API_KEY is set)
+    TTS_PROVIDER: str = os.getenv("TTS_PROVIDER", "auto")
+    TTS_MODEL_ID: str = os.getenv("TTS_MODEL_ID", "eleven_turbo_v2")
+    TTS_OUTPUT_FORMAT: str = os.getenv("TTS_OUTPUT_FORMAT", "pcm_16000")
+    TTS_CACHE_MAX_BYTES: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    TTS_LOCAL_CHUNK_DELAY_SECONDS: float = float(os.getenv("TTS_LOCAL_CHUNK_DELAY_SECONDS", "0"))
+    
+    # Conversation Context (token budgets; memory is per user and companion)
+    CONTEXT_WINDOW_TOKENS: int = int(os.getenv("CONTEXT_WINDOW_TOKENS", "1500"))
+    CONTEXT_SUMMARY_TOKENS: int = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "400"))
+    CONTEXT_MEMORY_TOKENS: int = int(os.getenv("CONTEXT_MEMORY_TOKENS", "600"))
+    CONTEXT_MEMORY_TTL_DAYS: int = int(os.getenv("CONTEXT_MEMORY_TTL_DAYS", "30"))
+    
+    # Speech Ingest (provider: off or local; PCM ring per connection, energy VAD)
+    STT_PROVIDER: str = os.getenv("STT_PROVIDER", "off")
+    STT_CONCURRENCY: int = int(os.getenv("STT_CONCURRENCY", "4"))
+    STT_BUFFER_SECONDS: float = float(os.getenv("STT_BUFFER_SECONDS", "20"))
+    STT_JITTER_FRAMES: int = int(os.getenv("STT_JITTER_FRAMES", "5"))
+    STT_VAD_THRESHOLD: float = float(os.getenv("STT_VAD_THRESHOLD", "500"))
+    STT_VAD_START_MS: int = int(os.getenv("STT_VAD_START_MS", "60"))
+    STT_VAD_SILENCE_MS: int = int(os.getenv("STT_VAD_SILENCE_MS", "600"))
+    STT_VAD_PREROLL_MS: int = int(os.getenv("STT_VAD_PREROLL_MS", "200"))
+    STT_MAX_UTTERANCE_SECONDS: float = float(os.getenv("STT_MAX_UTTERANCE_SECONDS", "15"))
+    STT_LOCAL_DELAY_SECONDS: float = float(os.getenv("STT_LOCAL_DELAY_SECONDS", "0"))
+    
+    # Media Relay (server-side WebRTC termination for calls that fail peer-to-peer; needs aiortc and WORKERS=1)
+    MEDIA_RELAY_ENABLED: bool = os.getenv("MEDIA_RELAY_ENABLED", "false").lower() == "true"
+    MEDIA_RELAY_WORKERS: int = int(os.getenv("MEDIA_RELAY_WORKERS", "2"))
+    MEDIA_RELAY_TIMEOUT_SECONDS: float = float(os.getenv("MEDIA_RELAY_TIMEOUT_SECONDS", "10"))
+    MEDIA_RELAY_TAP_AUDIO: bool = os.getenv("MEDIA_RELAY_TAP_AUDIO", "true").lower() == "true"
+    
+    # Presence (shared online/in-call index; a dead worker's entries are reaped after the TTL)
+    PRESENCE_HEARTBEAT_SECONDS: float = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "10"))
+    PRESENCE_WORKER_TTL_SECONDS: int = int(os.getenv("PRESENCE_WORKER_TTL_SECONDS", "30"))
+    PRESENCE_LAST_SEEN_DAYS: int = int(os.getenv("PRESENCE_LAST_SEEN_DAYS", "30"))
+    PRESENCE_QUERY_MAX: int = int(os.getenv("PRESENCE_QUERY_MAX", "1000"))
+    
+    # Capacity Scheduler (concurrent companion sessions; 0 = unlimited, metadata.maxSessions overrides per companion)
+    CAPACITY_COMPANION_SESSIONS: int = int(os.getenv("CAPACITY_COMPANION_SESSIONS", "0"))
+    CAPACITY_WORKER_SESSIONS: int = int(os.getenv("CAPACITY_WORKER_SESSIONS", "0"))
+    CAPACITY_SESSION_SECONDS: float = float(os.getenv("CAPACITY_SESSION_SECONDS", "600"))
+    CAPACITY_QUEUE_MAX: int = int(os.getenv("CAPACITY_QUEUE_MAX", "500"))
+    CAPACITY_POLL_SECONDS: float = float(os.getenv("CAPACITY_POLL_SECONDS", "1"))
+    CAPACITY_WAITER_STALE_SECONDS: float = float(os.getenv("CAPACITY_WAITER_STALE_SECONDS", "15"))
+    CAPACITY_WORKER_TTL_SECONDS: int = int(os.getenv("CAPACITY_WORKER_TTL_SECONDS", "30"))
+    
+    # Graceful Drain (deploys: stop new joins, spread client reconnects, let negotiations finish)
+    DRAIN_ON_SIGTERM: bool = os.getenv("DRAIN_ON_SIGTERM", "true").lower() == "true"
+    DRAIN_DEADLINE_SECONDS: float = float(os.getenv("DRAIN_DEADLINE_SECONDS", "25"))
+    DRAIN_RECONNECT_SPREAD_SECONDS: float = float(os.getenv("DRAIN_RECONNECT_SPREAD_SECONDS", "10"))
+    DRAIN_NEGOTIATION_TIMEOUT_SECONDS: float = float(os.getenv("DRAIN_NEGOTIATION_TIMEOUT_SECONDS", "15"))
+    DRAIN_BACKOFF_BASE_MS: int = int(os.getenv("DRAIN_BACKOFF_BASE_MS", "500"))
+    DRAIN_BACKOFF_MAX_MS: int = int(os.getenv("DRAIN_BACKOFF_MAX_MS", "15000"))
+    DRAIN_TOKEN: str = os.getenv("DRAIN_TOKEN", "")
+    
+    # Worker Processes (python main.py): 1 runs a single uvicorn process (with reload when DEBUG),
+    # 0 runs one per CPU core. ip_hash pins each client IP to one worker in the kernel so Engine.IO
+    # long-polling stays sticky; reuseport balances every connection and needs websocket-only clients.
+    # Single-process only: the media relay (refused unless WORKERS=1). Per worker: media tiers
+    # only see stats from the worker's own connections, and reply batching is per worker
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
+    WORKER_ROUTING: str = os.getenv("WORKER_ROUTING", "ip_hash")
+    WORKER_HEARTBEAT_SECONDS: float = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "1"))
+    WORKER_HEARTBEAT_TIMEOUT_SECONDS: float = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT_SECONDS", "10"))
+    WORKER_STARTUP_TIMEOUT_SECONDS: float = float(os.getenv("WORKER_STARTUP_TIMEOUT_SECONDS", "60"))
+    WORKER_RESTART_BACKOFF_MAX_SECONDS: float = float(os.getenv("WORKER_RESTART_BACKOFF_MAX_SECONDS", "30"))
+    
     # CORS Configuration
     CORS_ORIGINS: List[str] = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
     
+    # Socket.IO Serializer: json, msgpack, or both (JSON on /socket.io, msgpack on SOCKETIO_MSGPACK_PATH)
+    SOCKETIO_SERIALIZER: str = os.getenv("SOCKETIO_SERIALIZER", "json")
+    SOCKETIO_MSGPACK_PATH: str = os.getenv("SOCKETIO_MSGPACK_PATH", "socket.io-msgpack")
+    # Redis URL relaying emits between workers; defaults to REDIS_URL when WORKERS is not 1
+    SOCKETIO_MESSAGE_QUEUE: str = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+    # WebSocket-only skips the long-polling handshake and upgrade (clients must use transports: ["websocket"])
+    SOCKETIO_WEBSOCKET_ONLY: bool = os.getenv("SOCKETIO_WEBSOCKET_ONLY", "False").lower() == "true"
+    SOCKETIO_PING_INTERVAL_SECONDS: float = float(os.getenv("SOCKETIO_PING_INTERVAL_SECONDS", "25"))
+    SOCKETIO_PING_TIMEOUT_SECONDS: float = float(os.getenv("SOCKETIO_PING_TIMEOUT_SECONDS", "20"))
+    # Largest accepted message, on polling requests and WebSocket frames alike
+    SOCKETIO_MAX_HTTP_BUFFER_SIZE: int = int(os.getenv("SOCKETIO_MAX_HTTP_BUFFER_SIZE", "1000000"))
+    # Polling responses at least this large are gzip/deflate compressed
+    SOCKETIO_COMPRESSION_THRESHOLD: int = int(os.getenv("SOCKETIO_COMPRESSION_THRESHOLD", "1024"))
+    # Negotiate permessage-deflate with WebSocket clients that offer it
+    SOCKETIO_WS_PER_MESSAGE_DEFLATE: bool = os.getenv("SOCKETIO_WS_PER_MESSAGE_DEFLATE", "True").lower() == "true"
+    
     # Session Configuration
     SESSION_SECRET_KEY: str = os.getenv("SESSION_SECRET_KEY", "your-secret-key-change-in-production")
     SESSION_EXPIRE_MINUTES: int = int(os.getenv("SESSION_EXPIRE_MINUTES", "60"))
+    # How long a dropped connection stays in its room, so resuming within it is not announced
+    SESSION_RESUME_GRACE_SECONDS: float = float(os.getenv("SESSION_RESUME_GRACE_SECONDS", "10"))
+    
+    # Bulk Room Provisioning
+    BULK_ROOMS_MAX: int = int(os.getenv("BULK_ROOMS_MAX", "500"))
 
 settings = Settings()
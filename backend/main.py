@@ -1,30 +1,112 @@
-from fastapi import FastAPI, HTTPException, Depends
+# Installed before anything else so the startup report covers every import
+from utils.startup_profile import startup_profile
+startup_profile.install()
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import socketio
+from fastapi.responses import JSONResponse, Response
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List
 
 from config import settings
 from models import (
-    VideoRoom, RoomInfo, ICEConfig, CompanionsResponse, 
-    ChatMessage, RecordingUpload, JoinEvent, OfferEvent, 
-    AnswerEvent, CandidateEvent, LeaveEvent, EndEvent
+    RoomStatus, UserRole,
+    VideoRoom, RoomInfo, BulkRoomRequest, BulkRoomResult, BulkRoomResponse, ICEConfig, CompanionsResponse, CompanionSearchResponse,
+    ChatMessage, RecordingUpload, JoinEvent, ResumeEvent, LeaveEvent, EndEvent, AudioStartEvent,
+    RelayDescriptionEvent, PresenceQuery, PresenceResponse, QueueTicket, CapacityWaitEvent,
+    FastOfferEvent, FastAnswerEvent, FastCandidateEvent, FastStatsEvent
 )
 from utils.redis_manager import redis_manager
-from utils.companion_service import companion_service
-from utils.webrtc_config import webrtc_config_service
+from utils.services import services
+from utils.media_adaptation import media_adaptation_service
+from utils.telemetry_store import telemetry_store
+from utils.tracing import tracer, traced
+from utils.signaling_transport import create_signaling_server, websocket_options
+from socketio.exceptions import ConnectionRefusedError as SocketConnectionRefused
+from utils.companion_replies import reply_engine
+from utils.tts_relay import tts_relay
+from utils.context_store import context_store
+from utils.speech_ingest import speech_ingest
+from utils.media_relay import media_relay, AIORTC_AVAILABLE, TAP_SAMPLE_RATE, TAP_FRAME_MS, TAP_FRAME_BYTES
+from utils.presence import presence_service
+from utils.capacity import capacity_scheduler
+from utils.drain import drain_controller
+from utils.session_tokens import session_tokens
+from utils.sdp_pipeline import sdp_pipeline, history_fields
+from utils.room_lifecycle import room_lifecycle, can_transition, compute_setup_metrics, TERMINAL_STATUSES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def start_companion_service(service) -> None:
+    # Answer from the last snapshot right away and revalidate in the background,
+    # spreading upstream fetches out when many workers start together
+    service.load_snapshot()
+    service.start_background_refresh(settings.COMPANION_REVALIDATE_JITTER_SECONDS)
+
+# Services constructed on first use (or by the lifespan below) rather than at import
+services.register(
+    "companion_service", "utils.companion_service:companion_service",
+    start=start_companion_service,
+    stop=lambda service: service.close()
+)
+services.register(
+    "webrtc_config_service", "utils.webrtc_config:webrtc_config_service",
+    start=lambda service: service.start_prober(),
+    stop=lambda service: service.stop_prober()
+)
+
+get_companion_service = services.dependency("companion_service")
+get_webrtc_config_service = services.dependency("webrtc_config_service")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start services before serving and stop them on shutdown"""
+    logger.info("Starting AI Companion Video Call API")
+    logger.info(f"Redis URL: {settings.REDIS_URL}")
+    logger.info(f"CORS Origins: {settings.CORS_ORIGINS}")
+    
+    await services.start()
+    with startup_profile.phase("start background tasks"):
+        telemetry_store.start_flusher()
+        presence_service.start()
+        capacity_scheduler.start()
+        if settings.DRAIN_ON_SIGTERM:
+            drain_controller.install_signal_handler(drain_worker)
+        if settings.MEDIA_RELAY_ENABLED:
+            if settings.WORKERS != 1:
+                # Both peers of a relayed call must reach the same relay process
+                logger.error("MEDIA_RELAY_ENABLED requires WORKERS=1; media relay disabled")
+            elif AIORTC_AVAILABLE:
+                media_relay.start()
+            else:
+                logger.warning("MEDIA_RELAY_ENABLED is set but aiortc is not installed; media relay disabled")
+    startup_profile.mark_ready()
+    startup_profile.log_report()
+    
+    yield
+    
+    logger.info("Shutting down AI Companion Video Call API")
+    await services.stop()
+    await telemetry_store.stop_flusher()
+    await reply_engine.close()
+    await tts_relay.close()
+    await media_relay.stop()
+    await speech_ingest.close()
+    await context_store.close()
+    await presence_service.stop()
+    await capacity_scheduler.stop()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Companion Video Call API",
     description="Backend API for AI Companion Video Call & Streaming",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -36,15 +118,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Socket.IO
-sio = socketio.AsyncServer(
-    cors_allowed_origins=settings.CORS_ORIGINS,
-    logger=True,
-    engineio_logger=True
-)
+# Initialize Socket.IO (JSON, msgpack or both, see SOCKETIO_SERIALIZER)
+sio = create_signaling_server()
 
 # Create Socket.IO app
-socket_app = socketio.ASGIApp(sio, app)
+socket_app = sio.asgi_app(app)
 
 # Store active connections
 active_connections: Dict[str, Dict[str, Any]] = {}
@@ -55,13 +133,32 @@ async def root():
     """Health check endpoint"""
     return {"message": "AI Companion Video Call API is running", "status": "healthy"}
 
-@app.post("/api/video/rooms", response_model=VideoRoom)
+@app.get("/api/health/ready")
+async def readiness():
+    """Readiness probe; 503 while the worker drains so load balancers stop routing to it"""
+    if drain_controller.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", **drain_controller.status()})
+    return {"status": "ready"}
+
+@app.post("/api/admin/drain", status_code=202)
+async def start_drain(x_drain_token: Optional[str] = Header(default=None), deadline_seconds: Optional[float] = None):
+    """Start draining this worker (e.g. from a pre-stop hook) without shutting it down"""
+    if not settings.DRAIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_drain_token != settings.DRAIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid drain token")
+    drain_controller.run(lambda: drain_worker(deadline_seconds))
+    return drain_controller.status()
+
+@app.post("/api/video/rooms", response_model=VideoRoom, responses={202: {"model": QueueTicket}})
+@traced("POST /api/video/rooms")
 async def create_video_room(
     companion_id: str,
     user_id: str,
-    expire_minutes: int = 60
+    expire_minutes: int = 60,
+    companion_service=Depends(get_companion_service)
 ):
-    """Create a new video room"""
+    """Create a new video room, or a queue ticket (202) while the companion is at capacity"""
     try:
         logger.info(f"Creating video room for companion {companion_id} and user {user_id}")
         
@@ -70,17 +167,74 @@ async def create_video_room(
         if not companion:
             raise HTTPException(status_code=404, detail="Companion not found")
         
-        # Create room
-        room = await redis_manager.create_room(companion_id, user_id, expire_minutes)
+        # Create room if the companion has a free session slot
+        room = await capacity_scheduler.request_room(companion, user_id, expire_minutes)
+        if room is None:
+            raise HTTPException(status_code=503, detail="Companion is at capacity and its queue is full")
+        if isinstance(room, QueueTicket):
+            logger.info(f"Queued ticket {room.ticketId} for companion {companion_id} at position {room.position}")
+            return JSONResponse(status_code=202, content=room.model_dump())
+        tracer.current_span().set_room(room.roomId)
         
         logger.info(f"Created room {room.roomId}")
         return room
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating video room: {e}")
         raise HTTPException(status_code=500, detail="Failed to create video room")
 
+@app.post("/api/video/rooms/bulk", response_model=BulkRoomResponse)
+@traced("POST /api/video/rooms/bulk")
+async def create_video_rooms_bulk(request: BulkRoomRequest, companion_service=Depends(get_companion_service)):
+    """Create many video rooms at once; each item succeeds or fails on its own.
+    
+    Every room takes a companion session slot under the same limits as a
+    single room, but items that do not fit fail with "Companion at
+    capacity" instead of being queued.
+    """
+    if len(request.rooms) > settings.BULK_ROOMS_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BULK_ROOMS_MAX} rooms per request")
+    
+    try:
+        logger.info(f"Bulk creating {len(request.rooms)} video rooms")
+        
+        # Validate every companion against one snapshot of the cached catalog
+        catalog = await companion_service.get_catalog()
+        results: List[Optional[BulkRoomResult]] = [None] * len(request.rooms)
+        valid = []
+        for index, item in enumerate(request.rooms):
+            companion = catalog.get(item.companionId)
+            if companion is None:
+                results[index] = BulkRoomResult(index=index, status="failed", error="Companion not found")
+            else:
+                valid.append((index, companion))
+        
+        # Admit all valid rooms in one pipeline and write the admitted ones in another
+        created = await capacity_scheduler.request_rooms([
+            (companion, request.rooms[index].userId, request.rooms[index].expireMinutes)
+            for index, companion in valid
+        ]) if valid else []
+        for (index, _), outcome in zip(valid, created):
+            if outcome is None:
+                results[index] = BulkRoomResult(index=index, status="failed", error="Companion at capacity")
+            elif isinstance(outcome, Exception):
+                logger.error(f"Error creating room for item {index}: {outcome}")
+                results[index] = BulkRoomResult(index=index, status="failed", error="Failed to create video room")
+            else:
+                results[index] = BulkRoomResult(index=index, status="created", room=outcome)
+        
+        created_count = sum(1 for result in results if result.status == "created")
+        logger.info(f"Bulk created {created_count} of {len(results)} video rooms")
+        return BulkRoomResponse(created=created_count, failed=len(results) - created_count, results=results)
+        
+    except Exception as e:
+        logger.error(f"Error bulk creating video rooms: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create video rooms")
+
 @app.get("/api/video/rooms/{room_id}", response_model=RoomInfo)
+@traced("GET /api/video/rooms/{room_id}")
 async def get_room_info(room_id: str):
     """Fetch or validate room info"""
     try:
@@ -90,7 +244,7 @@ async def get_room_info(room_id: str):
         
         # Check if room is expired
         if datetime.utcnow() > room.expiresAt:
-            await redis_manager.update_room_status(room_id, "expired")
+            await room_lifecycle.transition(room_id, RoomStatus.EXPIRED, "expired")
             raise HTTPException(status_code=410, detail="Room has expired")
         
         return RoomInfo(roomId=room_id, status=room.status)
@@ -101,29 +255,152 @@ async def get_room_info(room_id: str):
         logger.error(f"Error getting room info: {e}")
         raise HTTPException(status_code=500, detail="Failed to get room info")
 
+@app.get("/api/video/rooms/{room_id}/events")
+async def get_room_events(room_id: str):
+    """Room lifecycle event log with call setup metrics"""
+    try:
+        events = await room_lifecycle.get_events(room_id)
+        if not events:
+            raise HTTPException(status_code=404, detail="Room not found")
+        
+        return {"roomId": room_id, "events": events, "metrics": compute_setup_metrics(events)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting room events: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get room events")
+
 @app.get("/api/webrtc/config", response_model=ICEConfig)
-async def get_webrtc_config():
+async def get_webrtc_config(user_id: Optional[str] = None, region: Optional[str] = None,
+                            webrtc_config_service=Depends(get_webrtc_config_service)):
     """Provide ICE server configuration"""
     try:
-        config = webrtc_config_service.get_ice_config()
-        logger.info("Providing WebRTC ICE configuration")
-        return config
+        # Served pre-serialized; TURN credentials are cached per user until near expiry
+        payload = webrtc_config_service.get_ice_config_json(user_id, region)
+        return Response(content=payload, media_type="application/json")
     except Exception as e:
         logger.error(f"Error getting WebRTC config: {e}")
         raise HTTPException(status_code=500, detail="Failed to get WebRTC config")
 
+@app.get("/api/webrtc/media-constraints")
+async def get_media_constraints(room_id: Optional[str] = None):
+    """Provide the current media constraints and bitrate cap for a room"""
+    return media_adaptation_service.get_profile(room_id)
+
+@app.get("/api/webrtc/quality/{room_id}")
+async def get_room_quality(room_id: str):
+    """Rolling network quality aggregates for a room"""
+    summary = media_adaptation_service.get_room_summary(room_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No stats for room")
+    return summary
+
+@app.get("/api/telemetry/rooms/{room_id}")
+async def get_room_telemetry(room_id: str, resolution: Optional[str] = Query(default=None, pattern="^(1s|10s|1m)$")):
+    """Call-quality summary for a room, optionally with a 1s/10s/1m rollup series"""
+    try:
+        quality = await telemetry_store.get_room_quality(room_id, resolution)
+    except Exception as e:
+        logger.error(f"Error getting room telemetry: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get room telemetry")
+    
+    if quality is None:
+        raise HTTPException(status_code=404, detail="No telemetry for room")
+    return quality
+
+@app.get("/api/debug/traces")
+async def get_debug_traces(room_id: Optional[str] = None, limit: int = Query(default=200, ge=1, le=2000)):
+    """Recent call setup spans from the in-memory trace ring"""
+    return {"enabled": tracer.enabled, "spans": tracer.recent_spans(room_id, limit)}
+
+@app.get("/api/debug/replies")
+async def get_debug_replies():
+    """Companion reply counters and time-to-first-token percentiles for this worker"""
+    return reply_engine.stats()
+
+@app.get("/api/debug/tts")
+async def get_debug_tts():
+    """Speech cache hit rate and first audio chunk latency for this worker"""
+    return tts_relay.stats()
+
+@app.get("/api/debug/speech")
+async def get_debug_speech():
+    """Audio ingest streams, frame counters and transcription latency for this worker"""
+    return speech_ingest.stats()
+
+@app.get("/api/webrtc/relay")
+async def get_webrtc_relay():
+    """Media relay availability and worker process health"""
+    return media_relay.status()
+
+@app.get("/api/debug/startup")
+async def get_debug_startup(top: int = Query(default=15, ge=1, le=200)):
+    """Import and initialization cost of this worker, per module and per service"""
+    return startup_profile.report(top)
+
+@app.get("/api/capacity")
+async def get_capacity():
+    """Session limits, worker loads and admission counters"""
+    return await capacity_scheduler.stats()
+
+@app.get("/api/webrtc/servers")
+async def get_webrtc_servers(webrtc_config_service=Depends(get_webrtc_config_service)):
+    """Report probe results (reachability and RTT) for configured ICE servers"""
+    return {"regions": webrtc_config_service.regions, "servers": webrtc_config_service.server_status()}
+
+@app.post("/api/presence/query", response_model=PresenceResponse)
+@traced("POST /api/presence/query")
+async def query_presence(query: PresenceQuery):
+    """Bulk presence: which users are online, which companions are in a call, room occupancy"""
+    if len(query.userIds) + len(query.companionIds) + len(query.roomIds) > settings.PRESENCE_QUERY_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.PRESENCE_QUERY_MAX} ids per query")
+    return await presence_service.query(query.userIds, query.companionIds, query.roomIds)
+
 @app.get("/api/companions", response_model=CompanionsResponse)
-async def get_companions():
+async def get_companions(companion_service=Depends(get_companion_service)):
     """List available companions with images and metadata"""
     try:
         logger.info("Fetching companions")
-        companions = await companion_service.fetch_companions()
+        companions = await companion_service.list_companions()
         return CompanionsResponse(companions=companions)
     except Exception as e:
         logger.error(f"Error fetching companions: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch companions")
 
+@app.get("/api/companions/search", response_model=CompanionSearchResponse)
+async def search_companions(
+    q: Optional[str] = None,
+    interest: List[str] = Query(default=[]),
+    filter: List[str] = Query(default=[], description="Metadata filters as key:value"),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1),
+    companion_service=Depends(get_companion_service)
+):
+    """Search companions by name, description and personality with metadata filters"""
+    filters: Dict[str, List[str]] = {}
+    if interest:
+        filters["interests"] = interest
+    for item in filter:
+        key, sep, value = item.partition(":")
+        if not sep or not key:
+            raise HTTPException(status_code=400, detail=f"Invalid filter '{item}', expected key:value")
+        filters.setdefault(key, []).append(value)
+    
+    try:
+        companions, next_cursor, total = await companion_service.search_companions(
+            query=q, filters=filters, cursor=cursor, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error searching companions: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search companions")
+    
+    return CompanionSearchResponse(companions=companions, total=total, nextCursor=next_cursor)
+
 @app.post("/api/video/recordings", response_model=RecordingUpload)
+@traced("POST /api/video/recordings")
 async def upload_recording(
     recording_id: str,
     room_id: str,
@@ -163,6 +440,7 @@ async def upload_recording(
         raise HTTPException(status_code=500, detail="Failed to upload recording")
 
 @app.post("/api/chat/messages")
+@traced("POST /api/chat/messages")
 async def send_chat_message(message: ChatMessage):
     """Send chat message (REST fallback)"""
     try:
@@ -188,23 +466,106 @@ async def send_chat_message(message: ChatMessage):
 
 # Socket.IO Event Handlers
 @sio.event
-async def connect(sid, environ):
-    """Handle client connection"""
+async def connect(sid, environ, auth=None):
+    """Handle client connection; auth may carry a resumeToken to rejoin without a join event"""
+    if drain_controller.draining:
+        # The client retries with backoff and lands on another worker
+        raise SocketConnectionRefused("Server is draining", drain_controller.reconnect_hint())
     logger.info(f"Client {sid} connected")
     active_connections[sid] = {"connected_at": datetime.utcnow()}
+    if isinstance(auth, dict) and auth.get("resumeToken"):
+        await resume_session(sid, auth["resumeToken"])
 
 @sio.event
 async def disconnect(sid):
     """Handle client disconnection"""
     logger.info(f"Client {sid} disconnected")
+    speech_ingest.stop(sid, flush=False)
+    await close_relay_peer(sid, active_connections.get(sid, {}).get("roomId"))
+    # Tickets of a draining worker's waiters stay queued for the worker they reconnect to
+    await capacity_scheduler.unwatch(sid, cancel=not drain_controller.draining)
     if sid in active_connections:
         del active_connections[sid]
+    
+    # A dropped connection leaves its room after a grace period unless the user resumes meanwhile
+    presence_service.leave_later(sid, settings.SESSION_RESUME_GRACE_SECONDS, announce_departure)
+
+async def announce_departure(user_id: str, room_id: str, occupancy: Optional[int], memberships: Optional[int]) -> None:
+    if not memberships:
+        await sio.emit("user_left", {"userId": user_id, "occupancy": occupancy}, room=room_id)
+    if occupancy == 0:
+        await release_room(room_id)
+
+async def release_room(room_id: str) -> None:
+    """Free a room's companion session slot and in-memory quality state once nobody is left in it"""
+    media_adaptation_service.discard_room(room_id)
+    await telemetry_store.close_room(room_id)
+    await capacity_scheduler.release(room_id)
+
+async def enter_session(sid: str, room_id: str, user_id: str, role: UserRole, companion_id: str,
+                        room_expires_at: Optional[float]) -> Optional[Dict[str, Any]]:
+    """Put a connection in its room and announce it unless the user is already there; returns a resumption token"""
+    await sio.enter_room(sid, room_id)
+    await capacity_scheduler.claim(room_id)
+    active_connections[sid]["roomId"] = room_id
+    active_connections[sid]["userId"] = user_id
+    active_connections[sid]["role"] = role
+    active_connections[sid]["companionId"] = companion_id
+    occupancy, memberships = await presence_service.join(sid, user_id, room_id, companion_id)
+    
+    # Rejoins, resumed sessions and extra tabs of a user already in the room are not announced again
+    if memberships is None or memberships <= 1:
+        await sio.emit("user_joined", {
+            "userId": user_id,
+            "role": role,
+            "occupancy": occupancy
+        }, room=room_id, skip_sid=sid)
+    return session_tokens.issue(room_id, user_id, role.value, companion_id, room_expires_at)
+
+async def resume_session(sid: str, token: str) -> bool:
+    """Restore a connection's room membership and role from a resumption token and the room's status"""
+    claims = session_tokens.verify(token)
+    if claims is None:
+        await sio.emit("resume_failed", {"message": "Invalid or expired resumption token"}, room=sid)
+        return False
+    # One HGET, checked on whichever worker the client reconnects to
+    status = await redis_manager.get_room_status(claims["roomId"])
+    if status is None or RoomStatus(status) in TERMINAL_STATUSES:
+        await sio.emit("resume_failed", {"message": "Room not found or has ended"}, room=sid)
+        return False
+    session = await enter_session(sid, claims["roomId"], claims["userId"], UserRole(claims["role"]),
+                                  claims["companionId"], claims["expiresAt"])
+    await sio.emit("session_resumed", {
+        "roomId": claims["roomId"],
+        "userId": claims["userId"],
+        "role": claims["role"],
+        **session
+    }, room=sid)
+    logger.info(f"Client {sid} resumed session in room {claims['roomId']}")
+    return True
 
 @sio.event
+async def resume(sid, data):
+    """Rejoin a room with a resumption token instead of a full join"""
+    try:
+        resume_event = ResumeEvent(**data)
+        if drain_controller.draining:
+            await sio.emit("reconnect_advised", drain_controller.reconnect_hint(), room=sid)
+            return
+        await resume_session(sid, resume_event.token)
+    except Exception as e:
+        logger.error(f"Error in resume event: {e}")
+        await sio.emit("resume_failed", {"message": "Failed to resume session"}, room=sid)
+
+@sio.event
+@traced("sio.join")
 async def join(sid, data):
     """Handle join room event"""
     try:
         join_event = JoinEvent(**data)
+        if drain_controller.draining:
+            await sio.emit("reconnect_advised", drain_controller.reconnect_hint(), room=sid)
+            return
         logger.info(f"Client {sid} joining room {join_event.roomId}")
         
         # Verify room exists
@@ -212,18 +573,21 @@ async def join(sid, data):
         if not room:
             await sio.emit("error", {"message": "Room not found"}, room=sid)
             return
+        if room.status in TERMINAL_STATUSES:
+            await sio.emit("error", {"message": "Room has ended"}, room=sid)
+            return
         
-        # Join the room
-        await sio.enter_room(sid, join_event.roomId)
-        active_connections[sid]["roomId"] = join_event.roomId
-        active_connections[sid]["userId"] = join_event.userId
-        active_connections[sid]["role"] = join_event.role
+        # First join moves the room to waiting; later joins are only logged
+        event_details = {"userId": join_event.userId, "role": join_event.role.value}
+        if not (can_transition(room.status, RoomStatus.WAITING)
+                and await room_lifecycle.transition(join_event.roomId, RoomStatus.WAITING, "join", **event_details)):
+            await room_lifecycle.record_event(join_event.roomId, "join", **event_details)
         
-        # Notify others in the room
-        await sio.emit("user_joined", {
-            "userId": join_event.userId,
-            "role": join_event.role
-        }, room=join_event.roomId, skip_sid=sid)
+        # Join the room and hand out a token for resuming after a reconnect
+        session = await enter_session(sid, join_event.roomId, join_event.userId, join_event.role, room.companionId,
+                                      room.expiresAt.replace(tzinfo=timezone.utc).timestamp())
+        if session is not None:
+            await sio.emit("session_token", session, room=sid)
         
         logger.info(f"Client {sid} joined room {join_event.roomId}")
         
@@ -232,25 +596,32 @@ async def join(sid, data):
         await sio.emit("error", {"message": "Failed to join room"}, room=sid)
 
 @sio.event
+@traced("sio.offer")
 async def offer(sid, data):
     """Handle WebRTC offer"""
     try:
-        offer_event = OfferEvent(**data)
+        offer_event = FastOfferEvent.parse(data)
         logger.info(f"Offer from {offer_event.from_} in room {offer_event.roomId}")
         
+        sdp = offer_event.sdp
+        if settings.SDP_PIPELINE_ENABLED:
+            sdp = sdp_pipeline.process_for_room(offer_event.roomId, sdp)
+        
         # Store signaling data
         signal_data = {
             "type": "offer",
             "from": offer_event.from_,
-            "sdp": offer_event.sdp,
+            **history_fields(sdp),
             "timestamp": datetime.utcnow().isoformat()
         }
         await redis_manager.store_webrtc_signal(offer_event.roomId, signal_data)
+        await room_lifecycle.record_event(offer_event.roomId, "offer", userId=offer_event.from_)
+        drain_controller.negotiation_started(offer_event.roomId)
         
         # Forward to other clients in the room
         await sio.emit("offer", {
             "from": offer_event.from_,
-            "sdp": offer_event.sdp
+            "sdp": sdp
         }, room=offer_event.roomId, skip_sid=sid)
         
     except Exception as e:
@@ -258,25 +629,31 @@ async def offer(sid, data):
         await sio.emit("error", {"message": "Failed to handle offer"}, room=sid)
 
 @sio.event
+@traced("sio.answer")
 async def answer(sid, data):
     """Handle WebRTC answer"""
     try:
-        answer_event = AnswerEvent(**data)
+        answer_event = FastAnswerEvent.parse(data)
         logger.info(f"Answer from {answer_event.from_} in room {answer_event.roomId}")
         
+        sdp = answer_event.sdp
+        if settings.SDP_PIPELINE_ENABLED:
+            sdp = sdp_pipeline.process_for_room(answer_event.roomId, sdp)
+        
         # Store signaling data
         signal_data = {
             "type": "answer",
             "from": answer_event.from_,
-            "sdp": answer_event.sdp,
+            **history_fields(sdp),
             "timestamp": datetime.utcnow().isoformat()
         }
         await redis_manager.store_webrtc_signal(answer_event.roomId, signal_data)
+        await room_lifecycle.record_event(answer_event.roomId, "answer", userId=answer_event.from_)
         
         # Forward to other clients in the room
         await sio.emit("answer", {
             "from": answer_event.from_,
-            "sdp": answer_event.sdp
+            "sdp": sdp
         }, room=answer_event.roomId, skip_sid=sid)
         
     except Exception as e:
@@ -284,10 +661,11 @@ async def answer(sid, data):
         await sio.emit("error", {"message": "Failed to handle answer"}, room=sid)
 
 @sio.event
+@traced("sio.candidate")
 async def candidate(sid, data):
     """Handle WebRTC ICE candidate"""
     try:
-        candidate_event = CandidateEvent(**data)
+        candidate_event = FastCandidateEvent.parse(data)
         logger.info(f"ICE candidate from {candidate_event.from_} in room {candidate_event.roomId}")
         
         # Store signaling data
@@ -310,6 +688,55 @@ async def candidate(sid, data):
         await sio.emit("error", {"message": "Failed to handle candidate"}, room=sid)
 
 @sio.event
+@traced("sio.connected")
+async def connected(sid, data):
+    """Handle a client reporting its peer connection is established"""
+    try:
+        connection = active_connections.get(sid, {})
+        room_id = connection.get("roomId")
+        if not room_id:
+            return
+        if data.get("roomId", room_id) != room_id:
+            await sio.emit("error", {"message": "Not in this room"}, room=sid)
+            return
+        
+        drain_controller.negotiation_finished(room_id)
+        await room_lifecycle.transition(room_id, RoomStatus.CONNECTED, "connected", userId=connection.get("userId"))
+        
+    except Exception as e:
+        logger.error(f"Error in connected event: {e}")
+
+@sio.event
+async def stats(sid, data):
+    """Handle periodic WebRTC stats and push a new media profile when the tier changes"""
+    try:
+        stats_event = FastStatsEvent.parse(data)
+        if active_connections.get(sid, {}).get("roomId") != stats_event.roomId:
+            await sio.emit("error", {"message": "Not in this room"}, room=sid)
+            return
+        
+        telemetry_store.ingest(
+            stats_event.roomId,
+            stats_event.from_,
+            stats_event.rttMs,
+            stats_event.packetLoss,
+            stats_event.availableBitrateKbps
+        )
+        
+        profile = media_adaptation_service.record_stats(
+            stats_event.roomId,
+            stats_event.rttMs,
+            stats_event.packetLoss,
+            stats_event.availableBitrateKbps
+        )
+        if profile is not None:
+            await sio.emit("media_profile", profile, room=stats_event.roomId)
+        
+    except Exception as e:
+        logger.error(f"Error in stats event: {e}")
+
+@sio.event
+@traced("sio.leave")
 async def leave(sid, data):
     """Handle leave room event"""
     try:
@@ -319,80 +746,279 @@ async def leave(sid, data):
         # Leave the room
         await sio.leave_room(sid, leave_event.roomId)
         
-        # Notify others in the room
-        await sio.emit("user_left", {
-            "userId": leave_event.userId
-        }, room=leave_event.roomId, skip_sid=sid)
+        left = await presence_service.leave(sid)
+        
+        # Notify others in the room, unless the user is still there on another connection
+        if not (left and left[3]):
+            await sio.emit("user_left", {
+                "userId": leave_event.userId,
+                "occupancy": left[2] if left else None
+            }, room=leave_event.roomId, skip_sid=sid)
+        if left and left[2] == 0:
+            await release_room(leave_event.roomId)
         
         # Clean up connection data
         if sid in active_connections:
             active_connections[sid].pop("roomId", None)
             active_connections[sid].pop("userId", None)
             active_connections[sid].pop("role", None)
+            active_connections[sid].pop("companionId", None)
+        speech_ingest.stop(sid, flush=False)
+        await close_relay_peer(sid, leave_event.roomId)
         
     except Exception as e:
         logger.error(f"Error in leave event: {e}")
 
 @sio.event
+@traced("sio.end")
 async def end(sid, data):
     """Handle end call event"""
     try:
         end_event = EndEvent(**data)
         logger.info(f"Ending call in room {end_event.roomId}")
         
+        # Update room status; a room that already ended is not ended twice
+        if not await room_lifecycle.transition(end_event.roomId, RoomStatus.ENDED, "ended", reason=end_event.reason):
+            return
+        
         # Notify all clients in the room
         await sio.emit("call_ended", {
             "reason": end_event.reason
         }, room=end_event.roomId)
+        drain_controller.negotiation_finished(end_event.roomId)
+        await release_room(end_event.roomId)
         
-        # Update room status
-        await redis_manager.update_room_status(end_event.roomId, "inactive")
+        # Remember the conversation for the user's next call with this companion
+        room = await redis_manager.get_room(end_event.roomId)
+        if room:
+            context_store.close_room_later(room.roomId, room.userId, room.companionId)
         
     except Exception as e:
         logger.error(f"Error in end event: {e}")
 
 @sio.event
+async def capacity_wait(sid, data):
+    """Follow a queue ticket; progress arrives as capacity_queued until capacity_admitted"""
+    try:
+        wait_event = CapacityWaitEvent(**data)
+        if not await capacity_scheduler.watch(wait_event.ticketId, sid):
+            await sio.emit("capacity_dropped", {"ticketId": wait_event.ticketId}, room=sid)
+    except Exception as e:
+        logger.error(f"Error in capacity_wait event: {e}")
+        await sio.emit("error", {"message": "Failed to follow queue ticket"}, room=sid)
+
+async def notify_capacity(sid: str, event: str, payload: Dict[str, Any]) -> None:
+    await sio.emit(event, payload, room=sid)
+
+capacity_scheduler.notify = notify_capacity
+
+@sio.event
+async def presence_query(sid, data):
+    """Bulk presence lookup over the socket; answered with a presence event"""
+    try:
+        query = PresenceQuery(**data)
+        if len(query.userIds) + len(query.companionIds) + len(query.roomIds) > settings.PRESENCE_QUERY_MAX:
+            await sio.emit("error", {"message": f"At most {settings.PRESENCE_QUERY_MAX} ids per presence query"}, room=sid)
+            return
+        result = await presence_service.query(query.userIds, query.companionIds, query.roomIds)
+        await sio.emit("presence", result.model_dump(mode="json"), room=sid)
+    except Exception as e:
+        logger.error(f"Error in presence_query event: {e}")
+        await sio.emit("error", {"message": "Presence query failed"}, room=sid)
+
+async def post_chat_message(sid: str, room_id: str, sender: str, text: str) -> None:
+    """Store and broadcast a chat message, then let the room's companion answer it"""
+    message_data = {
+        "from": sender,
+        "text": text,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    await redis_manager.store_chat_message(room_id, message_data)
+    
+    # Broadcast to all clients in the room
+    await sio.emit("message", message_data, room=room_id)
+    
+    connection = active_connections.get(sid, {})
+    companion_id = connection.get("companionId")
+    # The context role follows the connection's joined role, never the client-supplied sender
+    from_companion = connection.get("role") == UserRole.COMPANION
+    if companion_id:
+        await context_store.append(room_id, "model" if from_companion else "user", text)
+    
+    # Let the room's companion answer, streaming tokens to the room
+    if reply_engine.enabled and companion_id and not from_companion:
+        companion = await services.get("companion_service").get_companion_by_id(companion_id)
+        if companion:
+            async def emit_to_room(event: str, payload: Dict[str, Any]) -> None:
+                await sio.emit(event, payload, room=room_id)
+            
+            if not reply_engine.submit(room_id, active_connections[sid].get("userId"), companion, emit_to_room):
+                await sio.emit("companion_reply_error", {
+                    "companionId": companion_id,
+                    "message": "Companion is busy, try again shortly"
+                }, room=sid)
+
+@sio.event
+@traced("sio.message")
 async def message(sid, data):
     """Handle chat message"""
     try:
         logger.info(f"Chat message from {sid}")
         
-        # Store message
-        message_data = {
-            "from": data.get("from", "unknown"),
-            "text": data.get("text", ""),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
         room_id = active_connections.get(sid, {}).get("roomId")
         if room_id:
-            await redis_manager.store_chat_message(room_id, message_data)
-            
-            # Broadcast to all clients in the room
-            await sio.emit("message", message_data, room=room_id)
+            await post_chat_message(sid, room_id, data.get("from", "unknown"), data.get("text", ""))
         
     except Exception as e:
         logger.error(f"Error in message event: {e}")
 
-# Startup and shutdown events
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    logger.info("Starting AI Companion Video Call API")
-    logger.info(f"Redis URL: {settings.REDIS_URL}")
-    logger.info(f"CORS Origins: {settings.CORS_ORIGINS}")
+def open_speech_stream(sid: str, room_id: str, sample_rate: int, frame_ms: int) -> None:
+    """Start transcribing a connection's audio into the room's chat"""
+    user_id = active_connections.get(sid, {}).get("userId", "unknown")
+    
+    async def on_transcript(text: str, duration_ms: int) -> None:
+        await sio.emit("transcript", {"userId": user_id, "text": text, "durationMs": duration_ms}, room=room_id)
+        if active_connections.get(sid, {}).get("roomId") == room_id:
+            await post_chat_message(sid, room_id, user_id, text)
+    
+    speech_ingest.start(sid, room_id, user_id, sample_rate, frame_ms, on_transcript)
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    logger.info("Shutting down AI Companion Video Call API")
-    await companion_service.close()
+@sio.event
+async def audio_start(sid, data):
+    """Open a speech stream: 16-bit mono PCM frames follow as audio_frame events"""
+    try:
+        start_event = AudioStartEvent(**data)
+        connection = active_connections.get(sid, {})
+        if not speech_ingest.enabled or connection.get("roomId") != start_event.roomId:
+            await sio.emit("error", {"message": "Audio ingest unavailable"}, room=sid)
+            return
+        
+        open_speech_stream(sid, start_event.roomId, start_event.sampleRate, start_event.frameMs)
+        logger.info(f"Audio stream from {sid} in room {start_event.roomId} ({start_event.sampleRate} Hz, {start_event.frameMs} ms frames)")
+        
+    except Exception as e:
+        logger.error(f"Error in audio_start event: {e}")
+        await sio.emit("error", {"message": "Failed to start audio"}, room=sid)
+
+@sio.event
+async def audio_frame(sid, data):
+    """One audio frame, {"seq": n, "data": <binary PCM>}; kept free of validation and logging"""
+    try:
+        speech_ingest.push(sid, data["seq"], data["data"])
+    except (KeyError, TypeError, ValueError):
+        pass
+
+@sio.event
+async def audio_stop(sid, data=None):
+    """Close the speech stream, transcribing any utterance still open"""
+    speech_ingest.stop(sid)
+
+@sio.event
+@traced("sio.relay_offer")
+async def relay_offer(sid, data):
+    """Terminate the client's media on the server relay when peer-to-peer fails"""
+    try:
+        offer_event = RelayDescriptionEvent(**data)
+        if not media_relay.running or active_connections.get(sid, {}).get("roomId") != offer_event.roomId:
+            await sio.emit("error", {"message": "Media relay unavailable"}, room=sid)
+            return
+        
+        tap_audio = settings.MEDIA_RELAY_TAP_AUDIO and speech_ingest.enabled
+        answer_sdp = await media_relay.offer(offer_event.roomId, sid, offer_event.sdp, tap_audio)
+        if tap_audio:
+            open_speech_stream(sid, offer_event.roomId, TAP_SAMPLE_RATE, TAP_FRAME_MS)
+        await room_lifecycle.record_event(offer_event.roomId, "relay", userId=active_connections[sid].get("userId"))
+        await sio.emit("relay_answer", {"sdp": answer_sdp}, room=sid)
+        
+    except Exception as e:
+        logger.error(f"Error in relay_offer event: {e}")
+        await sio.emit("error", {"message": "Failed to set up media relay"}, room=sid)
+
+@sio.event
+async def relay_update_answer(sid, data):
+    """Client's answer to a relay_update offer (the relay adding or changing tracks)"""
+    try:
+        answer_event = RelayDescriptionEvent(**data)
+        await media_relay.answer(answer_event.roomId, sid, answer_event.sdp)
+    except Exception as e:
+        logger.error(f"Error in relay_update_answer event: {e}")
+
+def on_relay_audio(room_id: str, sid: str, seq: int, data: bytes) -> None:
+    """Feed audio tapped by the relay into the connection's speech stream, frame by frame"""
+    view = memoryview(data)
+    for offset in range(0, len(view), TAP_FRAME_BYTES):
+        speech_ingest.push(sid, seq + offset // TAP_FRAME_BYTES, view[offset:offset + TAP_FRAME_BYTES])
+
+async def on_relay_offer(room_id: str, sid: str, sdp: str) -> None:
+    await sio.emit("relay_update", {"sdp": sdp}, room=sid)
+
+async def on_relay_closed(room_id: str, sid: str) -> None:
+    speech_ingest.stop(sid)
+    await sio.emit("relay_closed", {"roomId": room_id}, room=sid)
+
+media_relay.on_audio = on_relay_audio
+media_relay.on_offer = on_relay_offer
+media_relay.on_closed = on_relay_closed
+
+async def close_relay_peer(sid: str, room_id: Optional[str]) -> None:
+    if media_relay.running and room_id:
+        try:
+            await media_relay.close_peer(room_id, sid)
+        except Exception as e:
+            logger.error(f"Failed to close relay peer {sid}: {e}")
+
+async def drain_worker(deadline_seconds: Optional[float] = None) -> None:
+    """Move this worker's clients elsewhere before it stops.
+    
+    New connections and joins are refused from here on. Every client is sent
+    reconnect_advised with a jittered delay, except those of rooms still
+    exchanging offer/answer, which are told once the exchange completes.
+    Clients still connected at the deadline are disconnected, and buffered
+    Redis writes are flushed.
+    """
+    if not drain_controller.start(deadline_seconds):
+        return
+    logger.info(f"Draining {len(active_connections)} connections, deadline {drain_controller.remaining():.0f}s")
+    await capacity_scheduler.stop()
+    
+    advised = set()
+    while active_connections and drain_controller.remaining() > 0:
+        for sid, connection in list(active_connections.items()):
+            if sid not in advised and not drain_controller.is_negotiating(connection.get("roomId")):
+                advised.add(sid)
+                await sio.emit("reconnect_advised", drain_controller.reconnect_hint(), room=sid)
+        await asyncio.sleep(0.1)
+    
+    for sid in list(active_connections):
+        await sio.disconnect(sid)
+    await telemetry_store.flush()
+    await context_store.close()
+    logger.info(f"Drain finished, {len(advised)} clients advised to reconnect")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "main:app",
-        host=settings.HOST,
-        port=settings.PORT,
-        reload=settings.DEBUG
-    )
+    if settings.WORKERS == 1:
+        import uvicorn
+        uvicorn.run(
+            "main:socket_app",
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=settings.DEBUG,
+            **websocket_options()
+        )
+    else:
+        if settings.MEDIA_RELAY_ENABLED:
+            raise SystemExit("MEDIA_RELAY_ENABLED requires WORKERS=1: relayed peers of one call must share a process")
+        from utils.worker_pool import WorkerPool
+        pool = WorkerPool(
+            settings.HOST,
+            settings.PORT,
+            workers=settings.WORKERS,
+            routing=settings.WORKER_ROUTING,
+            heartbeat_interval=settings.WORKER_HEARTBEAT_SECONDS,
+            heartbeat_timeout=settings.WORKER_HEARTBEAT_TIMEOUT_SECONDS,
+            startup_timeout=settings.WORKER_STARTUP_TIMEOUT_SECONDS,
+            backoff_max=settings.WORKER_RESTART_BACKOFF_MAX_SECONDS,
+            # Workers drain on SIGTERM before exiting
+            shutdown_timeout=settings.DRAIN_DEADLINE_SECONDS + 10
+        )
+        raise SystemExit(pool.run())
@@ -4,9 +4,14 @@ from datetime import datetime
 from enum import Enum
 
 class RoomStatus(str, Enum):
+    CREATED = "created"
+    WAITING = "waiting"
+    CONNECTED = "connected"
+    ENDED = "ended"
+    EXPIRED = "expired"
+    # Legacy statuses of rooms created before the lifecycle engine
     ACTIVE = "active"
     INACTIVE = "inactive"
-    EXPIRED = "expired"
 
 class UserRole(str, Enum):
     USER = "user"
@@ -17,9 +22,37 @@ class VideoRoom(BaseModel):
     companionId: str
     userId: str
     expiresAt: datetime
-    status: RoomStatus = RoomStatus.ACTIVE
+    status: RoomStatus = RoomStatus.CREATED
     createdAt: datetime = Field(default_factory=datetime.utcnow)
 
+class QueueTicket(BaseModel):
+    ticketId: str
+    companionId: str
+    position: int  # 0 = next in line
+    estimatedWaitSeconds: int
+
+class CapacityWaitEvent(BaseModel):
+    ticketId: str
+
+class BulkRoomItem(BaseModel):
+    companionId: str
+    userId: str
+    expireMinutes: int = Field(default=60, ge=1)
+
+class BulkRoomRequest(BaseModel):
+    rooms: List[BulkRoomItem]
+
+class BulkRoomResult(BaseModel):
+    index: int
+    status: str  # "created" or "failed"
+    room: Optional[VideoRoom] = None
+    error: Optional[str] = None
+
+class BulkRoomResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkRoomResult]
+
 class RoomInfo(BaseModel):
     roomId: str
     status: RoomStatus
@@ -39,6 +72,11 @@ class Companion(BaseModel):
 class CompanionsResponse(BaseModel):
     companions: List[Companion]
 
+class CompanionSearchResponse(BaseModel):
+    companions: List[Companion]
+    total: int
+    nextCursor: Optional[str] = None
+
 class ChatMessage(BaseModel):
     roomId: str
     from_: str = Field(alias="from")
@@ -56,6 +94,9 @@ class JoinEvent(BaseModel):
     userId: str
     role: UserRole
 
+class ResumeEvent(BaseModel):
+    token: str  # from the session_token event of an earlier join
+
 class OfferEvent(BaseModel):
     roomId: str
     from_: str = Field(alias="from")
@@ -71,6 +112,43 @@ class CandidateEvent(BaseModel):
     from_: str = Field(alias="from")
     candidate: Dict[str, Any]
 
+class StatsEvent(BaseModel):
+    roomId: str
+    from_: str = Field(alias="from")
+    # Metrics the client could not measure are left out rather than sent as 0
+    rttMs: Optional[float] = Field(default=None, ge=0)
+    packetLoss: Optional[float] = Field(default=None, ge=0, le=1)  # fraction of packets lost
+    availableBitrateKbps: Optional[float] = Field(default=None, ge=0)
+
+class AudioStartEvent(BaseModel):
+    roomId: str
+    sampleRate: int = Field(default=16000, ge=8000, le=48000)  # 16-bit mono PCM
+    frameMs: int = Field(default=20, ge=10, le=100)
+
+class RelayDescriptionEvent(BaseModel):
+    roomId: str
+    sdp: str  # complete (non-trickle) SDP; the relay does not take separate candidates
+
+class PresenceQuery(BaseModel):
+    userIds: List[str] = Field(default_factory=list)
+    companionIds: List[str] = Field(default_factory=list)
+    roomIds: List[str] = Field(default_factory=list)
+
+class UserPresence(BaseModel):
+    online: bool
+    connections: int
+    lastSeen: Optional[datetime] = None
+
+class CompanionPresence(BaseModel):
+    inCall: bool
+    participants: int  # connections currently in rooms with this companion
+    lastSeen: Optional[datetime] = None
+
+class PresenceResponse(BaseModel):
+    users: Dict[str, UserPresence]
+    companions: Dict[str, CompanionPresence]
+    rooms: Dict[str, int]  # occupancy
+
 class LeaveEvent(BaseModel):
     roomId: str
     userId: str
@@ -78,3 +156,112 @@ class LeaveEvent(BaseModel):
 class EndEvent(BaseModel):
     roomId: str
     reason: Optional[str] = None
+
+# Hot-path signaling events
+#
+# offer/answer/candidate/stats arrive many times per call, so their handlers
+# parse into these slotted classes with hand-written checks instead of
+# validating a Pydantic model per event. Each accepts the same input as the
+# Pydantic model it mirrors (extra keys ignored, the same lax coercions) and
+# raises ValueError where that model raises ValidationError.
+
+def _required(data: Dict[str, Any], key: str) -> Any:
+    try:
+        return data[key]
+    except KeyError:
+        raise ValueError(f"{key}: field required") from None
+    except TypeError:
+        raise ValueError(f"event payload must be an object, got {type(data).__name__}") from None
+
+def _str_field(data: Dict[str, Any], key: str) -> str:
+    value = _required(data, key)
+    if type(value) is str:
+        return value
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    raise ValueError(f"{key}: input should be a valid string")
+
+def _optional_float_field(data: Dict[str, Any], key: str, low: float, high: Optional[float] = None) -> Optional[float]:
+    value = data.get(key)
+    if value is None:
+        return None
+    if type(value) is not float:
+        try:
+            if isinstance(value, (bytes, bytearray)):
+                value = value.decode("utf-8")
+            if not isinstance(value, (int, float, str)):
+                raise TypeError
+            value = float(value)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValueError(f"{key}: input should be a valid number") from None
+    # Written so NaN fails the bounds like it does in Pydantic
+    if not value >= low or (high is not None and not value <= high):
+        raise ValueError(f"{key}: input should be between {low} and {high}" if high is not None
+                         else f"{key}: input should be greater than or equal to {low}")
+    return value
+
+class FastOfferEvent:
+    """Fast-path form of OfferEvent"""
+    
+    __slots__ = ("roomId", "from_", "sdp")
+    
+    def __init__(self, roomId: str, from_: str, sdp: str):
+        self.roomId = roomId
+        self.from_ = from_
+        self.sdp = sdp
+    
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> "FastOfferEvent":
+        return cls(_str_field(data, "roomId"), _str_field(data, "from"), _str_field(data, "sdp"))
+
+class FastAnswerEvent(FastOfferEvent):
+    """Fast-path form of AnswerEvent"""
+    
+    __slots__ = ()
+
+class FastCandidateEvent:
+    """Fast-path form of CandidateEvent"""
+    
+    __slots__ = ("roomId", "from_", "candidate")
+    
+    def __init__(self, roomId: str, from_: str, candidate: Dict[str, Any]):
+        self.roomId = roomId
+        self.from_ = from_
+        self.candidate = candidate
+    
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> "FastCandidateEvent":
+        candidate = _required(data, "candidate")
+        if type(candidate) is not dict:
+            if not isinstance(candidate, dict):
+                raise ValueError("candidate: input should be a valid dictionary")
+            candidate = dict(candidate)
+        return cls(_str_field(data, "roomId"), _str_field(data, "from"), candidate)
+
+class FastStatsEvent:
+    """Fast-path form of StatsEvent"""
+    
+    __slots__ = ("roomId", "from_", "rttMs", "packetLoss", "availableBitrateKbps")
+    
+    def __init__(self, roomId: str, from_: str, rttMs: Optional[float] = None, packetLoss: Optional[float] = None,
+                 availableBitrateKbps: Optional[float] = None):
+        self.roomId = roomId
+        self.from_ = from_
+        self.rttMs = rttMs
+        self.packetLoss = packetLoss
+        self.availableBitrateKbps = availableBitrateKbps
+    
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> "FastStatsEvent":
+        return cls(
+            _str_field(data, "roomId"),
+            _str_field(data, "from"),
+            _optional_float_field(data, "rttMs", 0.0),
+            _optional_float_field(data, "packetLoss", 0.0, 1.0),
+            _optional_float_field(data, "availableBitrateKbps", 0.0)
+        )
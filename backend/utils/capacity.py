@@ -0,0 +1,242 @@
+import math
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from config import settings
+from models import Companion, VideoRoom, QueueTicket
+from utils.redis_manager import redis_manager, new_room_ids
+
+logger = logging.getLogger(__name__)
+
+# Sends one event with its payload to a waiting client's socket
+Notify = Callable[[str, str, Dict[str, Any]], Awaitable[None]]
+
+class CapacityScheduler:
+    """Admits companion sessions within per-companion and per-worker limits.
+    
+    Every admission is one Lua call on Redis that checks the companion's
+    session count, reserves the slot on the least-loaded live worker from a
+    sorted set and takes it, so decisions are O(log n) and consistent across
+    workers. Connections are not routed by that choice, so when a room's
+    socket joins, claim() moves the session's load to the worker actually
+    holding it.
+    Requests that do not fit get a ticket in the companion's FIFO queue; the
+    worker holding the waiter's socket retries it every poll and pushes its
+    position and estimated wait until it is admitted.
+    """
+    
+    def __init__(self, companion_limit: int = 0, worker_limit: int = 0, session_seconds: float = 600.0,
+                 queue_max: int = 500, poll_interval: float = 1.0, stale_seconds: float = 15.0, worker_ttl: int = 30):
+        self.worker_id = uuid.uuid4().hex
+        self.companion_limit = companion_limit
+        self.worker_limit = worker_limit
+        self.session_seconds = session_seconds
+        self.queue_max = queue_max
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.worker_ttl = worker_ttl
+        self.notify: Optional[Notify] = None
+        # ticketId -> (sid, ticket details, last pushed position) for waiters on this worker
+        self.waiters: Dict[str, Tuple[str, Dict[str, Any], Optional[int]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+    
+    def limit_for(self, companion: Companion) -> int:
+        """Session limit of a companion; metadata.maxSessions overrides the default (0 = unlimited)"""
+        metadata = companion.metadata or {}
+        try:
+            return int(metadata.get("maxSessions", self.companion_limit))
+        except (TypeError, ValueError):
+            return self.companion_limit
+    
+    async def request_room(self, companion: Companion, user_id: str,
+                           expire_minutes: int = 60) -> Union[VideoRoom, QueueTicket, None]:
+        """Create a room if the companion has capacity, else queue a ticket; None if the queue is full"""
+        ticket_id = uuid.uuid4().hex
+        ticket = {
+            "companionId": companion.id,
+            "userId": user_id,
+            "expireMinutes": expire_minutes,
+            "limit": self.limit_for(companion)
+        }
+        outcome = await self._admit(ticket_id, ticket, fresh=True)
+        if outcome is None:
+            self.rejected += 1
+            return None
+        if isinstance(outcome, QueueTicket):
+            self.queued += 1
+        return outcome
+    
+    async def request_rooms(self, requests: List[Tuple[Companion, str, int]]) -> List[Union[VideoRoom, Exception, None]]:
+        """Create rooms for (companion, userId, expireMinutes) requests that fit now, without queueing.
+        
+        Every room takes a session slot like request_room, all admissions in
+        one pipeline. Returns per request the room, None if the companion or
+        every worker is at capacity (or others are queued for it), or the
+        error creating the room.
+        """
+        room_ids = new_room_ids(len(requests))
+        now = time.time()
+        results = await redis_manager.admit_sessions([
+            (room_id, companion.id, now + expire_minutes * 60, self.limit_for(companion))
+            for room_id, (companion, _, expire_minutes) in zip(room_ids, requests)
+        ], self.worker_limit, now - self.stale_seconds)
+        
+        outcomes: List[Union[VideoRoom, Exception, None]] = [
+            result if isinstance(result, Exception) else None for result in results
+        ]
+        admitted = [index for index, result in enumerate(results) if not isinstance(result, Exception) and result[0] == 1]
+        created = await redis_manager.create_rooms(
+            [(requests[index][0].id, requests[index][1], requests[index][2]) for index in admitted],
+            room_ids=[room_ids[index] for index in admitted]
+        ) if admitted else []
+        for index, outcome in zip(admitted, created):
+            outcomes[index] = outcome
+            if isinstance(outcome, Exception):
+                await self.release(room_ids[index])
+        
+        self.admitted += sum(1 for outcome in outcomes if isinstance(outcome, VideoRoom))
+        self.rejected += sum(1 for outcome in outcomes if outcome is None)
+        return outcomes
+    
+    async def _admit(self, ticket_id: str, ticket: Dict[str, Any], fresh: bool) -> Union[VideoRoom, QueueTicket, None]:
+        room_id = str(uuid.uuid4())
+        now = time.time()
+        result = await redis_manager.admit_session(
+            room_id, ticket["companionId"], now + ticket["expireMinutes"] * 60, ticket["limit"], self.worker_limit,
+            ticket_id, ticket if fresh else None, now - self.stale_seconds, self.queue_max
+        )
+        if result[0] == 1:
+            self.admitted += 1
+            try:
+                return await redis_manager.create_room(ticket["companionId"], ticket["userId"], ticket["expireMinutes"],
+                                                       room_id=room_id)
+            except Exception:
+                await redis_manager.release_session(room_id)
+                raise
+        if result[0] == 0:
+            return QueueTicket(
+                ticketId=ticket_id,
+                companionId=ticket["companionId"],
+                position=result[1],
+                estimatedWaitSeconds=self.estimate_wait(result[1], ticket["limit"], result[2])
+            )
+        return None
+    
+    def estimate_wait(self, position: int, limit: int, average_seconds: Optional[str]) -> int:
+        """Seconds until position + 1 of the companion's sessions have ended"""
+        average = float(average_seconds) if average_seconds else self.session_seconds
+        return math.ceil((position + 1) * average / max(1, limit))
+    
+    async def release(self, room_id: str) -> None:
+        """Free the session slot held by a room"""
+        try:
+            companion_id = await redis_manager.release_session(room_id)
+            if companion_id:
+                logger.info(f"Released session of companion {companion_id} in room {room_id}")
+        except Exception as e:
+            logger.error(f"Failed to release session of room {room_id}: {e}")
+    
+    async def claim(self, room_id: str) -> None:
+        """Count a room's session against this worker, which holds a socket joined to it"""
+        try:
+            await redis_manager.claim_session(room_id, self.worker_id)
+        except Exception as e:
+            logger.error(f"Failed to claim session of room {room_id}: {e}")
+    
+    async def watch(self, ticket_id: str, sid: str) -> bool:
+        """Push a queued ticket's progress to a socket; False if the ticket is unknown"""
+        ticket = await redis_manager.get_capacity_ticket(ticket_id)
+        if ticket is None:
+            return False
+        self.waiters[ticket_id] = (sid, ticket, None)
+        await self._poll(ticket_id)
+        return True
+    
+    async def unwatch(self, sid: str, cancel: bool = True) -> None:
+        """Stop following a disconnected socket's tickets, giving up their queue places unless cancel is False"""
+        for ticket_id, (waiter_sid, ticket, _) in list(self.waiters.items()):
+            if waiter_sid == sid:
+                del self.waiters[ticket_id]
+                if cancel:
+                    await redis_manager.cancel_capacity_ticket(ticket_id, ticket["companionId"])
+    
+    async def _poll(self, ticket_id: str) -> None:
+        sid, ticket, last_position = self.waiters[ticket_id]
+        try:
+            outcome = await self._admit(ticket_id, ticket, fresh=False)
+        except Exception as e:
+            logger.error(f"Failed to admit ticket {ticket_id}: {e}")
+            return
+        if isinstance(outcome, QueueTicket):
+            if outcome.position != last_position:
+                self.waiters[ticket_id] = (sid, ticket, outcome.position)
+                await self._notify(sid, "capacity_queued", outcome.model_dump())
+            return
+        self.waiters.pop(ticket_id, None)
+        if outcome is None:
+            await self._notify(sid, "capacity_dropped", {"ticketId": ticket_id})
+        else:
+            await self._notify(sid, "capacity_admitted", {"ticketId": ticket_id, "room": outcome.model_dump(mode="json")})
+    
+    async def _notify(self, sid: str, event: str, payload: Dict[str, Any]) -> None:
+        if self.notify is not None:
+            await self.notify(sid, event, payload)
+    
+    async def stats(self) -> Dict[str, Any]:
+        """Limits, worker loads and this worker's admission counters"""
+        return {
+            "workerId": self.worker_id,
+            "companionLimit": self.companion_limit,
+            "workerLimit": self.worker_limit,
+            "workers": [{"workerId": worker, "sessions": int(load)} for worker, load in await redis_manager.get_capacity_workers()],
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected
+        }
+    
+    def start(self) -> None:
+        """Register this worker for placement and start serving its queue waiters"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await redis_manager.remove_capacity_worker(self.worker_id)
+        except Exception as e:
+            logger.error(f"Failed to deregister worker {self.worker_id}: {e}")
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await redis_manager.heartbeat_capacity_worker(self.worker_id, self.worker_ttl)
+                # Order does not matter here: the queue in Redis only lets its head through
+                for ticket_id in list(self.waiters):
+                    if ticket_id in self.waiters:
+                        await self._poll(ticket_id)
+            except Exception as e:
+                logger.error(f"Capacity scheduler poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+# Global capacity scheduler instance
+capacity_scheduler = CapacityScheduler(
+    companion_limit=settings.CAPACITY_COMPANION_SESSIONS,
+    worker_limit=settings.CAPACITY_WORKER_SESSIONS,
+    session_seconds=settings.CAPACITY_SESSION_SECONDS,
+    queue_max=settings.CAPACITY_QUEUE_MAX,
+    poll_interval=settings.CAPACITY_POLL_SECONDS,
+    stale_seconds=settings.CAPACITY_WAITER_STALE_SECONDS,
+    worker_ttl=settings.CAPACITY_WORKER_TTL_SECONDS
+)
@@ -0,0 +1,64 @@
+import os
+import gzip
+import json
+import time
+import logging
+import tempfile
+from typing import List, Optional, Tuple
+from models import Companion
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+def save_snapshot(path: str, companions: List[Companion]) -> None:
+    """Atomically write the catalog to a gzipped compact JSON snapshot"""
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "savedAt": time.time(),
+        "companions": [companion.model_dump(exclude_none=True) for companion in companions]
+    }
+    data = gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    # Write to a temp file in the same directory, then rename over the target
+    fd, tmp_path = tempfile.mkstemp(prefix=".catalog-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    logger.info(f"Saved catalog snapshot with {len(companions)} companions to {path} ({len(data)} bytes)")
+
+def load_snapshot(path: str) -> Optional[Tuple[List[Companion], float]]:
+    """Load a snapshot, returning (companions, saved_at) or None if unusable"""
+    try:
+        with open(path, "rb") as snapshot_file:
+            payload = json.loads(gzip.decompress(snapshot_file.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable catalog snapshot {path}: {e}")
+        return None
+
+    if payload.get("version") != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring catalog snapshot {path} with version {payload.get('version')}")
+        return None
+
+    try:
+        companions = [Companion(**item) for item in payload["companions"]]
+    except Exception as e:
+        logger.warning(f"Ignoring invalid catalog snapshot {path}: {e}")
+        return None
+
+    return companions, float(payload.get("savedAt", 0))
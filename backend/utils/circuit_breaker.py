@@ -0,0 +1,65 @@
+import time
+import logging
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open"""
+
+class CircuitBreaker:
+    """Failure-counting circuit breaker for upstream calls.
+
+    The circuit opens after `failure_threshold` consecutive failures and
+    rejects calls until `reset_timeout` seconds have passed. It then lets up
+    to `half_open_max_calls` probe calls through; a successful probe closes
+    the circuit, a failed one opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go through, moving to half-open when due"""
+        if self.state == CircuitState.CLOSED:
+            return True
+
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            logger.info(f"Circuit {self.name} half-open, probing upstream")
+            self.state = CircuitState.HALF_OPEN
+            self._half_open_calls = 0
+
+        if self._half_open_calls >= self.half_open_max_calls:
+            return False
+        self._half_open_calls += 1
+        return True
+
+    def record_success(self) -> None:
+        """Record a successful call"""
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the circuit when the threshold is hit"""
+        self.failures += 1
+        if self.state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logger.warning(f"Circuit {self.name} opened after {self.failures} failures")
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
@@ -0,0 +1,212 @@
+import re
+import base64
+import logging
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Set, Tuple, Iterable
+from models import Companion
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Companion fields covered by full-text search
+TEXT_FIELDS = ("name", "description", "personality")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase search tokens"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def encode_cursor(companion_id: str) -> str:
+    """Encode the last returned companion id as an opaque cursor"""
+    return base64.urlsafe_b64encode(companion_id.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """Decode a cursor produced by encode_cursor"""
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        return base64.b64decode(cursor + padding, altchars=b"-_", validate=True).decode()
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class CompanionIndex:
+    """In-memory inverted indexes over the companion catalog"""
+
+    def __init__(self):
+        self.companions: Dict[str, Companion] = {}
+        self._fingerprints: Dict[str, int] = {}
+        self._sorted_ids: List[str] = []
+        # token -> companion ids containing it
+        self._postings: Dict[str, Set[str]] = {}
+        # sorted vocabulary for prefix lookups
+        self._vocabulary: List[str] = []
+        # metadata key -> value -> companion ids
+        self._metadata: Dict[str, Dict[str, Set[str]]] = {}
+        # companion id -> (tokens, metadata pairs) for removal
+        self._doc_terms: Dict[str, Tuple[Set[str], Set[Tuple[str, str]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.companions)
+
+    def get(self, companion_id: str) -> Optional[Companion]:
+        """Look up a companion by id"""
+        return self.companions.get(companion_id)
+
+    def all(self) -> List[Companion]:
+        """Every indexed companion, ordered by id"""
+        return [self.companions[companion_id] for companion_id in self._sorted_ids]
+
+    def update(self, companions: Iterable[Companion]) -> Tuple[int, int]:
+        """Incrementally sync the index with a fresh catalog.
+
+        Only companions that were added, changed or removed are re-indexed.
+        Returns the number of (indexed, removed) companions.
+        """
+        seen: Set[str] = set()
+        indexed = 0
+        for companion in companions:
+            if not companion.id or companion.id in seen:
+                continue
+            seen.add(companion.id)
+
+            fingerprint = hash(companion.model_dump_json())
+            if self._fingerprints.get(companion.id) == fingerprint:
+                continue
+
+            if companion.id in self.companions:
+                self._remove(companion.id)
+            self._add(companion, fingerprint)
+            indexed += 1
+
+        stale = [companion_id for companion_id in self.companions if companion_id not in seen]
+        for companion_id in stale:
+            self._remove(companion_id)
+
+        if indexed or stale:
+            logger.info(f"Companion index updated: {indexed} indexed, {len(stale)} removed, {len(self)} total")
+        return indexed, len(stale)
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        filters: Optional[Dict[str, List[str]]] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[Companion], Optional[str], int]:
+        """Search the catalog.
+
+        Every query token must match; the last token also matches as a prefix
+        so partially typed words find results. Filters match metadata values,
+        any of the values within a key and all of the keys. Results are ordered
+        by companion id and paged with an opaque cursor.
+
+        Returns (page, next_cursor, total_matches).
+        """
+        candidates = self._match(query, filters)
+
+        if candidates is None:
+            ordered = self._sorted_ids
+        else:
+            ordered = sorted(candidates)
+
+        start = 0
+        if cursor:
+            start = bisect_right(ordered, decode_cursor(cursor))
+
+        page_ids = ordered[start:start + limit]
+        next_cursor = None
+        if page_ids and start + limit < len(ordered):
+            next_cursor = encode_cursor(page_ids[-1])
+
+        return [self.companions[companion_id] for companion_id in page_ids], next_cursor, len(ordered)
+
+    def _match(self, query: Optional[str], filters: Optional[Dict[str, List[str]]]) -> Optional[Set[str]]:
+        """Resolve query and filters to a candidate id set (None means everything)"""
+        candidates: Optional[Set[str]] = None
+
+        tokens = tokenize(query)
+        for position, token in enumerate(tokens):
+            if position == len(tokens) - 1:
+                matches = self._prefix_postings(token)
+            else:
+                matches = self._postings.get(token, set())
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return set()
+
+        for key, values in (filters or {}).items():
+            value_index = self._metadata.get(key.lower(), {})
+            value_matches: Set[str] = set()
+            for value in values:
+                value_matches |= value_index.get(value.lower(), set())
+            candidates = value_matches if candidates is None else candidates & value_matches
+            if not candidates:
+                return set()
+
+        return candidates
+
+    def _prefix_postings(self, prefix: str) -> Set[str]:
+        """Union of postings for every vocabulary token starting with prefix"""
+        matches: Set[str] = set()
+        position = bisect_left(self._vocabulary, prefix)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(prefix):
+            matches |= self._postings[self._vocabulary[position]]
+            position += 1
+        return matches
+
+    def _add(self, companion: Companion, fingerprint: int) -> None:
+        """Index a single companion"""
+        tokens: Set[str] = set()
+        for field in TEXT_FIELDS:
+            tokens.update(tokenize(getattr(companion, field)))
+
+        metadata_pairs: Set[Tuple[str, str]] = set()
+        for key, value in (companion.metadata or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            for item in values:
+                if item is None or isinstance(item, dict):
+                    continue
+                metadata_pairs.add((key.lower(), str(item).lower()))
+
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._vocabulary, token)
+            postings.add(companion.id)
+
+        for key, value in metadata_pairs:
+            self._metadata.setdefault(key, {}).setdefault(value, set()).add(companion.id)
+
+        self.companions[companion.id] = companion
+        self._fingerprints[companion.id] = fingerprint
+        self._doc_terms[companion.id] = (tokens, metadata_pairs)
+        insort(self._sorted_ids, companion.id)
+
+    def _remove(self, companion_id: str) -> None:
+        """Drop a single companion from every index"""
+        tokens, metadata_pairs = self._doc_terms.pop(companion_id)
+
+        for token in tokens:
+            postings = self._postings[token]
+            postings.discard(companion_id)
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+        for key, value in metadata_pairs:
+            value_index = self._metadata[key]
+            value_index[value].discard(companion_id)
+            if not value_index[value]:
+                del value_index[value]
+            if not value_index:
+                del self._metadata[key]
+
+        del self.companions[companion_id]
+        del self._fingerprints[companion_id]
+        del self._sorted_ids[bisect_left(self._sorted_ids, companion_id)]
@@ -0,0 +1,332 @@
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import importlib.util
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from config import settings
+from models import Companion
+from utils.redis_manager import redis_manager
+from utils.context_store import context_store
+from utils.tts_relay import SpeechStream, tts_relay
+
+logger = logging.getLogger(__name__)
+
+# Emits one event with its payload to the room the reply belongs to
+Emit = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+class PromptPrefix:
+    """System prompt for a companion, built once from its profile"""
+    
+    __slots__ = ("key", "companion_id", "name", "text")
+    
+    def __init__(self, key: str, companion_id: str, name: str, text: str):
+        self.key = key
+        self.companion_id = companion_id
+        self.name = name
+        self.text = text
+
+def build_prompt_prefix(companion: Companion) -> str:
+    """System instructions derived from a companion's name, description and personality"""
+    lines = [f"You are {companion.name}, an AI companion talking to a user on a live video call."]
+    if companion.description:
+        lines.append(companion.description)
+    if companion.personality:
+        lines.append(f"Personality: {companion.personality}")
+    lines.append("Stay in character and answer conversationally in a few short spoken sentences.")
+    return "\n".join(lines)
+
+class PromptCache:
+    """LRU of prompt prefixes per companion, rebuilt when the profile changes"""
+    
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, PromptPrefix]" = OrderedDict()
+    
+    def get(self, companion: Companion) -> PromptPrefix:
+        fingerprint = hashlib.sha1(
+            "\x1f".join([companion.name, companion.description or "", companion.personality or ""]).encode("utf-8")
+        ).hexdigest()[:16]
+        key = f"{companion.id}:{fingerprint}"
+        
+        prefix = self._entries.get(companion.id)
+        if prefix is not None and prefix.key == key:
+            self._entries.move_to_end(companion.id)
+            return prefix
+        
+        prefix = PromptPrefix(key, companion.id, companion.name, build_prompt_prefix(companion))
+        self._entries[companion.id] = prefix
+        self._entries.move_to_end(companion.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return prefix
+
+class LLMProvider(ABC):
+    """Streams a companion's reply to the conversation so far.
+    
+    history is the context window, oldest first, as {"role": "user" | "model",
+    "text": ...} and ends with the user message(s) being answered; background
+    carries what the window no longer holds (long-term memory, call summary).
+    """
+    
+    name = "base"
+    
+    @abstractmethod
+    def stream(self, prefix: PromptPrefix, history: List[Dict[str, str]], background: str = "") -> AsyncIterator[str]:
+        ...
+
+class LocalProvider(LLMProvider):
+    """Deterministic stand-in that needs no API key, for development and tests"""
+    
+    name = "local"
+    
+    def __init__(self, token_delay: float = 0.0):
+        self.token_delay = token_delay
+    
+    async def stream(self, prefix: PromptPrefix, history: List[Dict[str, str]], background: str = "") -> AsyncIterator[str]:
+        pending = []
+        for entry in reversed(history):
+            if entry["role"] != "user":
+                break
+            pending.append(entry["text"])
+        heard = " / ".join(reversed(pending)) or "nothing yet"
+        
+        reply = f"{prefix.name} here. You said: {heard}. Tell me more!"
+        for index, word in enumerate(reply.split(" ")):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield word if index == 0 else " " + word
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini streaming provider; one model object per cached prompt prefix"""
+    
+    name = "gemini"
+    
+    def __init__(self, api_key: str, model_name: str, max_models: int = 256):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.max_models = max_models
+        self._genai = None
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+    
+    def _client(self):
+        # Imported on the first reply so the SDK is neither required nor loaded at startup
+        if self._genai is None:
+            import google.generativeai as genai
+            
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+    
+    def _model_for(self, prefix: PromptPrefix):
+        model = self._models.get(prefix.key)
+        if model is None:
+            model = self._models[prefix.key] = self._client().GenerativeModel(self.model_name, system_instruction=prefix.text)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        else:
+            self._models.move_to_end(prefix.key)
+        return model
+    
+    async def stream(self, prefix: PromptPrefix, history: List[Dict[str, str]], background: str = "") -> AsyncIterator[str]:
+        contents = [{"role": entry["role"], "parts": [entry["text"]]} for entry in history]
+        if background:
+            contents.insert(0, {"role": "user", "parts": [f"(Background, not a message from the user)\n{background}"]})
+        response = await self._model_for(prefix).generate_content_async(contents, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if text:
+                yield text
+
+def _gemini_installed() -> bool:
+    try:
+        return importlib.util.find_spec("google.generativeai") is not None
+    except ModuleNotFoundError:
+        return False
+
+def create_provider(name: str) -> Optional[LLMProvider]:
+    """Provider for COMPANION_REPLY_PROVIDER; "auto" uses Gemini when a key is configured, else none"""
+    if name == "off":
+        return None
+    if name == "auto":
+        if not settings.GOOGLE_API_KEY:
+            return None
+        if not _gemini_installed():
+            logger.warning("GOOGLE_API_KEY is set but google-generativeai is not installed; companion replies disabled")
+            return None
+        name = "gemini"
+    if name == "gemini":
+        return GeminiProvider(settings.GOOGLE_API_KEY, settings.COMPANION_REPLY_MODEL)
+    if name == "local":
+        return LocalProvider(settings.COMPANION_LOCAL_TOKEN_DELAY_SECONDS)
+    raise ValueError(f"Unknown COMPANION_REPLY_PROVIDER {name!r}")
+
+class ReplyEngine:
+    """Generates companion replies to chat with bounded concurrency per worker.
+    
+    One reply runs per room at a time; messages that arrive meanwhile are
+    batched into a single follow-up reply instead of queueing one each.
+    Tokens are emitted to the room as the provider produces them.
+    """
+    
+    def __init__(self, provider: Optional[LLMProvider], concurrency: int = 8, queue_max: int = 64,
+                 timeout: float = 30.0, prompt_cache_size: int = 256):
+        self.provider = provider
+        self.timeout = timeout
+        self.queue_max = queue_max
+        self.prompts = PromptCache(prompt_cache_size)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: Dict[str, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._ttft_ms: Deque[float] = deque(maxlen=1000)
+        self._replies = 0
+        self._batched = 0
+        self._rejected = 0
+        self._failed = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+    
+    def submit(self, room_id: str, user_id: Optional[str], companion: Companion, emit: Emit) -> bool:
+        """Schedule a reply to the room's latest messages; False if the worker is saturated"""
+        if room_id in self._pending:
+            self._pending[room_id] += 1
+            self._batched += 1
+            return True
+        if len(self._pending) >= self.queue_max:
+            self._rejected += 1
+            return False
+        
+        self._pending[room_id] = 0
+        task = asyncio.create_task(self._run(room_id, user_id, companion, emit))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+    
+    async def _run(self, room_id: str, user_id: Optional[str], companion: Companion, emit: Emit) -> None:
+        try:
+            while True:
+                speech = None
+                async with self._semaphore:
+                    self._pending[room_id] = 0
+                    try:
+                        speech = await asyncio.wait_for(self._reply(room_id, user_id, companion, emit), self.timeout)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self._failed += 1
+                        logger.error(f"Companion reply failed in room {room_id}: {e}")
+                        await emit("companion_reply_error", {"companionId": companion.id, "message": "Companion could not reply"})
+                # The reply has ended; its remaining audio is sent without holding a slot or the reply timeout
+                if speech is not None:
+                    try:
+                        await speech.finish()
+                    except asyncio.CancelledError:
+                        speech.cancel()
+                        raise
+                # Messages that arrived mid-reply are answered together
+                if not self._pending.get(room_id):
+                    break
+        finally:
+            self._pending.pop(room_id, None)
+    
+    async def _reply(self, room_id: str, user_id: Optional[str], companion: Companion,
+                     emit: Emit) -> Optional[SpeechStream]:
+        """Stream one reply; returns its speech stream, still to be finished, if the companion speaks"""
+        prefix = self.prompts.get(companion)
+        context = await context_store.get_context(room_id, user_id, companion.id)
+        history = [{"role": turn["role"], "text": turn["text"]} for turn in context["turns"]]
+        background = "\n\n".join(
+            f"{title}:\n{text}" for title, text in (
+                ("What you remember about this user", context["memory"]),
+                ("Earlier in this call", context["summary"])
+            ) if text
+        )
+        
+        reply_id = uuid.uuid4().hex
+        started_at = time.time()
+        started = time.perf_counter()
+        await emit("companion_reply_start", {"replyId": reply_id, "companionId": companion.id})
+        
+        # Companions with a voice are spoken sentence by sentence as the text streams
+        speech = None
+        if tts_relay.enabled and companion.voiceId:
+            speech = tts_relay.open_stream(companion.voiceId, emit, replyId=reply_id, companionId=companion.id)
+        
+        parts: List[str] = []
+        ttft_ms: Optional[float] = None
+        try:
+            async for token in self.provider.stream(prefix, history, background):
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                    self._ttft_ms.append(ttft_ms)
+                await emit("companion_reply_token", {"replyId": reply_id, "index": len(parts), "token": token})
+                parts.append(token)
+                if speech is not None:
+                    speech.feed(token)
+            
+            text = "".join(parts)
+            # Stamped with the start time so messages sent meanwhile follow the reply
+            await context_store.append(room_id, "model", text, at=started_at)
+            await redis_manager.store_chat_message(room_id, {
+                "from": companion.id,
+                "text": text,
+                "timestamp": datetime.utcfromtimestamp(started_at).isoformat()
+            })
+            self._replies += 1
+            await emit("companion_reply_end", {
+                "replyId": reply_id,
+                "companionId": companion.id,
+                "text": text,
+                "ttftMs": ttft_ms,
+                "totalMs": round((time.perf_counter() - started) * 1000, 1)
+            })
+        except BaseException:
+            if speech is not None:
+                speech.cancel()
+            raise
+        return speech
+    
+    def stats(self) -> Dict[str, Any]:
+        """Reply counters and time-to-first-token percentiles (ms)"""
+        samples = sorted(self._ttft_ms)
+        
+        def percentile(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        
+        return {
+            "provider": self.provider.name if self.provider else None,
+            "inFlightRooms": len(self._pending),
+            "replies": self._replies,
+            "batched": self._batched,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "ttftMs": {"p50": percentile(0.5), "p95": percentile(0.95), "samples": len(samples)}
+        }
+    
+    async def close(self) -> None:
+        """Cancel replies still in flight"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Global reply engine instance
+reply_engine = ReplyEngine(
+    create_provider(settings.COMPANION_REPLY_PROVIDER),
+    concurrency=settings.COMPANION_REPLY_CONCURRENCY,
+    queue_max=settings.COMPANION_REPLY_QUEUE_MAX,
+    timeout=settings.COMPANION_REPLY_TIMEOUT_SECONDS,
+    prompt_cache_size=settings.COMPANION_PROMPT_CACHE_SIZE
+)
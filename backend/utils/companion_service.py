@@ -1,50 +1,162 @@
-import httpx
+import time
+import random
+import asyncio
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from config import settings
 from models import Companion, CompanionsResponse
+from utils.companion_index import CompanionIndex
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.catalog_snapshot import load_snapshot, save_snapshot
+from utils.tracing import traced_call
 
 logger = logging.getLogger(__name__)
 
 class CompanionService:
     def __init__(self):
         self.base_url = settings.PERSONA_FETCHER_API_URL
-        self.client = httpx.AsyncClient(timeout=30.0)
+        # Created on first upstream fetch, so importing httpx stays off the startup path
+        self._client = None
+        self.breaker = CircuitBreaker(
+            "persona-api",
+            failure_threshold=settings.UPSTREAM_BREAKER_FAILURES,
+            reset_timeout=settings.UPSTREAM_BREAKER_RESET_SECONDS,
+            half_open_max_calls=settings.UPSTREAM_BREAKER_HALF_OPEN_CALLS
+        )
+        self.last_fetch_ok = False
+        self._last_good: Optional[List[Companion]] = None
+        self.index = CompanionIndex()
+        self._catalog_expires_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
     
+    @property
+    def client(self):
+        """HTTP client for the persona API"""
+        if self._client is None:
+            import httpx
+            
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    connect=settings.UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+                    read=settings.UPSTREAM_READ_TIMEOUT_SECONDS,
+                    write=settings.UPSTREAM_READ_TIMEOUT_SECONDS,
+                    pool=settings.UPSTREAM_CONNECT_TIMEOUT_SECONDS
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY_SECONDS
+                )
+            )
+        return self._client
+    
+    @traced_call("companion.fetch")
     async def fetch_companions(self) -> List[Companion]:
         """Fetch companions from external API"""
         try:
             logger.info(f"Fetching companions from {self.base_url}")
-            response = await self.client.get(self.base_url)
-            response.raise_for_status()
-            
-            data = response.json()
-            companions = []
-            
-            # Parse the response from the external API
-            if isinstance(data, list):
-                for item in data:
-                    companion = Companion(
-                        id=item.get("id", ""),
-                        name=item.get("name", "Unknown"),
-                        avatarUrl=item.get("avatarUrl", ""),
-                        description=item.get("description"),
-                        voiceId=item.get("voiceId"),  # ElevenLabs voice ID
-                        personality=item.get("personality"),
-                        metadata=item.get("metadata", {})
-                    )
-                    companions.append(companion)
+            data = await asyncio.wait_for(self._fetch_upstream(), timeout=settings.UPSTREAM_DEADLINE_SECONDS)
+            companions = self._parse_companions(data)
             
             logger.info(f"Successfully fetched {len(companions)} companions")
+            self.last_fetch_ok = True
+            if companions:
+                self._last_good = companions
             return companions
             
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP error fetching companions: {e}")
-            # Return mock data as fallback
-            return self._get_mock_companions()
+        except CircuitOpenError:
+            logger.warning("Persona API circuit open, skipping upstream fetch")
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out fetching companions after {settings.UPSTREAM_DEADLINE_SECONDS}s")
         except Exception as e:
             logger.error(f"Error fetching companions: {e}")
-            return self._get_mock_companions()
+        
+        self.last_fetch_ok = False
+        if self._last_good is not None:
+            logger.info(f"Serving last known-good catalog ({len(self._last_good)} companions)")
+            return self._last_good
+        # Return mock data as fallback
+        return self._get_mock_companions()
+    
+    async def _fetch_upstream(self) -> Any:
+        """Fetch the raw catalog through the circuit breaker with jittered retries"""
+        import httpx
+        
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(self.breaker.name)
+        
+        try:
+            for attempt in range(settings.UPSTREAM_RETRIES + 1):
+                try:
+                    data = await self._get_hedged()
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500
+                    if not retryable or attempt == settings.UPSTREAM_RETRIES:
+                        raise
+                    # Full jitter exponential backoff
+                    backoff = random.uniform(0, settings.UPSTREAM_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+                    logger.warning(f"Persona API attempt {attempt + 1} failed ({e}), retrying in {backoff:.2f}s")
+                    await asyncio.sleep(backoff)
+        except BaseException:
+            # Cancellation by the overall deadline counts as a failure too
+            self.breaker.record_failure()
+            raise
+        
+        self.breaker.record_success()
+        return data
+    
+    async def _get_hedged(self) -> Any:
+        """GET the catalog, firing a second hedged request if the first is slow"""
+        if settings.UPSTREAM_HEDGE_DELAY_SECONDS <= 0:
+            return await self._get_once()
+        
+        first = asyncio.create_task(self._get_once())
+        pending = {first}
+        error: Optional[BaseException] = None
+        # Whatever way this returns, raises or is cancelled, no request is left running
+        try:
+            delay = settings.UPSTREAM_HEDGE_DELAY_SECONDS * random.uniform(1.0, 1.5)
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            
+            logger.info(f"Persona API slower than {delay:.2f}s, sending hedged request")
+            pending = {first, asyncio.create_task(self._get_once())}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _get_once(self) -> Any:
+        """Single GET against the persona API"""
+        response = await self.client.get(self.base_url)
+        response.raise_for_status()
+        return response.json()
+    
+    def _parse_companions(self, data: Any) -> List[Companion]:
+        """Parse the response from the external API"""
+        companions = []
+        if isinstance(data, list):
+            for item in data:
+                companion = Companion(
+                    id=item.get("id", ""),
+                    name=item.get("name", "Unknown"),
+                    avatarUrl=item.get("avatarUrl", ""),
+                    description=item.get("description"),
+                    voiceId=item.get("voiceId"),  # ElevenLabs voice ID
+                    personality=item.get("personality"),
+                    metadata=item.get("metadata", {})
+                )
+                companions.append(companion)
+        return companions
     
     def _get_mock_companions(self) -> List[Companion]:
         """Return mock companions as fallback"""
@@ -79,17 +191,99 @@ class CompanionService:
             )
         ]
     
+    def load_snapshot(self) -> bool:
+        """Warm the catalog from the on-disk snapshot written by a previous run"""
+        if not settings.COMPANION_SNAPSHOT_PATH:
+            return False
+        
+        snapshot = load_snapshot(settings.COMPANION_SNAPSHOT_PATH)
+        if snapshot is None:
+            return False
+        
+        companions, saved_at = snapshot
+        self.index.update(companions)
+        self._last_good = companions
+        # A recent snapshot is as good as a fetch; an old one is served while revalidating
+        age = max(0.0, time.time() - saved_at)
+        self._catalog_expires_at = time.monotonic() + max(0.0, settings.COMPANION_CACHE_TTL_SECONDS - age)
+        logger.info(f"Loaded {len(companions)} companions from snapshot ({age:.0f}s old)")
+        return True
+    
+    def start_background_refresh(self, max_delay: float = 0.0) -> None:
+        """Revalidate the catalog in the background after a random delay"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh(random.uniform(0, max_delay)))
+    
+    async def _background_refresh(self, delay: float) -> None:
+        """Background task body for start_background_refresh"""
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            await self.refresh_catalog()
+        except Exception as e:
+            logger.error(f"Background catalog refresh failed: {e}")
+    
+    async def refresh_catalog(self) -> CompanionIndex:
+        """Refresh the catalog from upstream unless it is still fresh"""
+        async with self._refresh_lock:
+            # Another request may have refreshed while we waited
+            if time.monotonic() < self._catalog_expires_at:
+                return self.index
+            
+            companions = await self.fetch_companions()
+            self.index.update(companions)
+            # Retry sooner when we are serving a fallback catalog
+            ttl = settings.COMPANION_CACHE_TTL_SECONDS if self.last_fetch_ok else settings.UPSTREAM_BREAKER_RESET_SECONDS
+            self._catalog_expires_at = time.monotonic() + ttl
+            
+            if self.last_fetch_ok and settings.COMPANION_SNAPSHOT_PATH:
+                try:
+                    await asyncio.to_thread(save_snapshot, settings.COMPANION_SNAPSHOT_PATH, companions)
+                except Exception as e:
+                    logger.error(f"Failed to save catalog snapshot: {e}")
+        
+        return self.index
+    
+    async def get_catalog(self) -> CompanionIndex:
+        """Get the indexed catalog, revalidating it once the cache TTL has passed"""
+        if time.monotonic() < self._catalog_expires_at:
+            return self.index
+        
+        # Serve the stale catalog while a single background task revalidates it
+        if len(self.index):
+            self.start_background_refresh()
+            return self.index
+        
+        return await self.refresh_catalog()
+    
+    async def list_companions(self) -> List[Companion]:
+        """List every companion in the cached catalog"""
+        index = await self.get_catalog()
+        return index.all()
+    
+    async def search_companions(
+        self,
+        query: Optional[str] = None,
+        filters: Optional[Dict[str, List[str]]] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[List[Companion], Optional[str], int]:
+        """Search the cached catalog by text and metadata with cursor paging"""
+        index = await self.get_catalog()
+        page_size = min(limit or settings.COMPANION_PAGE_SIZE, settings.COMPANION_MAX_PAGE_SIZE)
+        return index.search(query=query, filters=filters, cursor=cursor, limit=page_size)
+    
     async def get_companion_by_id(self, companion_id: str) -> Optional[Companion]:
         """Get a specific companion by ID"""
-        companions = await self.fetch_companions()
-        for companion in companions:
-            if companion.id == companion_id:
-                return companion
-        return None
+        index = await self.get_catalog()
+        return index.get(companion_id)
     
     async def close(self):
         """Close the HTTP client"""
-        await self.client.aclose()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
 
 # Global companion service instance
 companion_service = CompanionService()
@@ -0,0 +1,142 @@
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set
+from config import settings
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return max(1, (len(text) + 3) // 4)
+
+def truncate_to_budget(lines: List[str], max_tokens: int) -> str:
+    """Join lines, dropping the oldest until the text fits the budget"""
+    total = sum(estimate_tokens(line) for line in lines)
+    start = 0
+    while total > max_tokens and start < len(lines) - 1:
+        total -= estimate_tokens(lines[start])
+        start += 1
+    return "\n".join(lines[start:])
+
+class Summarizer(ABC):
+    """Folds turns into an existing summary within a token budget"""
+    
+    @abstractmethod
+    async def summarize(self, previous: str, turns: List[Dict[str, Any]], max_tokens: int) -> str:
+        ...
+
+class ExtractiveSummarizer(Summarizer):
+    """Local summarizer keeping the first sentence of each turn, newest last"""
+    
+    async def summarize(self, previous: str, turns: List[Dict[str, Any]], max_tokens: int) -> str:
+        lines = previous.splitlines() if previous else []
+        for turn in turns:
+            text = " ".join(turn.get("text", "").split())
+            cut = min((index for index in (text.find(ending) for ending in ".!?") if index > 0), default=-1)
+            if 0 < cut < len(text) - 1:
+                text = text[:cut + 1]
+            if text:
+                speaker = "Companion" if turn.get("role") == "model" else "User"
+                lines.append(f"{speaker}: {text[:160]}")
+        return truncate_to_budget(lines, max_tokens)
+
+class ContextStore:
+    """Per-room conversation context for companion replies.
+    
+    Each turn is appended to a token-budgeted window in Redis; turns pushed
+    out of the window are folded into a rolling summary by a background
+    task, so appends stay O(1) and reading the prompt context (summary,
+    window and the user's long-term memory) is one round trip of O(window).
+    """
+    
+    def __init__(self, summarizer: Summarizer, window_tokens: int = 1500, summary_tokens: int = 400,
+                 memory_tokens: int = 600, memory_ttl_seconds: int = 30 * 86400):
+        self.summarizer = summarizer
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.memory_tokens = memory_tokens
+        self.memory_ttl_seconds = memory_ttl_seconds
+        self._summarizing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+    
+    async def append(self, room_id: str, role: str, text: str, at: Optional[float] = None) -> None:
+        """Add a turn ("user" or "model") to the room's window"""
+        turn = {"role": role, "text": text, "at": at if at is not None else time.time()}
+        overflow = await redis_manager.append_context_turn(room_id, turn, estimate_tokens(text), self.window_tokens)
+        if overflow:
+            self._spawn(room_id, self._summarize(room_id))
+    
+    async def get_context(self, room_id: str, user_id: Optional[str], companion_id: str) -> Dict[str, Any]:
+        """Summary, recent turns (oldest first) and long-term memory for a reply prompt"""
+        summary, turns, memory = await redis_manager.get_context(room_id, user_id, companion_id)
+        # Replies are appended when they finish but stamped when they start
+        turns.sort(key=lambda turn: turn.get("at", 0))
+        return {"summary": summary, "turns": turns, "memory": memory}
+    
+    def _spawn(self, room_id: str, coro) -> None:
+        """Run a summarization off the hot path, at most one per room on this worker"""
+        if room_id in self._summarizing:
+            coro.close()
+            return
+        self._summarizing.add(room_id)
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        
+        def done(finished: asyncio.Task) -> None:
+            self._tasks.discard(finished)
+            self._summarizing.discard(room_id)
+        task.add_done_callback(done)
+    
+    async def _summarize(self, room_id: str) -> None:
+        """Fold the overflow turns into the rolling summary (skipped if another worker is on it)"""
+        try:
+            claimed = await redis_manager.claim_context_overflow(room_id)
+            if claimed is None:
+                return
+            token, summary, turns = claimed
+            try:
+                summary = await self.summarizer.summarize(summary, turns, self.summary_tokens)
+            except Exception:
+                await redis_manager.release_context_lock(room_id, token)
+                raise
+            if not await redis_manager.commit_context_summary(room_id, token, summary, len(turns)):
+                logger.warning(f"Context summarization lock of room {room_id} expired; summary discarded")
+        except Exception as e:
+            logger.error(f"Context summarization failed for room {room_id}: {e}")
+    
+    async def close_room(self, room_id: str, user_id: str, companion_id: str) -> None:
+        """Fold the finished conversation into the user's long-term memory with the companion"""
+        try:
+            await self._summarize(room_id)
+            context = await self.get_context(room_id, user_id, companion_id)
+            if not context["summary"] and not context["turns"]:
+                return
+            session = await self.summarizer.summarize(context["summary"], context["turns"], self.summary_tokens)
+            memory = truncate_to_budget(context["memory"].splitlines() + session.splitlines(), self.memory_tokens)
+            await redis_manager.store_memory(user_id, companion_id, memory, self.memory_ttl_seconds)
+            logger.info(f"Updated memory of companion {companion_id} for user {user_id}")
+        except Exception as e:
+            logger.error(f"Failed to update memory for room {room_id}: {e}")
+    
+    def close_room_later(self, room_id: str, user_id: str, companion_id: str) -> None:
+        """Schedule close_room off the hot path"""
+        task = asyncio.create_task(self.close_room(room_id, user_id, companion_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def close(self) -> None:
+        """Let pending summaries finish"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Global context store instance
+context_store = ContextStore(
+    ExtractiveSummarizer(),
+    window_tokens=settings.CONTEXT_WINDOW_TOKENS,
+    summary_tokens=settings.CONTEXT_SUMMARY_TOKENS,
+    memory_tokens=settings.CONTEXT_MEMORY_TOKENS,
+    memory_ttl_seconds=settings.CONTEXT_MEMORY_TTL_DAYS * 86400
+)
@@ -0,0 +1,124 @@
+import time
+import signal
+import random
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class DrainController:
+    """Drain state of this worker and the negotiations it must let finish.
+    
+    While draining the worker refuses new connections and joins, and each
+    connected client is told to reconnect after a random delay spread over
+    a window (plus an exponential backoff hint), so a deploy turns into a
+    trickle of reconnects instead of a storm. Calls whose offer/answer
+    exchange is still running are only told once it completes or the
+    deadline passes; established calls keep their peer-to-peer media while
+    signaling moves.
+    """
+    
+    def __init__(self, deadline_seconds: float = 25.0, spread_seconds: float = 10.0,
+                 negotiation_timeout: float = 15.0, backoff_base_ms: int = 500, backoff_max_ms: int = 15000):
+        self.deadline_seconds = deadline_seconds
+        self.spread_seconds = spread_seconds
+        self.negotiation_timeout = negotiation_timeout
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.draining = False
+        self.started_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        # roomId -> monotonic time its offer was relayed
+        self.negotiations: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._signalled = False
+    
+    def start(self, deadline_seconds: Optional[float] = None) -> bool:
+        """Enter drain mode; False if already draining"""
+        if self.draining:
+            return False
+        self.draining = True
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + (deadline_seconds if deadline_seconds is not None else self.deadline_seconds)
+        return True
+    
+    def remaining(self) -> float:
+        """Seconds left before the drain deadline"""
+        if self.deadline is None:
+            return 0.0
+        return max(0.0, self.deadline - time.monotonic())
+    
+    def negotiation_started(self, room_id: str) -> None:
+        self.negotiations.setdefault(room_id, time.monotonic())
+    
+    def negotiation_finished(self, room_id: Optional[str]) -> None:
+        if room_id:
+            self.negotiations.pop(room_id, None)
+    
+    def is_negotiating(self, room_id: Optional[str]) -> bool:
+        """Whether a room's offer/answer exchange is in flight (stale ones are dropped)"""
+        started = self.negotiations.get(room_id) if room_id else None
+        if started is None:
+            return False
+        if time.monotonic() - started > self.negotiation_timeout:
+            del self.negotiations[room_id]
+            return False
+        return True
+    
+    def reconnect_hint(self) -> Dict[str, Any]:
+        """Payload of reconnect_advised: a jittered delay and the backoff to use if reconnecting fails"""
+        window = min(self.spread_seconds, max(0.0, self.remaining() - 1.0))
+        return {
+            "reason": "draining",
+            "delayMs": int(random.uniform(0, window) * 1000),
+            "backoffBaseMs": self.backoff_base_ms,
+            "backoffMaxMs": self.backoff_max_ms,
+            "jitter": "full"
+        }
+    
+    def run(self, drain: Callable[[], Awaitable[None]]) -> Optional[asyncio.Task]:
+        """Run the worker's drain procedure in the background (once)"""
+        if self._task is None:
+            self._task = asyncio.create_task(drain())
+        return self._task
+    
+    def install_signal_handler(self, drain: Callable[[], Awaitable[None]]) -> bool:
+        """Drain on the first SIGTERM before handing it to the server's own handler"""
+        previous = signal.getsignal(signal.SIGTERM)
+        if not callable(previous):
+            logger.warning("SIGTERM is not handled by the server; drain on SIGTERM disabled")
+            return False
+        loop = asyncio.get_running_loop()
+        
+        def finish(task: asyncio.Task) -> None:
+            previous(signal.SIGTERM, None)
+        
+        def handle(signum, frame) -> None:
+            if self._signalled:
+                # A second SIGTERM skips the rest of the drain
+                previous(signum, frame)
+                return
+            self._signalled = True
+            logger.info("SIGTERM received, draining before shutdown")
+            loop.call_soon_threadsafe(lambda: self.run(drain).add_done_callback(finish))
+        
+        signal.signal(signal.SIGTERM, handle)
+        return True
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "draining": self.draining,
+            "remainingSeconds": round(self.remaining(), 1) if self.draining else None,
+            "negotiations": sum(1 for room_id in list(self.negotiations) if self.is_negotiating(room_id))
+        }
+
+# Global drain controller instance
+drain_controller = DrainController(
+    deadline_seconds=settings.DRAIN_DEADLINE_SECONDS,
+    spread_seconds=settings.DRAIN_RECONNECT_SPREAD_SECONDS,
+    negotiation_timeout=settings.DRAIN_NEGOTIATION_TIMEOUT_SECONDS,
+    backoff_base_ms=settings.DRAIN_BACKOFF_BASE_MS,
+    backoff_max_ms=settings.DRAIN_BACKOFF_MAX_MS
+)
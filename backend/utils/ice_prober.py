@@ -0,0 +1,182 @@
+import os
+import time
+import asyncio
+import logging
+import struct
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STUN_BINDING_REQUEST = 0x0001
+STUN_BINDING_SUCCESS = 0x0101
+STUN_MAGIC_COOKIE = 0x2112A442
+
+DEFAULT_PORTS = {"stun": 3478, "turn": 3478, "turns": 5349}
+
+# Weight of the newest sample in the smoothed RTT
+RTT_SMOOTHING = 0.3
+
+def parse_ice_url(url: str) -> Tuple[str, str, int, str]:
+    """Split an ICE URL into (scheme, host, port, transport)"""
+    scheme, _, rest = url.partition(":")
+    scheme = scheme.lower()
+    address, _, query = rest.partition("?")
+    transport = "tcp" if scheme == "turns" else "udp"
+    for param in query.split("&"):
+        key, _, value = param.partition("=")
+        if key == "transport" and value:
+            transport = value.lower()
+    
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        port = port.lstrip(":")
+    else:
+        host, _, port = address.partition(":")
+    
+    return scheme, host, int(port) if port else DEFAULT_PORTS.get(scheme, 3478), transport
+
+class IceServer:
+    """A configured STUN/TURN URL and its latest probe results"""
+    
+    def __init__(self, url: str, region: str = "global", username: Optional[str] = None, credential: Optional[str] = None):
+        self.url = url
+        self.region = region
+        self.username = username
+        self.credential = credential
+        self.scheme, self.host, self.port, self.transport = parse_ice_url(url)
+        self.rtt_ms: Optional[float] = None
+        self.failures = 0
+        self.last_probe = 0.0
+    
+    @property
+    def kind(self) -> str:
+        return "stun" if self.scheme == "stun" else "turn"
+    
+    @property
+    def probed(self) -> bool:
+        return self.last_probe > 0
+    
+    def record(self, rtt_ms: Optional[float]) -> None:
+        """Fold a probe result into the server's health"""
+        self.last_probe = time.time()
+        if rtt_ms is None:
+            self.failures += 1
+            return
+        self.failures = 0
+        if self.rtt_ms is None:
+            self.rtt_ms = rtt_ms
+        else:
+            self.rtt_ms = (1 - RTT_SMOOTHING) * self.rtt_ms + RTT_SMOOTHING * rtt_ms
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "region": self.region,
+            "kind": self.kind,
+            "rttMs": round(self.rtt_ms, 2) if self.rtt_ms is not None else None,
+            "failures": self.failures,
+            "lastProbe": self.last_probe
+        }
+
+class _StunProtocol(asyncio.DatagramProtocol):
+    def __init__(self, transaction_id: bytes, waiter: asyncio.Future):
+        self.transaction_id = transaction_id
+        self.waiter = waiter
+    
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) < 20 or self.waiter.done():
+            return
+        message_type, _, cookie = struct.unpack("!HHI", data[:8])
+        if message_type == STUN_BINDING_SUCCESS and cookie == STUN_MAGIC_COOKIE and data[8:20] == self.transaction_id:
+            self.waiter.set_result(time.perf_counter())
+    
+    def error_received(self, exc: Exception) -> None:
+        if not self.waiter.done():
+            self.waiter.set_exception(exc)
+
+async def stun_binding_rtt(host: str, port: int, timeout: float) -> Optional[float]:
+    """Send a STUN binding request over UDP and return the RTT in ms"""
+    loop = asyncio.get_running_loop()
+    transaction_id = os.urandom(12)
+    waiter = loop.create_future()
+    transport = None
+    try:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _StunProtocol(transaction_id, waiter), remote_addr=(host, port)
+        )
+        sent_at = time.perf_counter()
+        transport.sendto(struct.pack("!HHI", STUN_BINDING_REQUEST, 0, STUN_MAGIC_COOKIE) + transaction_id)
+        received_at = await asyncio.wait_for(waiter, timeout)
+        return (received_at - sent_at) * 1000
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        if transport is not None:
+            transport.close()
+
+async def tcp_connect_rtt(host: str, port: int, timeout: float) -> Optional[float]:
+    """Measure TCP connect time in ms (for TURN over TCP/TLS)"""
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    rtt = (time.perf_counter() - started) * 1000
+    writer.close()
+    return rtt
+
+class IceProber:
+    """Periodically measures reachability and RTT of configured ICE servers"""
+    
+    def __init__(
+        self,
+        servers: List[IceServer],
+        interval: float = 30.0,
+        timeout: float = 1.0,
+        on_update: Optional[Callable[[], None]] = None
+    ):
+        self.servers = servers
+        self.interval = interval
+        self.timeout = timeout
+        self.on_update = on_update
+        self._task: Optional[asyncio.Task] = None
+    
+    async def probe_server(self, server: IceServer) -> Optional[float]:
+        """Probe one server and record the result"""
+        if server.transport == "udp":
+            rtt = await stun_binding_rtt(server.host, server.port, self.timeout)
+        else:
+            rtt = await tcp_connect_rtt(server.host, server.port, self.timeout)
+        server.record(rtt)
+        return rtt
+    
+    async def probe_once(self) -> None:
+        """Probe every server concurrently, then notify the listener"""
+        await asyncio.gather(*(self.probe_server(server) for server in self.servers))
+        reachable = sum(1 for server in self.servers if server.failures == 0)
+        logger.info(f"Probed {len(self.servers)} ICE servers, {reachable} reachable")
+        if self.on_update is not None:
+            self.on_update()
+    
+    def start(self) -> None:
+        """Start the background probe loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the background probe loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:
+                logger.error(f"ICE probe round failed: {e}")
+            await asyncio.sleep(self.interval)
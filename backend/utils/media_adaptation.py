@@ -0,0 +1,189 @@
+import time
+import logging
+from array import array
+from typing import Any, Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Quality tiers from best to worst, with the network conditions each one needs
+MEDIA_TIERS: List[Dict[str, Any]] = [
+    {"name": "720p", "width": 1280, "height": 720, "frameRate": 30, "maxBitrateKbps": 2500,
+     "minBitrateKbps": 1800, "maxPacketLoss": 0.02, "maxRttMs": 250},
+    {"name": "540p", "width": 960, "height": 540, "frameRate": 30, "maxBitrateKbps": 1200,
+     "minBitrateKbps": 900, "maxPacketLoss": 0.05, "maxRttMs": 400},
+    {"name": "360p", "width": 640, "height": 360, "frameRate": 24, "maxBitrateKbps": 600,
+     "minBitrateKbps": 0, "maxPacketLoss": 1.0, "maxRttMs": float("inf")},
+]
+TIERS_BY_NAME = {tier["name"]: tier for tier in MEDIA_TIERS}
+DEFAULT_TIER = MEDIA_TIERS[0]["name"]
+
+# Extra margin a better tier's thresholds must clear before upgrading
+UPGRADE_HEADROOM = 1.2
+
+# Ring value of a metric a stats sample did not report
+MISSING = float("nan")
+
+def _mean(values: array, count: int) -> Optional[float]:
+    # Slots past count are unfilled; NaN != NaN drops missing metrics
+    present = [value for value in values[:count] if value == value]
+    return sum(present) / len(present) if present else None
+
+class StatsRing:
+    """Fixed-size ring buffers of RTT, packet loss and available bitrate"""
+    
+    __slots__ = ("size", "rtt", "loss", "bitrate", "position", "count")
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.rtt = array("d", bytes(8 * size))
+        self.loss = array("d", bytes(8 * size))
+        self.bitrate = array("d", bytes(8 * size))
+        self.position = 0
+        self.count = 0
+    
+    def push(self, rtt_ms: Optional[float], packet_loss: Optional[float], bitrate_kbps: Optional[float]) -> None:
+        """Add a sample; metrics left out (None) are stored as NaN and skipped by averages()"""
+        position = self.position
+        self.rtt[position] = MISSING if rtt_ms is None else rtt_ms
+        self.loss[position] = MISSING if packet_loss is None else packet_loss
+        self.bitrate[position] = MISSING if bitrate_kbps is None else bitrate_kbps
+        self.position = (position + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+    
+    def averages(self) -> Dict[str, Any]:
+        """Mean of each metric over the buffered samples that reported it (None if none did)"""
+        count = self.count
+        return {
+            "rttMs": _mean(self.rtt, count),
+            "packetLoss": _mean(self.loss, count),
+            "availableBitrateKbps": _mean(self.bitrate, count),
+            "samples": count
+        }
+
+class RoomQuality:
+    """Rolling network quality and current media tier of one room"""
+    
+    __slots__ = ("ring", "tier", "samples_since_change", "last_sample")
+    
+    def __init__(self, window: int):
+        self.ring = StatsRing(window)
+        self.tier = DEFAULT_TIER
+        self.samples_since_change = 0
+        self.last_sample = 0.0
+
+def _tier_fits(tier: Dict[str, Any], averages: Dict[str, Any], headroom: float = 1.0) -> bool:
+    """Whether the averages meet a tier's thresholds; metrics nobody reported do not count against it"""
+    bitrate, loss, rtt = averages["availableBitrateKbps"], averages["packetLoss"], averages["rttMs"]
+    return (
+        (bitrate is None or bitrate >= tier["minBitrateKbps"] * headroom)
+        and (loss is None or loss * headroom <= tier["maxPacketLoss"])
+        and (rtt is None or rtt * headroom <= tier["maxRttMs"])
+    )
+
+def build_media_profile(tier_name: str) -> Dict[str, Any]:
+    """getUserMedia constraints plus sender bitrate cap for a tier"""
+    tier = TIERS_BY_NAME[tier_name]
+    return {
+        "tier": tier["name"],
+        "maxBitrateKbps": tier["maxBitrateKbps"],
+        "video": {
+            "width": {"ideal": tier["width"], "max": tier["width"]},
+            "height": {"ideal": tier["height"], "max": tier["height"]},
+            "frameRate": {"ideal": tier["frameRate"], "max": tier["frameRate"]}
+        },
+        "audio": {
+            "echoCancellation": True,
+            "noiseSuppression": True,
+            "autoGainControl": True
+        }
+    }
+
+class MediaAdaptationService:
+    """Chooses per-room media tiers from client-reported WebRTC stats.
+    
+    Downgrades happen as soon as the rolling averages no longer fit the
+    current tier; upgrades need the better tier to fit with headroom and a
+    minimum number of samples since the last change, so calls don't flap.
+    Rooms that stop reporting are forgotten after idle_seconds.
+    """
+    
+    def __init__(self, window: int = 16, upgrade_hold_samples: int = 8, idle_seconds: float = 300.0):
+        self.window = window
+        self.upgrade_hold_samples = upgrade_hold_samples
+        self.idle_seconds = idle_seconds
+        self.rooms: Dict[str, RoomQuality] = {}
+        self._next_sweep = time.monotonic() + idle_seconds
+    
+    def record_stats(self, room_id: str, rtt_ms: Optional[float], packet_loss: Optional[float],
+                     bitrate_kbps: Optional[float]) -> Optional[Dict[str, Any]]:
+        """Add a stats sample (None for metrics not reported); returns the new media profile if the tier changed"""
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.evict_idle(now)
+        if rtt_ms is None and packet_loss is None and bitrate_kbps is None:
+            return None
+        
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomQuality(self.window)
+        
+        room.last_sample = now
+        room.ring.push(rtt_ms, packet_loss, bitrate_kbps)
+        room.samples_since_change += 1
+        
+        averages = room.ring.averages()
+        current_index = next(i for i, tier in enumerate(MEDIA_TIERS) if tier["name"] == room.tier)
+        target_index = current_index
+        
+        if not _tier_fits(MEDIA_TIERS[current_index], averages):
+            target_index = next(
+                (i for i in range(current_index + 1, len(MEDIA_TIERS)) if _tier_fits(MEDIA_TIERS[i], averages)),
+                len(MEDIA_TIERS) - 1
+            )
+        elif current_index > 0 and room.samples_since_change >= self.upgrade_hold_samples:
+            if _tier_fits(MEDIA_TIERS[current_index - 1], averages, UPGRADE_HEADROOM):
+                target_index = current_index - 1
+        
+        if target_index == current_index:
+            return None
+        
+        previous = room.tier
+        room.tier = MEDIA_TIERS[target_index]["name"]
+        room.samples_since_change = 0
+        logger.info(f"Room {room_id} media tier {previous} -> {room.tier} ({averages})")
+        return build_media_profile(room.tier)
+    
+    def get_profile(self, room_id: Optional[str] = None) -> Dict[str, Any]:
+        """Current media profile for a room (the best tier for unknown rooms)"""
+        room = self.rooms.get(room_id) if room_id else None
+        return build_media_profile(room.tier if room else DEFAULT_TIER)
+    
+    def get_room_summary(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """Rolling quality aggregates for a room"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        return {"roomId": room_id, "tier": room.tier, **room.ring.averages()}
+    
+    def discard_room(self, room_id: str) -> None:
+        """Forget a room's stats once the call ends"""
+        self.rooms.pop(room_id, None)
+    
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Forget rooms without a sample for idle_seconds (calls that ended without an end event)"""
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.idle_seconds
+        idle = [room_id for room_id, room in self.rooms.items() if room.last_sample < cutoff]
+        for room_id in idle:
+            del self.rooms[room_id]
+        self._next_sweep = now + self.idle_seconds
+        return len(idle)
+
+# Global media adaptation service instance
+media_adaptation_service = MediaAdaptationService(
+    window=settings.MEDIA_STATS_WINDOW,
+    upgrade_hold_samples=settings.MEDIA_UPGRADE_HOLD_SAMPLES,
+    idle_seconds=settings.MEDIA_STATS_IDLE_SECONDS
+)
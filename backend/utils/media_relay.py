@@ -0,0 +1,370 @@
+import zlib
+import uuid
+import importlib.util
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# aiortc is optional: without it the relay reports itself unavailable. Only
+# look it up here; importing it costs startup time even when the relay is off
+AIORTC_AVAILABLE = importlib.util.find_spec("aiortc") is not None
+
+# Tapped audio is delivered to the parent as 16 kHz mono s16 PCM in 20 ms frames,
+# batched per message to keep IPC overhead down
+TAP_SAMPLE_RATE = 16000
+TAP_FRAME_MS = 20
+TAP_FRAME_BYTES = 2 * TAP_SAMPLE_RATE * TAP_FRAME_MS // 1000
+TAP_BATCH_FRAMES = 5
+
+# Callbacks into the web process
+AudioHandler = Callable[[str, str, int, bytes], None]
+OfferHandler = Callable[[str, str, str], Awaitable[None]]
+ClosedHandler = Callable[[str, str], Awaitable[None]]
+
+class _RelayPeer:
+    """A peer connection terminated by a relay worker"""
+    
+    def __init__(self, peer_id: str, pc, tap_audio: bool):
+        self.peer_id = peer_id
+        self.pc = pc
+        self.tap_audio = tap_audio
+        self.sources: List[Any] = []
+        self.tasks: List[asyncio.Task] = []
+        self.renegotiate_pending = False
+    
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await self.pc.close()
+
+class _RelayWorker:
+    """Runs inside a pool process: terminates peers and relays tracks between peers of a room"""
+    
+    def __init__(self, index: int, commands, events):
+        from aiortc.contrib.media import MediaRelay
+        
+        self.index = index
+        self.commands = commands
+        self.events = events
+        self.relay = MediaRelay()
+        self.rooms: Dict[str, Dict[str, _RelayPeer]] = {}
+    
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, self.commands.get)
+            if command[0] == "stop":
+                break
+            asyncio.create_task(self._dispatch(command))
+        for room_id in list(self.rooms):
+            for peer_id in list(self.rooms.get(room_id, {})):
+                await self._close_peer(room_id, peer_id, notify=False)
+    
+    async def _dispatch(self, command: Tuple) -> None:
+        name, request_id, room_id, peer_id = command[:4]
+        try:
+            if name == "offer":
+                result = await self._offer(room_id, peer_id, command[4], command[5])
+            elif name == "answer":
+                result = await self._answer(room_id, peer_id, command[4])
+            elif name == "close":
+                result = await self._close_peer(room_id, peer_id, notify=False)
+            else:
+                raise ValueError(f"Unknown relay command {name!r}")
+            self.events.put(("result", request_id, result))
+        except Exception as e:
+            self.events.put(("error", request_id, f"{type(e).__name__}: {e}"))
+    
+    async def _offer(self, room_id: str, peer_id: str, sdp: str, tap_audio: bool) -> str:
+        """Answer a peer's offer; tracks of the peers already in the room are relayed to it"""
+        from aiortc import RTCPeerConnection, RTCSessionDescription
+        
+        await self._close_peer(room_id, peer_id, notify=False)
+        peers = self.rooms.setdefault(room_id, {})
+        peer = peers[peer_id] = _RelayPeer(peer_id, RTCPeerConnection(), tap_audio)
+        
+        @peer.pc.on("track")
+        def on_track(track):
+            peer.sources.append(track)
+            if track.kind == "audio" and peer.tap_audio:
+                peer.tasks.append(asyncio.create_task(self._tap(room_id, peer_id, self.relay.subscribe(track))))
+            for other in list(peers.values()):
+                if other is not peer:
+                    other.pc.addTrack(self.relay.subscribe(track))
+                    asyncio.create_task(self._renegotiate(room_id, other))
+        
+        @peer.pc.on("connectionstatechange")
+        async def on_state():
+            if peer.pc.connectionState in ("failed", "closed") and peers.get(peer_id) is peer:
+                await self._close_peer(room_id, peer_id, notify=True)
+        
+        await peer.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+        for other in list(peers.values()):
+            if other is not peer:
+                for source in other.sources:
+                    peer.pc.addTrack(self.relay.subscribe(source))
+        await peer.pc.setLocalDescription(await peer.pc.createAnswer())
+        
+        # Tracks that found no transceiver in the offer need a server-initiated round
+        if any(transceiver.mid is None for transceiver in peer.pc.getTransceivers()):
+            asyncio.create_task(self._renegotiate(room_id, peer))
+        return peer.pc.localDescription.sdp
+    
+    async def _renegotiate(self, room_id: str, peer: _RelayPeer) -> None:
+        """Send the peer a fresh offer (answered through the "answer" command)"""
+        if peer.pc.signalingState != "stable":
+            peer.renegotiate_pending = True
+            return
+        peer.renegotiate_pending = False
+        await peer.pc.setLocalDescription(await peer.pc.createOffer())
+        self.events.put(("offer", room_id, peer.peer_id, peer.pc.localDescription.sdp))
+    
+    async def _answer(self, room_id: str, peer_id: str, sdp: str) -> None:
+        from aiortc import RTCSessionDescription
+        
+        peer = self.rooms.get(room_id, {}).get(peer_id)
+        if peer is None:
+            raise KeyError(f"No relay peer {peer_id} in room {room_id}")
+        await peer.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="answer"))
+        if peer.renegotiate_pending:
+            await self._renegotiate(room_id, peer)
+    
+    async def _close_peer(self, room_id: str, peer_id: str, notify: bool) -> None:
+        peers = self.rooms.get(room_id, {})
+        peer = peers.pop(peer_id, None)
+        if not peers:
+            self.rooms.pop(room_id, None)
+        if peer is not None:
+            await peer.close()
+            if notify:
+                self.events.put(("closed", room_id, peer_id))
+    
+    async def _tap(self, room_id: str, peer_id: str, track) -> None:
+        """Resample a peer's audio to 16 kHz mono PCM and ship it to the web process"""
+        import av
+        from aiortc.mediastreams import MediaStreamError
+        
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=TAP_SAMPLE_RATE)
+        buffer = bytearray()
+        seq = 0
+        batch_bytes = TAP_FRAME_BYTES * TAP_BATCH_FRAMES
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                break
+            for resampled in resampler.resample(frame):
+                buffer += memoryview(resampled.planes[0])[:resampled.samples * 2]
+            if len(buffer) >= batch_bytes:
+                size = len(buffer) - len(buffer) % TAP_FRAME_BYTES
+                self.events.put(("audio", room_id, peer_id, seq, bytes(buffer[:size])))
+                seq += size // TAP_FRAME_BYTES
+                del buffer[:size]
+
+def _worker_main(index: int, commands, events) -> None:
+    """Entry point of a relay pool process"""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_RelayWorker(index, commands, events).run())
+
+class MediaRelayPool:
+    """Pool of processes terminating WebRTC for calls that cannot go peer-to-peer.
+    
+    Each room is pinned to one worker by a stable hash, so all of its peers
+    share a process and their tracks are relayed between them in-process
+    (aiortc's MediaRelay fans a received track out to every subscriber).
+    Media work never runs on the web worker's event loop; the web process
+    only exchanges SDP and receives tapped audio.
+    """
+    
+    def __init__(self, workers: int = 2, timeout: float = 10.0):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.on_audio: Optional[AudioHandler] = None
+        self.on_offer: Optional[OfferHandler] = None
+        self.on_closed: Optional[ClosedHandler] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Any] = []
+        self._commands: List[Any] = []
+        self._events = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.restarts = 0
+    
+    @property
+    def running(self) -> bool:
+        return bool(self._processes)
+    
+    def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._events = self._context.Queue()
+        for index in range(self.workers):
+            self._commands.append(self._context.Queue())
+            self._processes.append(None)
+            self._spawn(index)
+        self._reader = threading.Thread(target=self._read_events, name="media-relay-events", daemon=True)
+        self._reader.start()
+        logger.info(f"Media relay started with {self.workers} worker process(es)")
+    
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker_main, args=(index, self._commands[index], self._events),
+            name=f"media-relay-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+    
+    def _worker_for(self, room_id: str) -> int:
+        """Pin a room to a worker, restarting it if it has died (its sessions are lost)"""
+        index = zlib.crc32(room_id.encode("utf-8")) % self.workers
+        if not self._processes[index].is_alive():
+            logger.warning(f"Media relay worker {index} died, restarting")
+            self.restarts += 1
+            self._spawn(index)
+        return index
+    
+    def _read_events(self) -> None:
+        while True:
+            event = self._events.get()
+            if event is None:
+                break
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+    
+    def _dispatch(self, event: Tuple) -> None:
+        kind = event[0]
+        if kind in ("result", "error"):
+            future = self._pending.pop(event[1], None)
+            if future is not None and not future.done():
+                if kind == "result":
+                    future.set_result(event[2])
+                else:
+                    future.set_exception(RuntimeError(event[2]))
+        elif kind == "audio" and self.on_audio is not None:
+            self.on_audio(*event[1:])
+        elif kind == "offer" and self.on_offer is not None:
+            asyncio.create_task(self.on_offer(*event[1:]))
+        elif kind == "closed" and self.on_closed is not None:
+            asyncio.create_task(self.on_closed(*event[1:]))
+    
+    async def _request(self, name: str, room_id: str, peer_id: str, *args: Any) -> Any:
+        if not self.running:
+            raise RuntimeError("Media relay is not running")
+        request_id = uuid.uuid4().hex
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        self._commands[self._worker_for(room_id)].put((name, request_id, room_id, peer_id, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+    
+    async def offer(self, room_id: str, peer_id: str, sdp: str, tap_audio: bool = True) -> str:
+        """Terminate a peer's (non-trickle) offer on the room's worker and return the answer SDP"""
+        return await self._request("offer", room_id, peer_id, sdp, tap_audio)
+    
+    async def answer(self, room_id: str, peer_id: str, sdp: str) -> None:
+        """Complete a renegotiation the relay started with on_offer"""
+        await self._request("answer", room_id, peer_id, sdp)
+    
+    async def close_peer(self, room_id: str, peer_id: str) -> None:
+        await self._request("close", room_id, peer_id)
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "available": AIORTC_AVAILABLE,
+            "running": self.running,
+            "workers": [process.is_alive() for process in self._processes if process is not None],
+            "restarts": self.restarts,
+            "pendingRequests": len(self._pending)
+        }
+    
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        for commands in self._commands:
+            commands.put(("stop",))
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self._events.put(None)
+        self._processes = []
+        self._commands = []
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+async def loopback_check(seconds: float = 3.0) -> Dict[str, Any]:
+    """Connect two local aiortc peers to one room through a one-worker pool.
+    
+    The first peer sends a tone, which is tapped and relayed to the second
+    peer after renegotiation. Run with `python -m utils.media_relay`.
+    """
+    import math
+    import fractions
+    from array import array
+    import av
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    from aiortc.mediastreams import AudioStreamTrack
+    
+    class ToneTrack(AudioStreamTrack):
+        async def recv(self):
+            silence = await super().recv()
+            samples = array("h", (
+                int(8000 * math.sin(2 * math.pi * 440 * (silence.pts + i) / silence.sample_rate))
+                for i in range(silence.samples)
+            ))
+            frame = av.AudioFrame(format="s16", layout="mono", samples=silence.samples)
+            frame.planes[0].update(samples.tobytes())
+            frame.pts = silence.pts
+            frame.sample_rate = silence.sample_rate
+            frame.time_base = fractions.Fraction(1, silence.sample_rate)
+            return frame
+    
+    pool = MediaRelayPool(workers=1)
+    peers = {"sender": RTCPeerConnection(), "receiver": RTCPeerConnection()}
+    tapped = {"sender": 0, "receiver": 0}
+    received: List[str] = []
+    
+    def on_audio(room_id: str, peer_id: str, seq: int, data: bytes) -> None:
+        tapped[peer_id] += len(data) // TAP_FRAME_BYTES
+    
+    async def on_offer(room_id: str, peer_id: str, sdp: str) -> None:
+        pc = peers[peer_id]
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        await pool.answer(room_id, peer_id, pc.localDescription.sdp)
+    
+    @peers["receiver"].on("track")
+    def on_track(track):
+        received.append(track.kind)
+    
+    pool.on_audio, pool.on_offer = on_audio, on_offer
+    pool.start()
+    try:
+        peers["sender"].addTrack(ToneTrack())
+        peers["receiver"].addTransceiver("audio", direction="recvonly")
+        for peer_id in ("receiver", "sender"):
+            pc = peers[peer_id]
+            await pc.setLocalDescription(await pc.createOffer())
+            answer = await pool.offer("loopback", peer_id, pc.localDescription.sdp)
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=answer, type="answer"))
+        await asyncio.sleep(seconds)
+    finally:
+        for pc in peers.values():
+            await pc.close()
+        await pool.stop()
+    return {"tappedFrames": tapped, "relayedTracks": received}
+
+# Global media relay pool instance
+media_relay = MediaRelayPool(workers=settings.MEDIA_RELAY_WORKERS, timeout=settings.MEDIA_RELAY_TIMEOUT_SECONDS)
+
+if __name__ == "__main__":
+    print(asyncio.run(loopback_check()))
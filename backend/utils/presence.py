@@ -0,0 +1,176 @@
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config import settings
+from models import PresenceResponse, UserPresence, CompanionPresence
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+# Called with (userId, roomId, room occupancy, user's remaining connections in the room)
+LeftHandler = Callable[[str, str, Optional[int], Optional[int]], Awaitable[None]]
+
+class PresenceService:
+    """Online users, companions in a call and room occupancy, shared across workers.
+    
+    Joins and leaves update counters in Redis hashes (one field per user,
+    companion and room) and last-seen sorted sets in a single script call,
+    so a bulk query for hundreds of ids is one pipelined HMGET/ZMSCORE round
+    trip instead of a scan over connections. Each worker also records its
+    own share of the counters; if its heartbeat lapses, another worker
+    subtracts that share so a crashed worker does not leave users online.
+    
+    Per-room membership counts tell whether a join is a user's first
+    connection to a room, so rejoins and resumed sessions are not announced
+    twice; a dropped connection can linger for a grace period so that a
+    quick reconnect is neither a leave nor a join.
+    """
+    
+    def __init__(self, heartbeat_interval: float = 10.0, worker_ttl: int = 30, last_seen_days: int = 30):
+        self.worker_id = uuid.uuid4().hex
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_ttl = worker_ttl
+        self.last_seen_seconds = last_seen_days * 86400
+        # sid -> (userId, roomId, companionId) counted by this worker
+        self.connections: Dict[str, Tuple[str, str, str]] = {}
+        # Dropped connections still counted until their grace period ends
+        self.lingering: Dict[asyncio.Task, Tuple[str, str, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Whether this worker has counters in Redis that a reap could have removed
+        self._counted = False
+    
+    @staticmethod
+    def _deltas(entry: Tuple[str, str, str], delta: int) -> List[Tuple[str, str, int]]:
+        user_id, room_id, companion_id = entry
+        return [("u", user_id, delta), ("r", room_id, delta), ("c", companion_id, delta), ("m", f"{room_id}:{user_id}", delta)]
+    
+    async def join(self, sid: str, user_id: str, room_id: str, companion_id: str) -> Tuple[Optional[int], Optional[int]]:
+        """Count a connection into a room; returns (room occupancy, user's connections in the room)"""
+        deltas = []
+        previous = self.connections.pop(sid, None)
+        if previous is not None:
+            deltas.extend(self._deltas(previous, -1))
+        entry = (user_id, room_id, companion_id)
+        self.connections[sid] = entry
+        deltas.extend(self._deltas(entry, 1))
+        try:
+            if not self._counted:
+                # Heartbeat first so other workers do not reap us as dead
+                await redis_manager.heartbeat_presence(self.worker_id, self.worker_ttl)
+            counts = await redis_manager.apply_presence(self.worker_id, deltas)
+            self._counted = True
+            return counts[-3], counts[-1]
+        except Exception as e:
+            logger.error(f"Failed to record presence of {user_id} in room {room_id}: {e}")
+            return None, None
+    
+    async def leave(self, sid: str) -> Optional[Tuple[str, str, Optional[int], Optional[int]]]:
+        """Uncount a connection; returns (userId, roomId, occupancy, user's connections left) if it was in a room"""
+        entry = self.connections.pop(sid, None)
+        if entry is None:
+            return None
+        return await self._uncount(entry)
+    
+    async def _uncount(self, entry: Tuple[str, str, str]) -> Tuple[str, str, Optional[int], Optional[int]]:
+        user_id, room_id, _ = entry
+        try:
+            counts = await redis_manager.apply_presence(self.worker_id, self._deltas(entry, -1))
+            return user_id, room_id, counts[1], counts[3]
+        except Exception as e:
+            logger.error(f"Failed to clear presence of {user_id} in room {room_id}: {e}")
+            return user_id, room_id, None, None
+    
+    def leave_later(self, sid: str, delay: float, on_left: LeftHandler) -> None:
+        """Keep a dropped connection counted for delay seconds, then uncount it and call on_left"""
+        entry = self.connections.pop(sid, None)
+        if entry is None:
+            return
+        
+        async def linger() -> None:
+            await asyncio.sleep(delay)
+            self.lingering.pop(task, None)
+            try:
+                await on_left(*await self._uncount(entry))
+            except Exception as e:
+                logger.error(f"Failed to announce departure of {entry[0]} from room {entry[1]}: {e}")
+        
+        task = asyncio.create_task(linger())
+        self.lingering[task] = entry
+    
+    async def query(self, user_ids: List[str], companion_ids: List[str], room_ids: List[str]) -> PresenceResponse:
+        """Presence of many users, companions and rooms in one Redis round trip"""
+        user_ids = list(dict.fromkeys(user_ids))
+        companion_ids = list(dict.fromkeys(companion_ids))
+        room_ids = list(dict.fromkeys(room_ids))
+        raw = await redis_manager.query_presence(user_ids, companion_ids, room_ids)
+        
+        def seen(score: Optional[float]) -> Optional[datetime]:
+            return datetime.utcfromtimestamp(score) if score else None
+        
+        return PresenceResponse(
+            users={
+                user_id: UserPresence(online=bool(count), connections=int(count or 0), lastSeen=seen(score))
+                for user_id, count, score in zip(user_ids, raw["users"], raw["userSeen"])
+            },
+            companions={
+                companion_id: CompanionPresence(inCall=bool(count), participants=int(count or 0), lastSeen=seen(score))
+                for companion_id, count, score in zip(companion_ids, raw["companions"], raw["companionSeen"])
+            },
+            rooms={room_id: int(count or 0) for room_id, count in zip(room_ids, raw["rooms"])}
+        )
+    
+    async def _heartbeat(self) -> None:
+        registered = await redis_manager.heartbeat_presence(self.worker_id, self.worker_ttl)
+        if not registered and self._counted and (self.connections or self.lingering):
+            # Our share was reaped while we were unreachable; count our connections again
+            logger.warning(f"Presence of worker {self.worker_id} was reaped; restoring its connections")
+            deltas = []
+            for entry in list(self.connections.values()) + list(self.lingering.values()):
+                deltas.extend(self._deltas(entry, 1))
+            await redis_manager.apply_presence(self.worker_id, deltas)
+    
+    def start(self) -> None:
+        """Start heartbeating and reaping the presence of dead workers"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop heartbeating and withdraw this worker's presence"""
+        for task in list(self.lingering):
+            task.cancel()
+        self.lingering.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await redis_manager.remove_presence_worker(self.worker_id)
+        except Exception as e:
+            logger.error(f"Failed to withdraw presence of worker {self.worker_id}: {e}")
+        self.connections.clear()
+        self._counted = False
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._heartbeat()
+                reaped = await redis_manager.reap_presence(self.worker_id)
+                if reaped:
+                    logger.info(f"Reaped {reaped} presence entries of dead workers")
+                await redis_manager.prune_last_seen(time.time() - self.last_seen_seconds)
+            except Exception as e:
+                logger.error(f"Presence heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+# Global presence service instance
+presence_service = PresenceService(
+    heartbeat_interval=settings.PRESENCE_HEARTBEAT_SECONDS,
+    worker_ttl=settings.PRESENCE_WORKER_TTL_SECONDS,
+    last_seen_days=settings.PRESENCE_LAST_SEEN_DAYS
+)
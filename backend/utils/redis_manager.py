@@ -1,44 +1,367 @@
+import os
 import redis
 import json
+import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Union
 from config import settings
 from models import VideoRoom, RoomStatus, Companion, CompanionsResponse
+from utils.tracing import traced_call
+from utils.sdp_pipeline import decompress_sdp
+
+# Compare-and-set room status: KEYS = room hash, event log; ARGV = new status, event JSON, allowed current statuses...
+TRANSITION_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'status')
+if not current then
+    return false
+end
+for i = 3, #ARGV do
+    if ARGV[i] == current then
+        redis.call('HSET', KEYS[1], 'status', ARGV[1])
+        redis.call('RPUSH', KEYS[2], ARGV[2])
+        local ttl = redis.call('TTL', KEYS[1])
+        if ttl > 0 then
+            redis.call('EXPIRE', KEYS[2], ttl)
+        end
+        return current
+    end
+end
+return false
+"""
+
+# Append a turn to a room's context window, moving the oldest turns to the overflow list
+# (awaiting summarization) while the window is over its token budget.
+# KEYS = turns, context hash, overflow, room hash; ARGV = "<tokens>|<turn JSON>", tokens, budget, fallback TTL
+CONTEXT_APPEND_SCRIPT = """
+local tokens = redis.call('HINCRBY', KEYS[2], 'tokens', ARGV[2])
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local budget = tonumber(ARGV[3])
+while tokens > budget and redis.call('LLEN', KEYS[1]) > 1 do
+    local turn = redis.call('LPOP', KEYS[1])
+    local cost = tonumber(string.match(turn, '^(%d+)|'))
+    tokens = redis.call('HINCRBY', KEYS[2], 'tokens', -cost)
+    redis.call('RPUSH', KEYS[3], turn)
+end
+local ttl = redis.call('TTL', KEYS[4])
+if ttl <= 0 then
+    ttl = tonumber(ARGV[4])
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+return redis.call('LLEN', KEYS[3])
+"""
+
+# Store a rolling summary and drop the overflow turns it covers, only while the caller still holds
+# the summarization lock (it may have expired and been taken by another worker).
+# KEYS = context hash, overflow, lock; ARGV = lock token, summary, turns consumed. Returns 1 if committed.
+CONTEXT_COMMIT_SCRIPT = """
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'summary', ARGV[2])
+redis.call('LTRIM', KEYS[2], tonumber(ARGV[3]), -1)
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+# Release the summarization lock if the caller still holds it. KEYS = lock; ARGV = lock token
+CONTEXT_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Presence counters: online users, participants per companion and per room, and connections of
+# each user in each room (field "roomId:userId"). Each worker
+# also counts its own contributions so a dead worker's share can be reaped.
+PRESENCE_TARGETS = """
+local targets = {u = 'presence:users', c = 'presence:companions', r = 'presence:rooms', m = 'presence:members'}
+local seen = {u = 'presence:seen:users', c = 'presence:seen:companions'}
+"""
+
+# KEYS = worker hash, worker set; ARGV = worker id, timestamp, then (kind, id, delta) triples.
+# Returns the new count of every target.
+PRESENCE_APPLY_SCRIPT = PRESENCE_TARGETS + """
+redis.call('SADD', KEYS[2], ARGV[1])
+local result = {}
+for i = 3, #ARGV, 3 do
+    local kind, id, delta = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local count = redis.call('HINCRBY', targets[kind], id, delta)
+    if count <= 0 then
+        redis.call('HDEL', targets[kind], id)
+        count = 0
+    end
+    local field = kind .. ':' .. id
+    if redis.call('HINCRBY', KEYS[1], field, delta) <= 0 then
+        redis.call('HDEL', KEYS[1], field)
+    end
+    if seen[kind] then
+        redis.call('ZADD', seen[kind], ARGV[2], id)
+    end
+    result[#result + 1] = count
+end
+return result
+"""
+
+# Undo everything a worker counted. KEYS = worker hash, worker set; ARGV = worker id
+PRESENCE_REAP_SCRIPT = PRESENCE_TARGETS + """
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    local kind, id = string.match(fields[i], '^(%a):(.*)$')
+    if redis.call('HINCRBY', targets[kind], id, -tonumber(fields[i + 1])) <= 0 then
+        redis.call('HDEL', targets[kind], id)
+    end
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+return #fields / 2
+"""
+
+# Companion session capacity. Shared KEYS: sessions per companion (hash), worker load (zset),
+# lease expiry (zset), lease details (hash), average session seconds per companion (hash)
+CAPACITY_KEYS = ["capacity:sessions", "capacity:workers", "capacity:leases", "capacity:lease", "capacity:durations"]
+
+def capacity_admit_keys(companion_id: str) -> List[str]:
+    """KEYS for CAPACITY_ADMIT_SCRIPT"""
+    return CAPACITY_KEYS + [f"capacity:queue:{companion_id}", "capacity:waiting", "capacity:tickets",
+                            "capacity:heartbeats"]
+
+CAPACITY_RELEASE_FUNCTION = """
+local function release(room)
+    local lease = redis.call('HGET', KEYS[4], room)
+    if not lease then
+        return nil
+    end
+    lease = cjson.decode(lease)
+    redis.call('HDEL', KEYS[4], room)
+    redis.call('ZREM', KEYS[3], room)
+    if redis.call('HINCRBY', KEYS[1], lease.c, -1) <= 0 then
+        redis.call('HDEL', KEYS[1], lease.c)
+    end
+    if tonumber(redis.call('ZSCORE', KEYS[2], lease.w) or 0) > 0 then
+        redis.call('ZINCRBY', KEYS[2], -1, lease.w)
+    end
+    return lease
+end
+"""
+
+# Admit a session or keep it queued. KEYS = CAPACITY_KEYS + companion queue (zset), waiter
+# last-poll times (hash), ticket details (hash), worker heartbeat expiry (zset). ARGV = room id, companion id, now, lease expiry,
+# companion limit, worker limit, ticket id, ticket JSON (empty when already queued),
+# stale-before timestamp, queue max (0 = unbounded, -1 = refuse instead of queueing).
+# Returns {1, worker}, {0, position, average seconds}, {-1} when the queue is full (or
+# queueing is refused) or {-2} when the ticket is no longer queued.
+CAPACITY_ADMIT_SCRIPT = CAPACITY_RELEASE_FUNCTION + """
+local now = tonumber(ARGV[3])
+local ticket = ARGV[7]
+local fresh = ARGV[8] ~= ''
+
+-- Sessions whose room expired without ending
+for _, room in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, 16)) do
+    release(room)
+end
+
+local function wait()
+    if fresh then
+        local queue_max = tonumber(ARGV[10])
+        if queue_max < 0 or (queue_max > 0 and redis.call('ZCARD', KEYS[6]) >= queue_max) then
+            return {-1}
+        end
+        redis.call('ZADD', KEYS[6], now, ticket)
+        redis.call('HSET', KEYS[8], ticket, ARGV[8])
+    end
+    redis.call('HSET', KEYS[7], ticket, now)
+    return {0, redis.call('ZRANK', KEYS[6], ticket), redis.call('HGET', KEYS[5], ARGV[2])}
+end
+
+if not fresh and not redis.call('ZSCORE', KEYS[6], ticket) then
+    return {-2}
+end
+
+-- Waiters that stopped polling give up their place
+local head
+while true do
+    head = redis.call('ZRANGE', KEYS[6], 0, 0)[1]
+    if not head or head == ticket or tonumber(redis.call('HGET', KEYS[7], head) or 0) >= tonumber(ARGV[9]) then
+        break
+    end
+    redis.call('ZREM', KEYS[6], head)
+    redis.call('HDEL', KEYS[7], head)
+    redis.call('HDEL', KEYS[8], head)
+end
+
+-- First come, first served: only the head of the queue may take a free slot
+if head and head ~= ticket then
+    return wait()
+end
+local limit = tonumber(ARGV[5])
+if limit > 0 and tonumber(redis.call('HGET', KEYS[1], ARGV[2]) or 0) >= limit then
+    return wait()
+end
+
+-- Least-loaded live worker; dead workers are dropped as they surface
+local worker, load = '', 0
+while true do
+    local top = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if #top == 0 then
+        break
+    end
+    if tonumber(redis.call('ZSCORE', KEYS[9], top[1]) or 0) > now then
+        worker, load = top[1], tonumber(top[2])
+        break
+    end
+    redis.call('ZREM', KEYS[2], top[1])
+    redis.call('ZREM', KEYS[9], top[1])
+end
+if worker ~= '' and tonumber(ARGV[6]) > 0 and load >= tonumber(ARGV[6]) then
+    return wait()
+end
+
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+if worker ~= '' then
+    redis.call('ZINCRBY', KEYS[2], 1, worker)
+end
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[1], cjson.encode({c = ARGV[2], w = worker, t = now}))
+redis.call('ZREM', KEYS[6], ticket)
+redis.call('HDEL', KEYS[7], ticket)
+redis.call('HDEL', KEYS[8], ticket)
+return {1, worker}
+"""
+
+# End a session and fold its length into the companion's average. KEYS = CAPACITY_KEYS;
+# ARGV = room id, now. Returns the companion id, or nil if the room held no session.
+CAPACITY_RELEASE_SCRIPT = CAPACITY_RELEASE_FUNCTION + """
+local lease = release(ARGV[1])
+if not lease then
+    return nil
+end
+local seconds = tonumber(ARGV[2]) - lease.t
+local average = tonumber(redis.call('HGET', KEYS[5], lease.c) or seconds)
+redis.call('HSET', KEYS[5], lease.c, tostring(0.8 * average + 0.2 * seconds))
+return lease.c
+"""
+
+# Move a session's load to the worker holding its sockets. KEYS = CAPACITY_KEYS; ARGV = room id,
+# worker id. Returns 1 if the session moved, 0 if it was already there or holds no lease.
+CAPACITY_CLAIM_SCRIPT = """
+local lease = redis.call('HGET', KEYS[4], ARGV[1])
+if not lease then
+    return 0
+end
+lease = cjson.decode(lease)
+if lease.w == ARGV[2] then
+    return 0
+end
+if lease.w ~= '' and tonumber(redis.call('ZSCORE', KEYS[2], lease.w) or 0) > 0 then
+    redis.call('ZINCRBY', KEYS[2], -1, lease.w)
+end
+redis.call('ZINCRBY', KEYS[2], 1, ARGV[2])
+lease.w = ARGV[2]
+redis.call('HSET', KEYS[4], ARGV[1], cjson.encode(lease))
+return 1
+"""
+
+# Number of pipeline commands _queue_room issues per room
+ROOM_WRITE_COMMANDS = 4
+
+def new_room_ids(count: int) -> List[str]:
+    """Random room ids from one urandom call instead of one uuid4() per room"""
+    id_bytes = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=id_bytes[i * 16:(i + 1) * 16], version=4)) for i in range(count)]
 
 class RedisManager:
     def __init__(self):
         self.redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self._transition_script = self.redis_client.register_script(TRANSITION_SCRIPT)
+        self._context_append_script = self.redis_client.register_script(CONTEXT_APPEND_SCRIPT)
+        self._context_commit_script = self.redis_client.register_script(CONTEXT_COMMIT_SCRIPT)
+        self._context_release_script = self.redis_client.register_script(CONTEXT_RELEASE_SCRIPT)
+        self._presence_apply_script = self.redis_client.register_script(PRESENCE_APPLY_SCRIPT)
+        self._presence_reap_script = self.redis_client.register_script(PRESENCE_REAP_SCRIPT)
+        self._capacity_admit_script = self.redis_client.register_script(CAPACITY_ADMIT_SCRIPT)
+        self._capacity_release_script = self.redis_client.register_script(CAPACITY_RELEASE_SCRIPT)
+        self._capacity_claim_script = self.redis_client.register_script(CAPACITY_CLAIM_SCRIPT)
     
-    async def create_room(self, companion_id: str, user_id: str, expire_minutes: int = 60) -> VideoRoom:
+    @traced_call("redis.create_room")
+    async def create_room(self, companion_id: str, user_id: str, expire_minutes: int = 60,
+                          room_id: Optional[str] = None) -> VideoRoom:
         """Create a new video room"""
-        room_id = str(uuid.uuid4())
-        expires_at = datetime.utcnow() + timedelta(minutes=expire_minutes)
+        room = self._new_room(room_id or str(uuid.uuid4()), companion_id, user_id, expire_minutes)
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        self._queue_room(pipe, room, expire_minutes)
+        pipe.execute()
+        
+        return room
+    
+    @traced_call("redis.create_rooms")
+    async def create_rooms(self, requests: List[Tuple[str, str, int]],
+                           room_ids: Optional[List[str]] = None) -> List[Union[VideoRoom, Exception]]:
+        """Create many rooms from (companion_id, user_id, expire_minutes) in one pipeline.
+        
+        Returns one entry per request: the room, or the error Redis reported
+        for its writes.
+        """
+        if room_ids is None:
+            room_ids = new_room_ids(len(requests))
+        rooms = [
+            self._new_room(room_id, companion_id, user_id, expire_minutes)
+            for room_id, (companion_id, user_id, expire_minutes) in zip(room_ids, requests)
+        ]
         
-        room = VideoRoom(
+        pipe = self.redis_client.pipeline(transaction=False)
+        for room, (_, _, expire_minutes) in zip(rooms, requests):
+            self._queue_room(pipe, room, expire_minutes)
+        replies = pipe.execute(raise_on_error=False)
+        
+        results: List[Union[VideoRoom, Exception]] = []
+        for i, room in enumerate(rooms):
+            errors = [reply for reply in replies[i * ROOM_WRITE_COMMANDS:(i + 1) * ROOM_WRITE_COMMANDS] if isinstance(reply, Exception)]
+            results.append(errors[0] if errors else room)
+        return results
+    
+    def _new_room(self, room_id: str, companion_id: str, user_id: str, expire_minutes: int) -> VideoRoom:
+        now = datetime.utcnow()
+        return VideoRoom(
             roomId=room_id,
             companionId=companion_id,
             userId=user_id,
-            expiresAt=expires_at,
-            status=RoomStatus.ACTIVE
+            expiresAt=now + timedelta(minutes=expire_minutes),
+            status=RoomStatus.CREATED,
+            createdAt=now
         )
-        
+    
+    def _queue_room(self, pipe, room: VideoRoom, expire_minutes: int) -> None:
+        """Queue the writes for a new room (ROOM_WRITE_COMMANDS commands) on a pipeline"""
         # Store room data in Redis
-        room_key = f"room:{room_id}"
-        self.redis_client.hset(room_key, mapping={
+        room_key = f"room:{room.roomId}"
+        fields = {
             "roomId": room.roomId,
             "companionId": room.companionId,
             "userId": room.userId,
             "expiresAt": room.expiresAt.isoformat(),
             "status": room.status.value,
             "createdAt": room.createdAt.isoformat()
-        })
+        }
+        pipe.hset(room_key, mapping=fields)
         
         # Set expiration
-        self.redis_client.expire(room_key, expire_minutes * 60)
+        pipe.expire(room_key, expire_minutes * 60)
         
-        return room
+        # Start the room's event log
+        events_key = f"room_events:{room.roomId}"
+        pipe.rpush(events_key, json.dumps({
+            "event": "created",
+            "status": room.status.value,
+            "at": time.time()
+        }))
+        pipe.expire(events_key, expire_minutes * 60)
     
+    @traced_call("redis.get_room")
     async def get_room(self, room_id: str) -> Optional[VideoRoom]:
         """Get room information"""
         room_key = f"room:{room_id}"
@@ -47,25 +370,64 @@ class RedisManager:
         if not room_data:
             return None
         
-        return VideoRoom(
-            roomId=room_data["roomId"],
-            companionId=room_data["companionId"],
-            userId=room_data["userId"],
-            expiresAt=datetime.fromisoformat(room_data["expiresAt"]),
-            status=RoomStatus(room_data["status"]),
-            createdAt=datetime.fromisoformat(room_data["createdAt"])
-        )
+        # Validating the hash as-is lets pydantic-core parse the timestamps and status
+        # instead of doing it in Python first
+        return VideoRoom.model_validate(room_data)
+    
+    async def get_room_status(self, room_id: str) -> Optional[str]:
+        """Status of a room, None if it does not exist (or has expired)"""
+        return self.redis_client.hget(f"room:{room_id}", "status")
     
+    @traced_call("redis.update_room_status")
     async def update_room_status(self, room_id: str, status: RoomStatus) -> bool:
         """Update room status"""
         room_key = f"room:{room_id}"
         return bool(self.redis_client.hset(room_key, "status", status.value))
     
+    @traced_call("redis.transition_room_status")
+    async def transition_room_status(
+        self,
+        room_id: str,
+        allowed_from: List[str],
+        status: str,
+        event: Dict[str, Any]
+    ) -> Optional[str]:
+        """Set room status only if the current one is in allowed_from, logging the event.
+        
+        Returns the previous status, or None if the room is missing or the
+        transition is not allowed.
+        """
+        previous = self._transition_script(
+            keys=[f"room:{room_id}", f"room_events:{room_id}"],
+            args=[status, json.dumps(event), *allowed_from]
+        )
+        return previous or None
+    
+    @traced_call("redis.append_room_event")
+    async def append_room_event(self, room_id: str, event: Dict[str, Any]) -> None:
+        """Append an event to the room's log, keeping the room's TTL"""
+        events_key = f"room_events:{room_id}"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(events_key, json.dumps(event))
+        pipe.ttl(f"room:{room_id}")
+        _, ttl = pipe.execute()
+        # Rooms without a TTL (or already gone) keep their log for the default session length
+        self.redis_client.expire(events_key, ttl if ttl and ttl > 0 else settings.SESSION_EXPIRE_MINUTES * 60)
+    
+    async def get_room_events(self, room_id: str) -> List[Dict[str, Any]]:
+        """Get a room's event log, oldest first"""
+        events = self.redis_client.lrange(f"room_events:{room_id}", 0, -1)
+        return [json.loads(event) for event in events]
+    
     async def delete_room(self, room_id: str) -> bool:
         """Delete a room"""
         room_key = f"room:{room_id}"
-        return bool(self.redis_client.delete(room_key))
+        return bool(self.redis_client.delete(
+            room_key, f"room_events:{room_id}",
+            f"context:{room_id}", f"context:{room_id}:turns", f"context:{room_id}:overflow"
+        ))
     
+    @traced_call("redis.store_chat_message")
     async def store_chat_message(self, room_id: str, message_data: Dict[str, Any]) -> None:
         """Store chat message"""
         message_key = f"chat:{room_id}"
@@ -79,6 +441,7 @@ class RedisManager:
         messages = self.redis_client.lrange(message_key, 0, limit - 1)
         return [json.loads(msg) for msg in messages]
     
+    @traced_call("redis.store_webrtc_signal")
     async def store_webrtc_signal(self, room_id: str, signal_data: Dict[str, Any]) -> None:
         """Store WebRTC signaling data"""
         signal_key = f"signal:{room_id}"
@@ -89,8 +452,237 @@ class RedisManager:
     async def get_webrtc_signals(self, room_id: str) -> List[Dict[str, Any]]:
         """Get WebRTC signaling data for a room"""
         signal_key = f"signal:{room_id}"
-        signals = self.redis_client.lrange(signal_key, 0, -1)
-        return [json.loads(signal) for signal in signals]
+        signals = [json.loads(signal) for signal in self.redis_client.lrange(signal_key, 0, -1)]
+        for signal in signals:
+            if "sdpz" in signal:
+                signal["sdp"] = decompress_sdp(signal.pop("sdpz"))
+        return signals
+    
+    @traced_call("redis.store_telemetry")
+    async def store_telemetry(self, worker_id: str, telemetry: Dict[str, Dict[str, Any]]) -> None:
+        """Store one worker's call-quality totals and rollups per room, expiring together with the room"""
+        room_ids = list(telemetry)
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.ttl(f"room:{room_id}")
+        ttls = pipe.execute()
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for room_id, ttl in zip(room_ids, ttls):
+            # Each worker writes only its own share; get_telemetry reads them all
+            telemetry_key = f"telemetry:{room_id}:{worker_id}"
+            workers_key = f"telemetry:{room_id}:workers"
+            pipe.hset(telemetry_key, mapping={
+                field: json.dumps(value, separators=(",", ":"))
+                for field, value in telemetry[room_id].items()
+            })
+            pipe.sadd(workers_key, worker_id)
+            # Rooms without a TTL (or already gone) keep telemetry for the default session length
+            ttl = ttl if ttl and ttl > 0 else settings.SESSION_EXPIRE_MINUTES * 60
+            pipe.expire(telemetry_key, ttl)
+            pipe.expire(workers_key, ttl)
+        pipe.execute()
+    
+    async def get_telemetry(self, room_id: str, resolution: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Every worker's stored totals (and optionally buckets of one resolution) for a room"""
+        worker_ids = list(self.redis_client.smembers(f"telemetry:{room_id}:workers"))
+        fields = ["state", resolution] if resolution else ["state"]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for worker_id in worker_ids:
+            pipe.hmget(f"telemetry:{room_id}:{worker_id}", fields)
+        
+        shares = []
+        for values in pipe.execute() if worker_ids else []:
+            if values[0] is None:
+                continue
+            share = {"state": json.loads(values[0])}
+            if resolution:
+                share["series"] = json.loads(values[1]) if values[1] else []
+            shares.append(share)
+        return shares
+
+    @traced_call("redis.append_context_turn")
+    async def append_context_turn(self, room_id: str, turn: Dict[str, Any], tokens: int, budget: int) -> int:
+        """Append a turn to the room's context window; returns turns awaiting summarization"""
+        encoded = f"{tokens}|{json.dumps(turn, separators=(',', ':'))}"
+        return self._context_append_script(
+            keys=[f"context:{room_id}:turns", f"context:{room_id}", f"context:{room_id}:overflow", f"room:{room_id}"],
+            args=[encoded, tokens, budget, settings.SESSION_EXPIRE_MINUTES * 60]
+        )
+    
+    @traced_call("redis.get_context")
+    async def get_context(self, room_id: str, user_id: Optional[str], companion_id: str) -> Tuple[str, List[Dict[str, Any]], str]:
+        """Rolling summary, context window and long-term memory in one round trip"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hget(f"context:{room_id}", "summary")
+        pipe.lrange(f"context:{room_id}:turns", 0, -1)
+        pipe.get(f"memory:{user_id}:{companion_id}")
+        summary, turns, memory = pipe.execute()
+        return summary or "", [json.loads(turn.partition("|")[2]) for turn in turns], memory or ""
+    
+    async def claim_context_overflow(self, room_id: str,
+                                     lock_seconds: int = 30) -> Optional[Tuple[str, str, List[Dict[str, Any]]]]:
+        """Lock a room's summarization and read its summary and overflow turns.
+        
+        Returns (lock token, summary, turns), or None when another worker
+        holds the lock.
+        """
+        token = uuid.uuid4().hex
+        if not self.redis_client.set(f"context:{room_id}:lock", token, nx=True, ex=lock_seconds):
+            return None
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hget(f"context:{room_id}", "summary")
+        pipe.lrange(f"context:{room_id}:overflow", 0, -1)
+        summary, turns = pipe.execute()
+        return token, summary or "", [json.loads(turn.partition("|")[2]) for turn in turns]
+    
+    async def commit_context_summary(self, room_id: str, token: str, summary: str, consumed: int) -> bool:
+        """Store a new rolling summary, drop the turns it covers and release the lock; False if the lock was lost"""
+        return bool(self._context_commit_script(
+            keys=[f"context:{room_id}", f"context:{room_id}:overflow", f"context:{room_id}:lock"],
+            args=[token, summary, consumed]
+        ))
+    
+    async def release_context_lock(self, room_id: str, token: str) -> None:
+        self._context_release_script(keys=[f"context:{room_id}:lock"], args=[token])
+    
+    async def store_memory(self, user_id: str, companion_id: str, memory: str, ttl_seconds: int) -> None:
+        self.redis_client.set(f"memory:{user_id}:{companion_id}", memory, ex=ttl_seconds)
+
+    @traced_call("redis.apply_presence")
+    async def apply_presence(self, worker_id: str, deltas: List[Tuple[str, str, int]]) -> List[int]:
+        """Apply (kind, id, delta) presence changes for a worker; returns the new counts"""
+        args: List[Any] = [worker_id, time.time()]
+        for kind, item_id, delta in deltas:
+            args.extend((kind, item_id, delta))
+        return self._presence_apply_script(keys=[f"presence:worker:{worker_id}", "presence:workers"], args=args)
+    
+    async def heartbeat_presence(self, worker_id: str, ttl_seconds: int) -> bool:
+        """Refresh a worker's heartbeat; False if its presence is not (or no longer) counted"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(f"presence:heartbeat:{worker_id}", "1", ex=ttl_seconds)
+        pipe.sismember("presence:workers", worker_id)
+        return bool(pipe.execute()[1])
+    
+    async def reap_presence(self, live_worker_id: Optional[str] = None) -> int:
+        """Remove the presence counted by workers whose heartbeat has expired"""
+        workers = [worker for worker in self.redis_client.smembers("presence:workers") if worker != live_worker_id]
+        if not workers:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for worker in workers:
+            pipe.exists(f"presence:heartbeat:{worker}")
+        alive = pipe.execute()
+        
+        reaped = 0
+        for worker, is_alive in zip(workers, alive):
+            if not is_alive:
+                reaped += self._presence_reap_script(keys=[f"presence:worker:{worker}", "presence:workers"], args=[worker])
+        return reaped
+    
+    async def prune_last_seen(self, before: float) -> None:
+        """Forget last-seen times older than a timestamp"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zremrangebyscore("presence:seen:users", "-inf", before)
+        pipe.zremrangebyscore("presence:seen:companions", "-inf", before)
+        pipe.execute()
+    
+    async def remove_presence_worker(self, worker_id: str) -> None:
+        """Withdraw everything a worker counted (clean shutdown)"""
+        self._presence_reap_script(keys=[f"presence:worker:{worker_id}", "presence:workers"], args=[worker_id])
+        self.redis_client.delete(f"presence:heartbeat:{worker_id}")
+    
+    @traced_call("redis.query_presence")
+    async def query_presence(self, user_ids: List[str], companion_ids: List[str], room_ids: List[str]) -> Dict[str, List[Any]]:
+        """Online counts and last-seen scores for many ids in one round trip"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        queued = []
+        for name, key, ids in (
+            ("users", "presence:users", user_ids),
+            ("userSeen", "presence:seen:users", user_ids),
+            ("companions", "presence:companions", companion_ids),
+            ("companionSeen", "presence:seen:companions", companion_ids),
+            ("rooms", "presence:rooms", room_ids)
+        ):
+            if ids:
+                if name.endswith("Seen"):
+                    pipe.zmscore(key, ids)
+                else:
+                    pipe.hmget(key, ids)
+                queued.append(name)
+        results = dict(zip(queued, pipe.execute())) if queued else {}
+        return {name: results.get(name, []) for name in ("users", "userSeen", "companions", "companionSeen", "rooms")}
+
+    @traced_call("redis.admit_session")
+    async def admit_session(self, room_id: str, companion_id: str, lease_expires_at: float, companion_limit: int,
+                            worker_limit: int, ticket_id: str, ticket: Optional[Dict[str, Any]],
+                            stale_before: float, queue_max: int) -> List[Any]:
+        """Admit a companion session or (re)queue its ticket; see CAPACITY_ADMIT_SCRIPT"""
+        return self._capacity_admit_script(
+            keys=capacity_admit_keys(companion_id),
+            args=[room_id, companion_id, time.time(), lease_expires_at, companion_limit, worker_limit,
+                  ticket_id, json.dumps(ticket) if ticket else "", stale_before, queue_max]
+        )
+    
+    @traced_call("redis.admit_sessions")
+    async def admit_sessions(self, sessions: List[Tuple[str, str, float, int]], worker_limit: int,
+                             stale_before: float) -> List[Any]:
+        """Admit many companion sessions in one pipeline, refusing instead of queueing those at capacity.
+        
+        sessions are (room id, companion id, lease expiry, companion limit);
+        each gets the CAPACITY_ADMIT_SCRIPT result, or the error Redis
+        reported for it.
+        """
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for room_id, companion_id, lease_expires_at, companion_limit in sessions:
+            # The room id doubles as the ticket id; a refused ticket is never stored
+            self._capacity_admit_script(
+                keys=capacity_admit_keys(companion_id),
+                args=[room_id, companion_id, now, lease_expires_at, companion_limit, worker_limit,
+                      room_id, "{}", stale_before, -1],
+                client=pipe
+            )
+        return pipe.execute(raise_on_error=False)
+    
+    @traced_call("redis.release_session")
+    async def release_session(self, room_id: str) -> Optional[str]:
+        """End a room's companion session; returns the companion id if it held one"""
+        return self._capacity_release_script(keys=CAPACITY_KEYS, args=[room_id, time.time()])
+    
+    @traced_call("redis.claim_session")
+    async def claim_session(self, room_id: str, worker_id: str) -> bool:
+        """Count a room's companion session against the worker its sockets joined; see CAPACITY_CLAIM_SCRIPT"""
+        return bool(self._capacity_claim_script(keys=CAPACITY_KEYS, args=[room_id, worker_id]))
+    
+    async def get_capacity_ticket(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        ticket = self.redis_client.hget("capacity:tickets", ticket_id)
+        return json.loads(ticket) if ticket else None
+    
+    async def cancel_capacity_ticket(self, ticket_id: str, companion_id: str) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrem(f"capacity:queue:{companion_id}", ticket_id)
+        pipe.hdel("capacity:waiting", ticket_id)
+        pipe.hdel("capacity:tickets", ticket_id)
+        pipe.execute()
+    
+    async def heartbeat_capacity_worker(self, worker_id: str, ttl_seconds: int) -> None:
+        """Keep a worker eligible for room placement"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zadd("capacity:heartbeats", {worker_id: time.time() + ttl_seconds})
+        pipe.zadd("capacity:workers", {worker_id: 0}, nx=True)
+        pipe.execute()
+    
+    async def remove_capacity_worker(self, worker_id: str) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrem("capacity:workers", worker_id)
+        pipe.zrem("capacity:heartbeats", worker_id)
+        pipe.execute()
+    
+    async def get_capacity_workers(self, limit: int = 100) -> List[Tuple[str, float]]:
+        """Placement candidates, least loaded first"""
+        return self.redis_client.zrange("capacity:workers", 0, limit - 1, withscores=True)
 
 # Global Redis manager instance
 redis_manager = RedisManager()
@@ -0,0 +1,85 @@
+import time
+import logging
+from typing import Any, Dict, FrozenSet, List, Optional
+from models import RoomStatus
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+# Allowed transitions: target status -> statuses it may be entered from.
+# ACTIVE and INACTIVE are the pre-lifecycle statuses still found on old rooms.
+ALLOWED_SOURCES: Dict[RoomStatus, FrozenSet[RoomStatus]] = {
+    RoomStatus.WAITING: frozenset({RoomStatus.CREATED, RoomStatus.ACTIVE}),
+    RoomStatus.CONNECTED: frozenset({RoomStatus.WAITING}),
+    RoomStatus.ENDED: frozenset({RoomStatus.CREATED, RoomStatus.ACTIVE, RoomStatus.WAITING, RoomStatus.CONNECTED}),
+    RoomStatus.EXPIRED: frozenset({RoomStatus.CREATED, RoomStatus.ACTIVE, RoomStatus.WAITING, RoomStatus.CONNECTED}),
+}
+
+TERMINAL_STATUSES = frozenset({RoomStatus.ENDED, RoomStatus.EXPIRED, RoomStatus.INACTIVE})
+
+# Pre-encoded source lists handed to the compare-and-set script
+_SOURCE_VALUES = {target: [status.value for status in sources] for target, sources in ALLOWED_SOURCES.items()}
+
+def can_transition(current: RoomStatus, target: RoomStatus) -> bool:
+    """Check whether a room may move from current to target"""
+    return current in ALLOWED_SOURCES.get(target, frozenset())
+
+def compute_setup_metrics(events: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+    """Derive call setup latencies (ms) from a room's event log.
+    
+    joinToAnswerMs runs from the last join before the first answer (the
+    moment both peers were present) to that answer; answerToConnectedMs
+    from the first answer to the first connected report.
+    """
+    created_at = last_join_at = answer_at = connected_at = None
+    for event in events:
+        name, at = event.get("event"), event.get("at")
+        if name == "created" and created_at is None:
+            created_at = at
+        elif name == "join" and answer_at is None:
+            last_join_at = at
+        elif name == "answer" and answer_at is None:
+            answer_at = at
+        elif name == "connected" and connected_at is None:
+            connected_at = at
+    
+    def elapsed(start: Optional[float], end: Optional[float]) -> Optional[float]:
+        if start is None or end is None:
+            return None
+        return round((end - start) * 1000, 1)
+    
+    return {
+        "joinToAnswerMs": elapsed(last_join_at, answer_at),
+        "answerToConnectedMs": elapsed(answer_at, connected_at),
+        "createdToConnectedMs": elapsed(created_at, connected_at)
+    }
+
+class RoomLifecycle:
+    """Enforces room status transitions in storage and keeps the room event log"""
+    
+    async def transition(self, room_id: str, target: RoomStatus, event: str, **details: Any) -> bool:
+        """Atomically move a room to target if its stored status allows it.
+        
+        The status check, status write and event log append happen in one
+        compare-and-set on Redis, so concurrent handlers on any worker can't
+        double-end a room or revive an ended one.
+        """
+        record = {"event": event, "status": target.value, "at": time.time(), **details}
+        previous = await redis_manager.transition_room_status(room_id, _SOURCE_VALUES[target], target.value, record)
+        if previous is None:
+            logger.info(f"Rejected transition of room {room_id} to {target.value} on {event}")
+            return False
+        
+        logger.info(f"Room {room_id} {previous} -> {target.value} on {event}")
+        return True
+    
+    async def record_event(self, room_id: str, event: str, **details: Any) -> None:
+        """Append a non-transition event (join, offer, answer...) to the log"""
+        await redis_manager.append_room_event(room_id, {"event": event, "at": time.time(), **details})
+    
+    async def get_events(self, room_id: str) -> List[Dict[str, Any]]:
+        """Full event log of a room, oldest first"""
+        return await redis_manager.get_room_events(room_id)
+
+# Global room lifecycle instance
+room_lifecycle = RoomLifecycle()
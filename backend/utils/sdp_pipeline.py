@@ -0,0 +1,238 @@
+import zlib
+import base64
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from config import settings
+from utils.media_adaptation import media_adaptation_service
+
+logger = logging.getLogger(__name__)
+
+# Codecs that travel with a kept codec rather than being negotiated on their own
+AUXILIARY_CODECS = {"rtx", "telephone-event"}
+
+# Legacy per-SSRC attributes browsers still emit but nothing reads
+REDUNDANT_SSRC_ATTRIBUTES = ("mslabel:", "label:")
+
+class SdpPolicy:
+    """Munging rules for offers and answers"""
+    
+    def __init__(
+        self,
+        preferred_codecs: Dict[str, List[str]],
+        strip_codecs: bool = True,
+        allowed_extmaps: Optional[Set[str]] = None,
+        max_kbps: Optional[Dict[str, int]] = None
+    ):
+        self.preferred_codecs = {kind: [codec.lower() for codec in codecs] for kind, codecs in preferred_codecs.items()}
+        self.strip_codecs = strip_codecs
+        self.allowed_extmaps = allowed_extmaps
+        self.max_kbps = max_kbps or {}
+    
+    @classmethod
+    def from_settings(cls) -> "SdpPolicy":
+        def split(value: str) -> List[str]:
+            return [item.strip() for item in value.split(",") if item.strip()]
+        
+        max_kbps = {}
+        if settings.SDP_VIDEO_MAX_KBPS:
+            max_kbps["video"] = settings.SDP_VIDEO_MAX_KBPS
+        if settings.SDP_AUDIO_MAX_KBPS:
+            max_kbps["audio"] = settings.SDP_AUDIO_MAX_KBPS
+        
+        return cls(
+            preferred_codecs={
+                "video": split(settings.SDP_PREFERRED_VIDEO_CODECS),
+                "audio": split(settings.SDP_PREFERRED_AUDIO_CODECS)
+            },
+            strip_codecs=settings.SDP_STRIP_CODECS,
+            allowed_extmaps=set(split(settings.SDP_ALLOWED_EXTMAPS)) or None,
+            max_kbps=max_kbps
+        )
+
+class MediaSection:
+    """One m= section: its m-line fields, payload types and attribute lines"""
+    
+    __slots__ = ("kind", "port", "proto", "payload_types", "lines", "codecs", "rtx_apt")
+    
+    def __init__(self, m_line: str):
+        fields = m_line[2:].split(" ")
+        self.kind = fields[0]
+        self.port = fields[1] if len(fields) > 1 else "0"
+        self.proto = fields[2] if len(fields) > 2 else ""
+        self.payload_types = fields[3:]
+        self.lines: List[str] = []
+        # payload type -> lowercase codec name, rtx payload type -> associated payload type
+        self.codecs: Dict[str, str] = {}
+        self.rtx_apt: Dict[str, str] = {}
+    
+    def add_line(self, line: str) -> None:
+        """Append an attribute line, noting codec mappings as they stream past"""
+        if line.startswith("a=rtpmap:"):
+            payload_type, _, encoding = line[9:].partition(" ")
+            self.codecs[payload_type] = encoding.partition("/")[0].lower()
+        elif line.startswith("a=fmtp:"):
+            payload_type, _, params = line[7:].partition(" ")
+            for param in params.split(";"):
+                key, _, value = param.strip().partition("=")
+                if key == "apt":
+                    self.rtx_apt[payload_type] = value
+        self.lines.append(line)
+    
+    def m_line(self) -> str:
+        return " ".join(["m=" + self.kind, self.port, self.proto] + self.payload_types)
+
+def parse_sdp(sdp: str) -> Tuple[List[str], List[MediaSection]]:
+    """Single pass over the SDP, splitting session lines from media sections"""
+    session_lines: List[str] = []
+    sections: List[MediaSection] = []
+    current: Optional[MediaSection] = None
+    
+    start = 0
+    length = len(sdp)
+    while start < length:
+        end = sdp.find("\n", start)
+        if end == -1:
+            end = length
+        line = sdp[start:end].rstrip("\r")
+        start = end + 1
+        if not line:
+            continue
+        
+        if line.startswith("m="):
+            current = MediaSection(line)
+            sections.append(current)
+        elif current is None:
+            session_lines.append(line)
+        else:
+            current.add_line(line)
+    
+    return session_lines, sections
+
+def serialize_sdp(session_lines: List[str], sections: List[MediaSection]) -> str:
+    lines = list(session_lines)
+    for section in sections:
+        lines.append(section.m_line())
+        lines.extend(section.lines)
+    return "\r\n".join(lines) + "\r\n"
+
+def _payload_type_of(line: str) -> Optional[str]:
+    """Payload type an rtpmap/fmtp/rtcp-fb line refers to"""
+    for prefix in ("a=rtpmap:", "a=fmtp:", "a=rtcp-fb:"):
+        if line.startswith(prefix):
+            return line[len(prefix):].partition(" ")[0]
+    return None
+
+def filter_codecs(section: MediaSection, policy: SdpPolicy) -> None:
+    """Order preferred codecs first and, if configured, drop the rest"""
+    preferred = policy.preferred_codecs.get(section.kind)
+    if not preferred or section.port == "0":
+        return
+    
+    ranked = [pt for codec in preferred for pt in section.payload_types if section.codecs.get(pt) == codec]
+    if not ranked:
+        # Nothing we prefer was offered; leave the section as negotiated
+        return
+    
+    if not policy.strip_codecs:
+        section.payload_types = ranked + [pt for pt in section.payload_types if pt not in ranked]
+        return
+    
+    kept = set(ranked)
+    for pt in section.payload_types:
+        codec = section.codecs.get(pt)
+        if codec == "rtx" and section.rtx_apt.get(pt) in kept:
+            ranked.append(pt)
+        elif codec in AUXILIARY_CODECS and codec != "rtx":
+            ranked.append(pt)
+    
+    keep = set(ranked)
+    section.payload_types = ranked
+    lines = []
+    for line in section.lines:
+        payload_type = _payload_type_of(line)
+        # rtcp-fb:* applies to every payload type
+        if payload_type is None or payload_type == "*" or payload_type in keep:
+            lines.append(line)
+    section.lines = lines
+
+def filter_extensions(section: MediaSection, policy: SdpPolicy) -> None:
+    """Drop RTP header extensions that are not on the allowlist"""
+    if policy.allowed_extmaps is None:
+        return
+    lines = []
+    for line in section.lines:
+        if line.startswith("a=extmap:"):
+            # a=extmap:<id>[/<direction>] <uri> [<attributes>]
+            uri = line.split(" ", 2)[1] if " " in line else ""
+            if uri not in policy.allowed_extmaps:
+                continue
+        lines.append(line)
+    section.lines = lines
+
+def strip_redundant(section: MediaSection, policy: SdpPolicy) -> None:
+    """Remove duplicate lines and legacy per-SSRC label attributes"""
+    seen: Set[str] = set()
+    lines = []
+    for line in section.lines:
+        if line in seen:
+            continue
+        if line.startswith("a=ssrc:"):
+            attribute = line.partition(" ")[2]
+            if attribute.startswith(REDUNDANT_SSRC_ATTRIBUTES):
+                continue
+        seen.add(line)
+        lines.append(line)
+    section.lines = lines
+
+def cap_bitrate(section: MediaSection, max_kbps: Optional[int]) -> None:
+    """Replace any b= lines with b=AS/b=TIAS caps, placed after c= as RFC 4566 orders them"""
+    if not max_kbps or section.port == "0" or section.kind not in ("audio", "video"):
+        return
+    lines = [line for line in section.lines if not line.startswith("b=")]
+    caps = [f"b=AS:{max_kbps}", f"b=TIAS:{max_kbps * 1000}"]
+    insert_at = next((i + 1 for i, line in enumerate(lines) if line.startswith("c=")), 0)
+    section.lines = lines[:insert_at] + caps + lines[insert_at:]
+
+class SdpPipeline:
+    """Munges offers/answers: codec filtering, extension allowlist, redundant lines, bitrate caps"""
+    
+    def __init__(self, policy: SdpPolicy):
+        self.policy = policy
+    
+    def process(self, sdp: str, max_kbps: Optional[Dict[str, int]] = None) -> str:
+        """Run every stage over a parsed SDP; max_kbps overrides the policy caps per media kind"""
+        session_lines, sections = parse_sdp(sdp)
+        caps = dict(self.policy.max_kbps)
+        for kind, cap in (max_kbps or {}).items():
+            caps[kind] = min(cap, caps[kind]) if kind in caps else cap
+        
+        for section in sections:
+            filter_codecs(section, self.policy)
+            filter_extensions(section, self.policy)
+            strip_redundant(section, self.policy)
+            cap_bitrate(section, caps.get(section.kind))
+        
+        return serialize_sdp(session_lines, sections)
+    
+    def process_for_room(self, room_id: str, sdp: str) -> str:
+        """Munge an offer/answer, capping video at the room's current media tier"""
+        profile = media_adaptation_service.get_profile(room_id)
+        munged = self.process(sdp, {"video": profile["maxBitrateKbps"]})
+        logger.debug(f"SDP for room {room_id}: {len(sdp)} -> {len(munged)} bytes")
+        return munged
+
+def compress_sdp(sdp: str) -> str:
+    """Compress an SDP for storage in the signal history"""
+    return base64.b64encode(zlib.compress(sdp.encode("utf-8"), 9)).decode("ascii")
+
+def decompress_sdp(data: str) -> str:
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8")
+
+def history_fields(sdp: str) -> Dict[str, str]:
+    """SDP field for a signal history entry, compressed as "sdpz" when enabled"""
+    if settings.SDP_COMPRESS_HISTORY:
+        return {"sdpz": compress_sdp(sdp)}
+    return {"sdp": sdp}
+
+# Global SDP pipeline instance
+sdp_pipeline = SdpPipeline(SdpPolicy.from_settings())
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from importlib import import_module
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from utils.startup_profile import StartupProfile, startup_profile
+
+logger = logging.getLogger(__name__)
+
+class ServiceRegistry:
+    """Services built on first use and started/stopped with the app lifespan.
+    
+    A service is registered as "module:attribute", so neither its module
+    (with whatever heavy dependencies it imports) nor the instance exists
+    until something asks for it: a request handler through dependency(), a
+    socket handler through get(), or the lifespan through start(). Each
+    construction and start is timed in the startup profile.
+    """
+    
+    def __init__(self, profile: StartupProfile):
+        self.profile = profile
+        self._targets: Dict[str, str] = {}
+        self._instances: Dict[str, Any] = {}
+        self._providers: Dict[str, Callable[[], Any]] = {}
+        self._hooks: List[Tuple[str, Optional[Callable[[Any], Any]], Optional[Callable[[Any], Any]]]] = []
+    
+    def register(self, name: str, target: str, start: Optional[Callable[[Any], Any]] = None,
+                 stop: Optional[Callable[[Any], Any]] = None) -> None:
+        """Register a service by "module:attribute"; start/stop hooks run in the lifespan in order"""
+        self._targets[name] = target
+        if start is not None or stop is not None:
+            self._hooks.append((name, start, stop))
+    
+    def get(self, name: str) -> Any:
+        """The service instance, importing and constructing it on first use"""
+        instance = self._instances.get(name)
+        if instance is None:
+            module_name, attribute = self._targets[name].split(":")
+            with self.profile.phase(f"init {name}"):
+                instance = self._instances[name] = getattr(import_module(module_name), attribute)
+        return instance
+    
+    def dependency(self, name: str) -> Callable[[], Any]:
+        """FastAPI dependency providing a service (one callable per name, for dependency_overrides)"""
+        provider = self._providers.get(name)
+        if provider is None:
+            def provider() -> Any:
+                return self.get(name)
+            provider.__name__ = f"get_{name}"
+            self._providers[name] = provider
+        return provider
+    
+    async def start(self) -> None:
+        for name, start, _ in self._hooks:
+            if start is None:
+                continue
+            service = self.get(name)
+            with self.profile.phase(f"start {name}"):
+                result = start(service)
+                if asyncio.iscoroutine(result):
+                    await result
+    
+    async def stop(self) -> None:
+        """Stop started services in reverse order; one failing does not keep the rest running"""
+        for name, _, stop in reversed(self._hooks):
+            if stop is None or name not in self._instances:
+                continue
+            try:
+                result = stop(self._instances[name])
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Failed to stop {name}: {e}")
+
+# Global service registry instance
+services = ServiceRegistry(startup_profile)
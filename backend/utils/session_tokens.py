@@ -0,0 +1,71 @@
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Secrets shipped in config.py and env.example; tokens signed with them could be forged by anyone
+PLACEHOLDER_SECRETS = frozenset({"", "your-secret-key-change-in-production", "your_secret_key_here"})
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class SessionTokens:
+    """Signed, self-contained tokens for resuming room membership after a reconnect.
+    
+    A token carries the room, user, role and companion of a join plus an
+    expiry, signed with HMAC-SHA256, so any worker can restore the session
+    by checking the signature instead of loading the room. Whether the room
+    still exists and has not ended is left to the caller. Resumption is
+    disabled while the secret is a placeholder.
+    """
+    
+    def __init__(self, secret: str, ttl_seconds: int = 3600):
+        self.enabled = secret not in PLACEHOLDER_SECRETS
+        if not self.enabled:
+            logger.warning("SESSION_SECRET_KEY is not set; session resumption disabled")
+        self._key = hashlib.sha256(secret.encode("utf-8")).digest()
+        self.ttl_seconds = ttl_seconds
+    
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()
+    
+    def issue(self, room_id: str, user_id: str, role: str, companion_id: str,
+              room_expires_at: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Token for a joined session, valid until the session TTL or the room's expiry; None when disabled"""
+        if not self.enabled:
+            return None
+        expires_at = int(time.time() + self.ttl_seconds)
+        if room_expires_at is not None:
+            expires_at = min(expires_at, int(room_expires_at))
+        payload = json.dumps({"r": room_id, "u": user_id, "o": role, "c": companion_id, "e": expires_at},
+                             separators=(",", ":")).encode("utf-8")
+        return {"token": f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}", "expiresAt": expires_at}
+    
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """Session claims (roomId, userId, role, companionId, expiresAt) of a valid token"""
+        if not self.enabled:
+            return None
+        try:
+            encoded_payload, encoded_signature = token.split(".")
+            payload = _b64decode(encoded_payload)
+            if not hmac.compare_digest(self._sign(payload), _b64decode(encoded_signature)):
+                return None
+            claims = json.loads(payload)
+            if claims["e"] <= time.time():
+                return None
+            return {"roomId": claims["r"], "userId": claims["u"], "role": claims["o"],
+                    "companionId": claims["c"], "expiresAt": claims["e"]}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+# Global session token instance
+session_tokens = SessionTokens(settings.SESSION_SECRET_KEY, ttl_seconds=settings.SESSION_EXPIRE_MINUTES * 60)
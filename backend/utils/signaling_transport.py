@@ -0,0 +1,129 @@
+import socketio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = ("json", "msgpack", "both")
+
+class SignalingServer:
+    """One or more Socket.IO servers sharing handlers, rooms and emits.
+    
+    Each server owns its own serializer and path, so JSON browsers and
+    msgpack clients can both be served while handlers stay written against
+    a single `sio` object. Emits go to every server; python-socketio encodes
+    each (callback-less) emit once per server and reuses the packet for all
+    recipients in the room.
+    """
+    
+    def __init__(self, servers: List[Tuple[str, socketio.AsyncServer]]):
+        self.servers = servers
+        self.primary = servers[0][1]
+    
+    def event(self, handler: Callable) -> Callable:
+        """Register a handler named after its event on every server"""
+        for _, server in self.servers:
+            server.on(handler.__name__, handler)
+        return handler
+    
+    def on(self, event: str, handler: Optional[Callable] = None):
+        """Register a handler for an event on every server"""
+        def register(func: Callable) -> Callable:
+            for _, server in self.servers:
+                server.on(event, func)
+            return func
+        return register(handler) if handler is not None else register
+    
+    def server_for(self, sid: str, namespace: Optional[str] = None) -> socketio.AsyncServer:
+        """The server a client session is connected to"""
+        if len(self.servers) > 1:
+            for _, server in self.servers:
+                if server.manager.is_connected(sid, namespace or "/"):
+                    return server
+        return self.primary
+    
+    async def emit(self, event: str, data: Any = None, room: Optional[str] = None, skip_sid=None, **kwargs) -> None:
+        """Emit to a room or sid on every server"""
+        for _, server in self.servers:
+            # A sid connected here needs no trip through the message queue to other workers
+            if room is not None and server.manager.is_connected(room, kwargs.get("namespace") or "/"):
+                await server.emit(event, data, room=room, skip_sid=skip_sid, ignore_queue=True, **kwargs)
+                return
+        for _, server in self.servers:
+            await server.emit(event, data, room=room, skip_sid=skip_sid, **kwargs)
+    
+    async def enter_room(self, sid: str, room: str, namespace: Optional[str] = None) -> None:
+        await self.server_for(sid, namespace).enter_room(sid, room, namespace=namespace)
+    
+    async def leave_room(self, sid: str, room: str, namespace: Optional[str] = None) -> None:
+        await self.server_for(sid, namespace).leave_room(sid, room, namespace=namespace)
+    
+    async def disconnect(self, sid: str, namespace: Optional[str] = None) -> None:
+        await self.server_for(sid, namespace).disconnect(sid, namespace=namespace)
+    
+    def asgi_app(self, other_asgi_app) -> socketio.ASGIApp:
+        """Mount every server on its own path in front of the HTTP app"""
+        asgi_app = other_asgi_app
+        for path, server in reversed(self.servers):
+            asgi_app = socketio.ASGIApp(server, asgi_app, socketio_path=path)
+        return asgi_app
+
+def _message_queue_url() -> str:
+    """Redis URL for relaying emits between worker processes, empty when running a single one"""
+    if settings.SOCKETIO_MESSAGE_QUEUE:
+        return settings.SOCKETIO_MESSAGE_QUEUE
+    return settings.REDIS_URL if settings.WORKERS != 1 else ""
+
+def _build_server(serializer: str, channel: str = "socketio") -> socketio.AsyncServer:
+    url = _message_queue_url()
+    return socketio.AsyncServer(
+        async_mode="asgi",
+        # One channel per server: each would otherwise deliver the other's emits a second time
+        client_manager=socketio.AsyncRedisManager(url, channel=channel) if url else None,
+        cors_allowed_origins=settings.CORS_ORIGINS,
+        serializer="msgpack" if serializer == "msgpack" else "default",
+        transports=["websocket"] if settings.SOCKETIO_WEBSOCKET_ONLY else ["polling", "websocket"],
+        ping_interval=settings.SOCKETIO_PING_INTERVAL_SECONDS,
+        ping_timeout=settings.SOCKETIO_PING_TIMEOUT_SECONDS,
+        max_http_buffer_size=settings.SOCKETIO_MAX_HTTP_BUFFER_SIZE,
+        compression_threshold=settings.SOCKETIO_COMPRESSION_THRESHOLD,
+        logger=True,
+        engineio_logger=True
+    )
+
+def websocket_options() -> Dict[str, Any]:
+    """uvicorn options for the WebSocket side of Engine.IO.
+    
+    Frames are read by the ASGI server, not Engine.IO, so the message size
+    limit is applied there too. Compression of WebSocket frames is
+    permessage-deflate, negotiated per connection by the ASGI server;
+    SDP offers and answers (several KB of repetitive text) shrink the most.
+    """
+    return {
+        "ws_max_size": settings.SOCKETIO_MAX_HTTP_BUFFER_SIZE,
+        "ws_per_message_deflate": settings.SOCKETIO_WS_PER_MESSAGE_DEFLATE
+    }
+
+def create_signaling_server() -> SignalingServer:
+    """Build the Socket.IO server(s) for the configured serializer.
+    
+    "json" and "msgpack" serve a single format on the default path; "both"
+    keeps JSON on the default path for existing browsers and adds msgpack
+    on SOCKETIO_MSGPACK_PATH.
+    """
+    serializer = settings.SOCKETIO_SERIALIZER
+    if serializer not in SERIALIZERS:
+        raise ValueError(f"SOCKETIO_SERIALIZER must be one of {SERIALIZERS}, got {serializer!r}")
+    
+    if serializer == "both":
+        servers = [
+            ("socket.io", _build_server("json")),
+            (settings.SOCKETIO_MSGPACK_PATH, _build_server("msgpack", channel="socketio-msgpack"))
+        ]
+    else:
+        servers = [("socket.io", _build_server(serializer))]
+    
+    logger.info(f"Socket.IO serializer: {serializer} ({', '.join('/' + path for path, _ in servers)})"
+                f"{', websocket only' if settings.SOCKETIO_WEBSOCKET_ONLY else ''}")
+    return SignalingServer(servers)
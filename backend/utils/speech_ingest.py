@@ -0,0 +1,272 @@
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from operator import mul
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Called with (text, duration in ms) for every final transcript
+TranscriptHandler = Callable[[str, int], Awaitable[None]]
+
+class STTProvider(ABC):
+    """Transcribes one utterance of 16-bit mono PCM"""
+    
+    name = "base"
+    
+    @abstractmethod
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> str:
+        ...
+
+class LocalSTTProvider(STTProvider):
+    """Deterministic stand-in that reports the utterance length instead of words"""
+    
+    name = "local"
+    
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+    
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> str:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return f"[speech {len(pcm) / (2 * sample_rate):.1f}s]"
+
+def create_provider(name: str) -> Optional[STTProvider]:
+    if name == "off":
+        return None
+    if name == "local":
+        return LocalSTTProvider(settings.STT_LOCAL_DELAY_SECONDS)
+    raise ValueError(f"Unknown STT_PROVIDER {name!r}")
+
+class AudioStream:
+    """Seq-indexed ring of fixed-size PCM frames with energy-based VAD.
+    
+    Frames are written straight into a preallocated buffer at the slot their
+    sequence number maps to, so frames arriving out of order within the
+    jitter window land in place and gaps older than it are played as
+    silence. VAD runs once per frame in sequence order on a memoryview of
+    the slot; only a finished utterance is copied out of the ring.
+    """
+    
+    __slots__ = ("room_id", "user_id", "sample_rate", "frame_bytes", "slots", "ring", "view", "samples",
+                 "arrived", "silence", "next_seq", "first_seq", "highest_seq", "jitter_frames",
+                 "threshold", "start_frames", "hangover_frames", "preroll_frames", "max_frames",
+                 "in_speech", "voiced_run", "silence_run", "utterance_start", "on_transcript",
+                 "frames", "late", "malformed")
+    
+    def __init__(self, room_id: str, user_id: str, sample_rate: int, frame_ms: int, buffer_seconds: float,
+                 jitter_frames: int, threshold: float, start_ms: int, silence_ms: int, preroll_ms: int,
+                 max_utterance_seconds: float, on_transcript: TranscriptHandler):
+        self.room_id = room_id
+        self.user_id = user_id
+        self.sample_rate = sample_rate
+        self.frame_bytes = 2 * sample_rate * frame_ms // 1000
+        self.slots = max(1, int(buffer_seconds * 1000) // frame_ms)
+        self.ring = bytearray(self.frame_bytes * self.slots)
+        self.view = memoryview(self.ring)
+        self.samples = self.view.cast("h")
+        self.arrived = bytearray(self.slots)
+        self.silence = bytes(self.frame_bytes)
+        self.next_seq: Optional[int] = None
+        self.first_seq = 0
+        self.highest_seq = -1
+        self.jitter_frames = jitter_frames
+        # Mean square of the samples a voiced frame exceeds
+        self.threshold = threshold * threshold
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.hangover_frames = max(1, silence_ms // frame_ms)
+        self.preroll_frames = preroll_ms // frame_ms
+        # Leave room for pre-roll and jitter so an open utterance is never overwritten
+        self.max_frames = min(int(max_utterance_seconds * 1000) // frame_ms,
+                              self.slots - self.preroll_frames - jitter_frames - 1)
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silence_run = 0
+        self.utterance_start = 0
+        self.on_transcript = on_transcript
+        self.frames = 0
+        self.late = 0
+        self.malformed = 0
+    
+    def push(self, seq: int, data: bytes) -> Optional[List[bytes]]:
+        """Store one frame and run VAD over every frame now due; returns finished utterances"""
+        if len(data) != self.frame_bytes:
+            self.malformed += 1
+            return None
+        utterances = None
+        if self.next_seq is None:
+            self.next_seq = self.first_seq = seq
+        elif seq < self.next_seq:
+            self.late += 1
+            return None
+        elif seq - (self.utterance_start if self.in_speech else self.next_seq - self.preroll_frames) >= self.slots:
+            # A jump this far ahead (client paused or restarted) would overwrite frames
+            # still needed; close what is open and resume from the new sequence number
+            pcm = self.flush()
+            if pcm:
+                utterances = [pcm]
+            self.arrived[:] = bytes(self.slots)
+            self.next_seq = self.first_seq = seq
+            self.highest_seq = seq - 1
+            self.voiced_run = 0
+        
+        slot = seq % self.slots
+        offset = slot * self.frame_bytes
+        self.view[offset:offset + self.frame_bytes] = data
+        self.arrived[slot] = 1
+        self.frames += 1
+        if seq > self.highest_seq:
+            self.highest_seq = seq
+        
+        # Process in order; a missing frame is given up on once the jitter window has passed it
+        while self.next_seq <= self.highest_seq:
+            slot = self.next_seq % self.slots
+            if not self.arrived[slot]:
+                if self.highest_seq - self.next_seq < self.jitter_frames:
+                    break
+                offset = slot * self.frame_bytes
+                self.view[offset:offset + self.frame_bytes] = self.silence
+            self.arrived[slot] = 0
+            utterance = self._detect(slot)
+            self.next_seq += 1
+            if utterance is not None:
+                if utterances is None:
+                    utterances = []
+                utterances.append(utterance)
+        return utterances
+    
+    def _detect(self, slot: int) -> Optional[bytes]:
+        samples_per_frame = self.frame_bytes // 2
+        frame = self.samples[slot * samples_per_frame:(slot + 1) * samples_per_frame]
+        voiced = sum(map(mul, frame, frame)) > self.threshold * samples_per_frame
+        
+        if not self.in_speech:
+            self.voiced_run = self.voiced_run + 1 if voiced else 0
+            if self.voiced_run >= self.start_frames:
+                self.in_speech = True
+                self.silence_run = 0
+                self.utterance_start = max(self.first_seq, self.next_seq - self.voiced_run + 1 - self.preroll_frames)
+            return None
+        
+        self.silence_run = 0 if voiced else self.silence_run + 1
+        length = self.next_seq + 1 - self.utterance_start
+        if self.silence_run >= self.hangover_frames or length >= self.max_frames:
+            return self._cut(self.next_seq + 1)
+        return None
+    
+    def _cut(self, end_seq: int) -> bytes:
+        """Copy frames [utterance_start, end_seq) out of the ring and reset VAD"""
+        start = (self.utterance_start % self.slots) * self.frame_bytes
+        end = (end_seq % self.slots) * self.frame_bytes
+        if start < end:
+            pcm = bytes(self.view[start:end])
+        else:
+            pcm = bytes(self.view[start:]) + bytes(self.view[:end])
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silence_run = 0
+        return pcm
+    
+    def flush(self) -> Optional[bytes]:
+        """Finish an utterance still open when the stream stops"""
+        if not self.in_speech or self.next_seq is None:
+            return None
+        return self._cut(self.next_seq)
+
+class SpeechIngest:
+    """Per-connection audio ingest, utterance segmentation and transcription"""
+    
+    def __init__(self, provider: Optional[STTProvider], concurrency: int = 4):
+        self.provider = provider
+        self.streams: Dict[str, AudioStream] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._latency_ms: Deque[float] = deque(maxlen=1000)
+        self.utterances = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+    
+    def start(self, sid: str, room_id: str, user_id: str, sample_rate: int, frame_ms: int,
+              on_transcript: TranscriptHandler) -> AudioStream:
+        """Open (or reopen) the audio stream of a connection"""
+        self.stop(sid, flush=False)
+        stream = AudioStream(
+            room_id, user_id, sample_rate, frame_ms,
+            buffer_seconds=settings.STT_BUFFER_SECONDS,
+            jitter_frames=settings.STT_JITTER_FRAMES,
+            threshold=settings.STT_VAD_THRESHOLD,
+            start_ms=settings.STT_VAD_START_MS,
+            silence_ms=settings.STT_VAD_SILENCE_MS,
+            preroll_ms=settings.STT_VAD_PREROLL_MS,
+            max_utterance_seconds=settings.STT_MAX_UTTERANCE_SECONDS,
+            on_transcript=on_transcript
+        )
+        self.streams[sid] = stream
+        return stream
+    
+    def push(self, sid: str, seq: int, data: bytes) -> bool:
+        """Feed one frame; False if the connection has no open stream"""
+        stream = self.streams.get(sid)
+        if stream is None:
+            return False
+        utterances = stream.push(seq, data)
+        if utterances:
+            for pcm in utterances:
+                self._transcribe(stream, pcm)
+        return True
+    
+    def stop(self, sid: str, flush: bool = True) -> None:
+        """Close a connection's stream, transcribing any open utterance"""
+        stream = self.streams.pop(sid, None)
+        if stream is not None and flush:
+            pcm = stream.flush()
+            if pcm:
+                self._transcribe(stream, pcm)
+    
+    def _transcribe(self, stream: AudioStream, pcm: bytes) -> None:
+        task = asyncio.create_task(self._run(stream, pcm))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, stream: AudioStream, pcm: bytes) -> None:
+        duration_ms = len(pcm) * 1000 // (2 * stream.sample_rate)
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                text = await self.provider.transcribe(pcm, stream.sample_rate)
+                self._latency_ms.append(round((time.perf_counter() - started) * 1000, 1))
+            self.utterances += 1
+            if text.strip():
+                await stream.on_transcript(text.strip(), duration_ms)
+        except Exception as e:
+            logger.error(f"Transcription failed in room {stream.room_id}: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Open streams, frame counters and transcription latency (ms)"""
+        samples = sorted(self._latency_ms)
+        return {
+            "provider": self.provider.name if self.provider else None,
+            "streams": len(self.streams),
+            "frames": sum(stream.frames for stream in self.streams.values()),
+            "lateFrames": sum(stream.late for stream in self.streams.values()),
+            "malformedFrames": sum(stream.malformed for stream in self.streams.values()),
+            "utterances": self.utterances,
+            "transcribeMs": {
+                "p50": samples[len(samples) // 2] if samples else None,
+                "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))] if samples else None
+            }
+        }
+    
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Global speech ingest instance
+speech_ingest = SpeechIngest(create_provider(settings.STT_PROVIDER), concurrency=settings.STT_CONCURRENCY)
@@ -0,0 +1,115 @@
+import sys
+import time
+import logging
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class _ImportTimer(MetaPathFinder):
+    """Times module execution by wrapping the loader each import resolves to"""
+    
+    def __init__(self, profile: "StartupProfile"):
+        self.profile = profile
+    
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            # Builtin and frozen importers are classes shared by many modules; they are cheap anyway
+            if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+                loader.exec_module = self.profile._timed(fullname, loader.exec_module)
+            return spec
+        return None
+
+class StartupProfile:
+    """Import and initialization cost of this worker, per module and per service.
+    
+    While installed, every module import is timed (inclusive and exclusive of
+    the imports it triggers, like `python -X importtime` but in-process), and
+    phase() times named initialization steps such as constructing or starting
+    a service. The report is logged when the worker is ready.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        # module -> [self ms, total ms]
+        self.imports: Dict[str, List[float]] = {}
+        self.phases: Dict[str, float] = {}
+        self.ready_ms: Optional[float] = None
+        self._finder: Optional[_ImportTimer] = None
+        # Time spent in nested imports of the modules currently executing
+        self._children: List[float] = []
+    
+    def install(self) -> None:
+        """Start timing imports (call before the imports to be measured)"""
+        if self._finder is None:
+            self._finder = _ImportTimer(self)
+            sys.meta_path.insert(0, self._finder)
+    
+    def uninstall(self) -> None:
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+    
+    def _timed(self, name: str, exec_module):
+        def run(module) -> None:
+            loader = exec_module.__self__
+            self._children.append(0.0)
+            started = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = (time.perf_counter() - started) * 1000
+                nested = self._children.pop()
+                if self._children:
+                    self._children[-1] += total
+                self.imports[name] = [round(total - nested, 2), round(total, 2)]
+                # Restore the loader's own method
+                loader.__dict__.pop("exec_module", None)
+        return run
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time an initialization step"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(self.phases.get(name, 0.0) + (time.perf_counter() - started) * 1000, 2)
+    
+    def mark_ready(self) -> None:
+        """Record the time from process start of profiling until the worker can serve"""
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        self.uninstall()
+    
+    def report(self, top: int = 15) -> Dict[str, Any]:
+        """Slowest modules (by exclusive time), per-phase timings and time to ready, in ms"""
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        packages: Dict[str, float] = {}
+        for name, (own, _) in self.imports.items():
+            root = name.split(".", 1)[0]
+            packages[root] = packages.get(root, 0.0) + own
+        return {
+            "readyMs": self.ready_ms,
+            "importMs": round(sum(packages.values()), 1),
+            "modulesImported": len(self.imports),
+            "packages": dict(sorted(((name, round(ms, 1)) for name, ms in packages.items()),
+                                    key=lambda item: item[1], reverse=True)[:top]),
+            "slowestModules": [{"module": name, "selfMs": own, "totalMs": total} for name, (own, total) in slowest],
+            "phases": self.phases
+        }
+    
+    def log_report(self) -> None:
+        report = self.report(top=8)
+        packages = ", ".join(f"{name} {ms:.0f}ms" for name, ms in report["packages"].items())
+        phases = ", ".join(f"{name} {ms:.0f}ms" for name, ms in report["phases"].items())
+        logger.info(f"Ready in {report['readyMs']}ms; imports {report['importMs']}ms ({packages}); init: {phases}")
+
+# Global startup profile instance
+startup_profile = StartupProfile()
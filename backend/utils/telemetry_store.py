@@ -0,0 +1,338 @@
+import time
+import uuid
+import asyncio
+import logging
+from array import array
+from typing import Any, Dict, List, Optional, Set
+from config import settings
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+# Rollup slot layout: per metric the number of samples that reported it, their sum and extreme
+(START, COUNT, RTT_COUNT, RTT_SUM, RTT_MAX, LOSS_COUNT, LOSS_SUM, LOSS_MAX,
+ BITRATE_COUNT, BITRATE_SUM, BITRATE_MIN) = range(11)
+ROLLUP_STRIDE = 11
+
+# Rollup resolutions: (name, bucket width in seconds, slots kept)
+ROLLUP_LEVELS = (("1s", 1, 300), ("10s", 10, 360), ("1m", 60, 240))
+
+def _mean(total: float, count: float, digits: int) -> Optional[float]:
+    return round(total / count, digits) if count else None
+
+class RollupSeries:
+    """Ring of fixed-width time buckets packed into one array of doubles"""
+    
+    __slots__ = ("width", "slots", "data", "head", "count")
+    
+    def __init__(self, width: int, slots: int):
+        self.width = width
+        self.slots = slots
+        self.data = array("d", bytes(8 * ROLLUP_STRIDE * slots))
+        self.head = 0
+        self.count = 0
+    
+    def add(self, timestamp: float, rtt_ms: Optional[float], packet_loss: Optional[float],
+            bitrate_kbps: Optional[float]) -> None:
+        data = self.data
+        bucket_start = timestamp - timestamp % self.width
+        base = self.head * ROLLUP_STRIDE
+        
+        # Samples that arrive late are folded into the current bucket
+        if self.count == 0 or bucket_start > data[base + START]:
+            if self.count:
+                self.head = (self.head + 1) % self.slots
+                base = self.head * ROLLUP_STRIDE
+            if self.count < self.slots:
+                self.count += 1
+            for offset in range(1, ROLLUP_STRIDE):
+                data[base + offset] = 0.0
+            data[base + START] = bucket_start
+            data[base + BITRATE_MIN] = float("inf")
+        
+        data[base + COUNT] += 1.0
+        # Metrics a client did not report are no sample, not a zero
+        if rtt_ms is not None:
+            data[base + RTT_COUNT] += 1.0
+            data[base + RTT_SUM] += rtt_ms
+            if rtt_ms > data[base + RTT_MAX]:
+                data[base + RTT_MAX] = rtt_ms
+        if packet_loss is not None:
+            data[base + LOSS_COUNT] += 1.0
+            data[base + LOSS_SUM] += packet_loss
+            if packet_loss > data[base + LOSS_MAX]:
+                data[base + LOSS_MAX] = packet_loss
+        if bitrate_kbps is not None:
+            data[base + BITRATE_COUNT] += 1.0
+            data[base + BITRATE_SUM] += bitrate_kbps
+            if bitrate_kbps < data[base + BITRATE_MIN]:
+                data[base + BITRATE_MIN] = bitrate_kbps
+    
+    def buckets(self) -> List[List[float]]:
+        """Buckets oldest first in the rollup slot layout, which merge_buckets() combines across workers"""
+        data = self.data
+        buckets = []
+        for offset in range(self.count):
+            base = ((self.head - self.count + 1 + offset) % self.slots) * ROLLUP_STRIDE
+            bucket = data[base:base + ROLLUP_STRIDE].tolist()
+            if not bucket[BITRATE_COUNT]:
+                # Keep the stored JSON finite
+                bucket[BITRATE_MIN] = 0.0
+            buckets.append(bucket)
+        return buckets
+
+def bucket_row(bucket: List[float]) -> List[Optional[float]]:
+    """A bucket as [start, count, avgRtt, maxRtt, avgLoss, maxLoss, avgBitrate, minBitrate].
+    
+    A metric no sample in the bucket reported is None.
+    """
+    rtt_count = bucket[RTT_COUNT]
+    loss_count = bucket[LOSS_COUNT]
+    bitrate_count = bucket[BITRATE_COUNT]
+    return [
+        bucket[START],
+        int(bucket[COUNT]),
+        _mean(bucket[RTT_SUM], rtt_count, 2),
+        round(bucket[RTT_MAX], 2) if rtt_count else None,
+        _mean(bucket[LOSS_SUM], loss_count, 4),
+        round(bucket[LOSS_MAX], 4) if loss_count else None,
+        _mean(bucket[BITRATE_SUM], bitrate_count, 1),
+        round(bucket[BITRATE_MIN], 1) if bitrate_count else None
+    ]
+
+# Per metric: (count, sum, extreme) slots of a bucket and how extremes combine
+BUCKET_METRICS = ((RTT_COUNT, RTT_SUM, RTT_MAX, max), (LOSS_COUNT, LOSS_SUM, LOSS_MAX, max),
+                  (BITRATE_COUNT, BITRATE_SUM, BITRATE_MIN, min))
+
+def merge_buckets(series: List[List[List[float]]]) -> List[List[float]]:
+    """Combine several workers' buckets of one resolution by start time, oldest first"""
+    merged: Dict[float, List[float]] = {}
+    for buckets in series:
+        for bucket in buckets:
+            into = merged.get(bucket[START])
+            if into is None:
+                merged[bucket[START]] = list(bucket)
+                continue
+            into[COUNT] += bucket[COUNT]
+            for count, total, extreme, pick in BUCKET_METRICS:
+                if bucket[count]:
+                    into[extreme] = pick(into[extreme], bucket[extreme]) if into[count] else bucket[extreme]
+                    into[count] += bucket[count]
+                    into[total] += bucket[total]
+    return [merged[start] for start in sorted(merged)]
+
+# Running totals per metric in a state: [count, sum, extreme] and how extremes combine
+STATE_METRICS = (("rtt", max), ("loss", max), ("bitrate", min))
+
+def merge_states(states: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the running totals several workers kept for one room"""
+    merged: Dict[str, Any] = {"peers": [], "samples": 0, "firstTs": 0.0, "lastTs": 0.0,
+                              "rtt": [0, 0.0, 0.0], "loss": [0, 0.0, 0.0], "bitrate": [0, 0.0, 0.0]}
+    for state in states:
+        if not state["samples"]:
+            continue
+        merged["peers"] += [peer for peer in state["peers"] if peer not in merged["peers"]]
+        merged["firstTs"] = min(merged["firstTs"], state["firstTs"]) if merged["samples"] else state["firstTs"]
+        merged["lastTs"] = max(merged["lastTs"], state["lastTs"])
+        merged["samples"] += state["samples"]
+        for key, pick in STATE_METRICS:
+            count, total, extreme = state[key]
+            into = merged[key]
+            if count:
+                into[2] = pick(into[2], extreme) if into[0] else extreme
+                into[0] += count
+                into[1] += total
+    return merged
+
+def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Call-quality summary of a room's running totals"""
+    (rtt_count, rtt_sum, rtt_max), (loss_count, loss_sum, loss_max) = state["rtt"], state["loss"]
+    bitrate_count, bitrate_sum, bitrate_min = state["bitrate"]
+    return {
+        "samples": state["samples"],
+        "peers": state["peers"],
+        "startedAt": state["firstTs"],
+        "lastSampleAt": state["lastTs"],
+        "durationSeconds": round(state["lastTs"] - state["firstTs"], 3),
+        "avgRttMs": _mean(rtt_sum, rtt_count, 2),
+        "maxRttMs": round(rtt_max, 2) if rtt_count else None,
+        "avgPacketLoss": _mean(loss_sum, loss_count, 4),
+        "maxPacketLoss": round(loss_max, 4) if loss_count else None,
+        "avgBitrateKbps": _mean(bitrate_sum, bitrate_count, 1),
+        "minBitrateKbps": round(bitrate_min, 1) if bitrate_count else None
+    }
+
+class RoomTelemetry:
+    """Rollups and running totals for one room"""
+    
+    __slots__ = ("peers", "rollups", "samples", "rtt_samples", "rtt_sum", "rtt_max", "loss_samples", "loss_sum",
+                 "loss_max", "bitrate_samples", "bitrate_sum", "bitrate_min", "first_ts", "last_ts")
+    
+    def __init__(self):
+        self.peers: Dict[str, int] = {}
+        self.rollups = [RollupSeries(width, slots) for _, width, slots in ROLLUP_LEVELS]
+        self.samples = 0
+        self.rtt_samples = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        self.loss_samples = 0
+        self.loss_sum = 0.0
+        self.loss_max = 0.0
+        self.bitrate_samples = 0
+        self.bitrate_sum = 0.0
+        self.bitrate_min = float("inf")
+        self.first_ts = 0.0
+        self.last_ts = 0.0
+    
+    def add(self, peer_id: str, timestamp: float, rtt_ms: Optional[float], packet_loss: Optional[float],
+            bitrate_kbps: Optional[float]) -> None:
+        if peer_id not in self.peers:
+            self.peers[peer_id] = len(self.peers)
+        
+        for series in self.rollups:
+            series.add(timestamp, rtt_ms, packet_loss, bitrate_kbps)
+        
+        if not self.samples:
+            self.first_ts = timestamp
+        self.samples += 1
+        self.last_ts = timestamp
+        if rtt_ms is not None:
+            self.rtt_samples += 1
+            self.rtt_sum += rtt_ms
+            if rtt_ms > self.rtt_max:
+                self.rtt_max = rtt_ms
+        if packet_loss is not None:
+            self.loss_samples += 1
+            self.loss_sum += packet_loss
+            if packet_loss > self.loss_max:
+                self.loss_max = packet_loss
+        if bitrate_kbps is not None:
+            self.bitrate_samples += 1
+            self.bitrate_sum += bitrate_kbps
+            if bitrate_kbps < self.bitrate_min:
+                self.bitrate_min = bitrate_kbps
+    
+    def state(self) -> Dict[str, Any]:
+        """Running totals in the form merge_states() combines across workers"""
+        return {
+            "peers": sorted(self.peers, key=self.peers.get),
+            "samples": self.samples,
+            "firstTs": self.first_ts,
+            "lastTs": self.last_ts,
+            "rtt": [self.rtt_samples, self.rtt_sum, self.rtt_max],
+            "loss": [self.loss_samples, self.loss_sum, self.loss_max],
+            "bitrate": [self.bitrate_samples, self.bitrate_sum, self.bitrate_min if self.bitrate_samples else 0.0]
+        }
+    
+    def payload(self) -> Dict[str, Any]:
+        """Running totals and every rollup resolution, as stored in Redis"""
+        return {"state": self.state(), **{
+            name: series.buckets() for (name, _, _), series in zip(ROLLUP_LEVELS, self.rollups)
+        }}
+
+class TelemetryStore:
+    """Call-quality telemetry: in-memory ingest, periodic rollup flush to Redis.
+    
+    The peers of one call may send stats to different workers, so each
+    worker stores its own totals and rollups per room, and reads merge
+    every worker's share.
+    """
+    
+    def __init__(self, flush_interval: float = 10.0, idle_seconds: float = 300.0):
+        self.worker_id = uuid.uuid4().hex
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        self.rooms: Dict[str, RoomTelemetry] = {}
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+    
+    def ingest(self, room_id: str, peer_id: str, rtt_ms: Optional[float], packet_loss: Optional[float],
+               bitrate_kbps: Optional[float], timestamp: Optional[float] = None) -> None:
+        """Record one stats sample; metrics left out (None) are not counted"""
+        if rtt_ms is None and packet_loss is None and bitrate_kbps is None:
+            return
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomTelemetry()
+        room.add(peer_id, timestamp if timestamp is not None else time.time(), rtt_ms, packet_loss, bitrate_kbps)
+        self._dirty.add(room_id)
+    
+    async def flush(self, room_ids: Optional[List[str]] = None) -> int:
+        """Persist this worker's totals and rollups of changed rooms to Redis with their room's TTL"""
+        if room_ids is None:
+            room_ids = list(self._dirty)
+        self._dirty.difference_update(room_ids)
+        
+        payloads = {}
+        for room_id in room_ids:
+            room = self.rooms.get(room_id)
+            if room is not None:
+                payloads[room_id] = room.payload()
+        
+        if payloads:
+            try:
+                await redis_manager.store_telemetry(self.worker_id, payloads)
+            except Exception:
+                self._dirty.update(payloads)
+                raise
+        return len(payloads)
+    
+    async def close_room(self, room_id: str) -> None:
+        """Flush a room's final telemetry and drop it from memory"""
+        if room_id in self.rooms:
+            await self.flush([room_id])
+            del self.rooms[room_id]
+    
+    async def evict_idle(self, now: Optional[float] = None) -> int:
+        """Flush and drop rooms without a sample for idle_seconds (calls that ended without an end event)"""
+        cutoff = (time.time() if now is None else now) - self.idle_seconds
+        idle = [room_id for room_id, room in self.rooms.items() if room.last_ts < cutoff]
+        if idle:
+            await self.flush(idle)
+            for room_id in idle:
+                del self.rooms[room_id]
+        return len(idle)
+    
+    async def get_room_quality(self, room_id: str, resolution: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Quality summary for a room (and optionally one rollup series), merged over every worker"""
+        if room_id in self._dirty:
+            await self.flush([room_id])
+        stored = await redis_manager.get_telemetry(room_id, resolution)
+        if not stored:
+            return None
+        
+        result: Dict[str, Any] = {"roomId": room_id, "summary": summarize(merge_states([share["state"] for share in stored]))}
+        if resolution:
+            result["series"] = [bucket_row(bucket) for bucket in merge_buckets([share["series"] for share in stored])]
+        return result
+    
+    def start_flusher(self) -> None:
+        """Start the periodic background flush"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop_flusher(self) -> None:
+        """Stop the background flush and write out anything pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Telemetry flush failed: {e}")
+
+# Global telemetry store instance
+telemetry_store = TelemetryStore(
+    flush_interval=settings.TELEMETRY_FLUSH_INTERVAL_SECONDS,
+    idle_seconds=settings.TELEMETRY_IDLE_SECONDS
+)
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import functools
+import contextvars
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+# OTLP span kinds / status codes
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+
+def trace_id_for_room(room_id: str) -> str:
+    """Deterministic 128-bit trace id, so every worker traces a room under the same id"""
+    return hashlib.sha256(room_id.encode("utf-8")).hexdigest()[:32]
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class _NoopSpan:
+    """Shared do-nothing span returned when a call is not traced"""
+    
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+    
+    def set_room(self, room_id: str) -> None:
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """A timed operation; root spans collect their children until they end"""
+    
+    __slots__ = ("tracer", "name", "kind", "span_id", "parent", "root", "room_id", "attributes",
+                 "start_ns", "end_ns", "error", "children", "_token")
+    
+    def __init__(self, tracer: "Tracer", name: str, kind: int, parent: Optional["Span"], room_id: Optional[str], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.root = parent.root if parent is not None else self
+        self.room_id = room_id
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+        self._token = None
+    
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        if self.root is self:
+            self.tracer._finish(self)
+        else:
+            self.root.children.append(self)
+        return False
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+    
+    def set_room(self, room_id: str) -> None:
+        """Attach the trace to a room once its id is known (e.g. right after creation)"""
+        self.root.room_id = room_id
+    
+    def to_otlp(self, trace_id: str) -> Dict[str, Any]:
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items() if value is not None]
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        if self.error:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+class Tracer:
+    """Lightweight per-room call setup tracer with OTLP-shaped export.
+    
+    With a sample rate of 0 every span call returns a shared no-op object,
+    so instrumented code pays one attribute check. Sampling is decided per
+    room from its trace id, so all workers keep or drop the same rooms.
+    """
+    
+    def __init__(self, sample_rate: float = 0.0, exporter: str = "memory", export_path: str = "", ring_size: int = 2048,
+                 service_name: str = "ai-companion-backend"):
+        self.sample_rate = sample_rate
+        self.enabled = sample_rate > 0
+        self.exporter = exporter
+        self.export_path = export_path
+        self.service_name = service_name
+        self.ring: Deque[Dict[str, Any]] = deque(maxlen=ring_size)
+    
+    def _sampled(self, trace_id: str) -> bool:
+        return int(trace_id[:8], 16) / 0xFFFFFFFF < self.sample_rate
+    
+    def span(self, name: str, room_id: Optional[str] = None, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+        """Start a span; roots are created for handlers, children inherit their trace"""
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        if parent is None and room_id is not None and not self._sampled(trace_id_for_room(room_id)):
+            return NOOP_SPAN
+        return Span(self, name, kind, parent, room_id, attributes)
+    
+    def child_span(self, name: str, kind: int = SPAN_KIND_CLIENT, **attributes: Any):
+        """Start a span only inside an active trace (Redis calls, upstream fetches)"""
+        if not self.enabled or _current_span.get() is None:
+            return NOOP_SPAN
+        return Span(self, name, kind, _current_span.get(), None, attributes)
+    
+    def current_span(self):
+        """The innermost active span, or the no-op span"""
+        return _current_span.get() or NOOP_SPAN
+    
+    def _finish(self, root: Span) -> None:
+        """Export a finished root span together with its children"""
+        if root.room_id is not None:
+            trace_id = trace_id_for_room(root.room_id)
+            # Rooms only known at the end of the root span are sampled here
+            if not self._sampled(trace_id):
+                return
+            root.attributes["room.id"] = root.room_id
+        elif random.random() < self.sample_rate:
+            trace_id = os.urandom(16).hex()
+        else:
+            return
+        
+        spans = [root.to_otlp(trace_id)] + [child.to_otlp(trace_id) for child in root.children]
+        for span in spans:
+            if root.room_id is not None:
+                span["roomId"] = root.room_id
+            self.ring.append(span)
+        
+        if self.exporter in ("stdout", "file"):
+            self._write(spans)
+    
+    def _write(self, spans: List[Dict[str, Any]]) -> None:
+        """Write one OTLP/JSON ExportTraceServiceRequest line"""
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [{key: value for key, value in span.items() if key != "roomId"} for span in spans]
+                }]
+            }]
+        }
+        line = json.dumps(request, separators=(",", ":")) + "\n"
+        try:
+            if self.exporter == "stdout":
+                sys.stdout.write(line)
+            else:
+                with open(self.export_path, "a", encoding="utf-8") as export_file:
+                    export_file.write(line)
+        except OSError as e:
+            logger.error(f"Failed to export trace: {e}")
+    
+    def recent_spans(self, room_id: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        """Most recent spans from the in-memory ring, optionally for one room"""
+        spans = [span for span in self.ring if room_id is None or span.get("roomId") == room_id]
+        return spans[-limit:]
+
+def _room_id_from_call(args: tuple, kwargs: Dict[str, Any]) -> Optional[str]:
+    """Find the room a handler call is about (room_id kwarg, event dict or request model)"""
+    if kwargs.get("room_id"):
+        return kwargs["room_id"]
+    for value in (*args, *kwargs.values()):
+        if isinstance(value, dict):
+            room_id = value.get("roomId")
+        else:
+            room_id = getattr(value, "roomId", None)
+        if isinstance(room_id, str):
+            return room_id
+    return None
+
+def traced(name: str, kind: int = SPAN_KIND_SERVER) -> Callable:
+    """Decorate a REST or Socket.IO handler with a root span for its room"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            with tracer.span(name, room_id=_room_id_from_call(args, kwargs), kind=kind):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_call(name: str) -> Callable:
+    """Decorate an outgoing call (Redis, upstream API) with a child span"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            with tracer.child_span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Global tracer instance
+tracer = Tracer(
+    sample_rate=settings.TRACING_SAMPLE_RATE,
+    exporter=settings.TRACING_EXPORTER,
+    export_path=settings.TRACING_EXPORT_PATH,
+    ring_size=settings.TRACING_RING_SIZE
+)
@@ -0,0 +1,280 @@
+import math
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Emits one event with its payload to the room the audio belongs to
+Emit = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Characters that end a phrase worth synthesizing on its own
+SENTENCE_ENDINGS = ".!?\n"
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so equal phrases share one cache entry"""
+    return " ".join(text.split())
+
+class TTSProvider(ABC):
+    """Streams synthesized audio for a voice; audio_format describes the bytes"""
+    
+    name = "base"
+    audio_format = "pcm_16000"
+    
+    @abstractmethod
+    def stream(self, voice_id: str, text: str) -> AsyncIterator[bytes]:
+        ...
+    
+    async def close(self) -> None:
+        pass
+
+class SyntheticProvider(TTSProvider):
+    """Local stand-in producing 16 kHz mono PCM tones, one chunk per word"""
+    
+    name = "local"
+    audio_format = "pcm_16000"
+    sample_rate = 16000
+    
+    def __init__(self, chunk_delay: float = 0.0):
+        self.chunk_delay = chunk_delay
+    
+    async def stream(self, voice_id: str, text: str) -> AsyncIterator[bytes]:
+        # Each voice gets its own pitch so streams are distinguishable by ear
+        pitch = 180 + int(hashlib.sha1(voice_id.encode("utf-8")).hexdigest()[:4], 16) % 200
+        step = 2 * math.pi * pitch / self.sample_rate
+        for word in text.split(" "):
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            # 40 ms per character (min 120 ms) of tone followed by 40 ms of silence
+            tone = max(3, len(word)) * self.sample_rate // 25
+            samples = array("h", (int(8000 * math.sin(step * i)) for i in range(tone)))
+            samples.extend(bytes(2 * self.sample_rate // 25))
+            yield samples.tobytes()
+
+class ElevenLabsProvider(TTSProvider):
+    """ElevenLabs streaming text-to-speech over HTTP"""
+    
+    name = "elevenlabs"
+    
+    def __init__(self, api_key: str, model_id: str, output_format: str = "pcm_16000", chunk_size: int = 4096):
+        self.api_key = api_key
+        self.model_id = model_id
+        self.audio_format = output_format
+        self.chunk_size = chunk_size
+        # Imported here so the dependency is only loaded when ElevenLabs is used
+        import httpx
+        
+        self.client = httpx.AsyncClient(
+            base_url="https://api.elevenlabs.io",
+            timeout=httpx.Timeout(settings.UPSTREAM_READ_TIMEOUT_SECONDS, connect=settings.UPSTREAM_CONNECT_TIMEOUT_SECONDS)
+        )
+    
+    async def stream(self, voice_id: str, text: str) -> AsyncIterator[bytes]:
+        async with self.client.stream(
+            "POST",
+            f"/v1/text-to-speech/{voice_id}/stream",
+            params={"output_format": self.audio_format},
+            headers={"xi-api-key": self.api_key},
+            json={"text": text, "model_id": self.model_id}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                yield chunk
+    
+    async def close(self) -> None:
+        await self.client.aclose()
+
+def create_provider(name: str) -> Optional[TTSProvider]:
+    """Provider for TTS_PROVIDER; "auto" uses ElevenLabs when a key is configured, else none"""
+    if name == "off":
+        return None
+    if name == "auto":
+        if not settings.ELEVENLABS_API_KEY:
+            return None
+        name = "elevenlabs"
+    if name == "elevenlabs":
+        return ElevenLabsProvider(settings.ELEVENLABS_API_KEY, settings.TTS_MODEL_ID, settings.TTS_OUTPUT_FORMAT)
+    if name == "local":
+        return SyntheticProvider(settings.TTS_LOCAL_CHUNK_DELAY_SECONDS)
+    raise ValueError(f"Unknown TTS_PROVIDER {name!r}")
+
+class AudioCache:
+    """Content-addressed LRU of synthesized chunks, bounded by total bytes"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, List[bytes]]" = OrderedDict()
+    
+    @staticmethod
+    def key(voice_id: str, text: str, audio_format: str) -> str:
+        return hashlib.sha256(f"{voice_id}\x00{audio_format}\x00{text}".encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[List[bytes]]:
+        chunks = self._entries.get(key)
+        if chunks is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return chunks
+    
+    def put(self, key: str, chunks: List[bytes]) -> None:
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = chunks
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= sum(len(chunk) for chunk in evicted)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+class SpeechStream:
+    """Speaks a reply phrase by phrase while its text is still streaming in.
+    
+    Text is fed token by token; each completed sentence is queued and
+    synthesized in order, so the first audio chunk goes out as soon as the
+    first sentence is ready rather than after the whole reply.
+    """
+    
+    def __init__(self, relay: "TTSRelay", voice_id: str, emit: Emit, **details: Any):
+        self.relay = relay
+        self.voice_id = voice_id
+        self.emit = emit
+        self.stream_id = uuid.uuid4().hex
+        self.details = details
+        self.buffer = ""
+        self.seq = 0
+        self.bytes = 0
+        self.first_chunk_ms: Optional[float] = None
+        self.started = time.perf_counter()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    def feed(self, text: str) -> None:
+        """Add streamed text, queueing any sentences it completes"""
+        self.buffer += text
+        cut = max(self.buffer.rfind(ending) for ending in SENTENCE_ENDINGS)
+        if cut >= 0:
+            self._queue.put_nowait(self.buffer[:cut + 1])
+            self.buffer = self.buffer[cut + 1:]
+    
+    async def finish(self) -> None:
+        """Queue the remaining text and wait until all audio has been sent"""
+        if self.buffer.strip():
+            self._queue.put_nowait(self.buffer)
+        self.buffer = ""
+        self._queue.put_nowait(None)
+        await self._task
+    
+    def cancel(self) -> None:
+        self._task.cancel()
+    
+    async def _send(self, chunk: bytes, cached: bool) -> None:
+        if self.first_chunk_ms is None:
+            self.first_chunk_ms = round((time.perf_counter() - self.started) * 1000, 1)
+            self.relay.first_chunk_ms.append(self.first_chunk_ms)
+        await self.emit("companion_audio_chunk", {"streamId": self.stream_id, "seq": self.seq, "cached": cached, "data": chunk})
+        self.seq += 1
+        self.bytes += len(chunk)
+    
+    async def _run(self) -> None:
+        await self.emit("companion_audio_start", {
+            "streamId": self.stream_id,
+            "format": self.relay.provider.audio_format,
+            **self.details
+        })
+        try:
+            while True:
+                text = await self._queue.get()
+                if text is None:
+                    break
+                text = normalize_text(text)
+                if not text:
+                    continue
+                
+                key = self.relay.cache.key(self.voice_id, text, self.relay.provider.audio_format)
+                cached = self.relay.cache.get(key)
+                if cached is not None:
+                    for chunk in cached:
+                        await self._send(chunk, True)
+                    continue
+                
+                chunks = []
+                async for chunk in self.relay.provider.stream(self.voice_id, text):
+                    chunks.append(chunk)
+                    await self._send(chunk, False)
+                self.relay.cache.put(key, chunks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Speech synthesis failed for stream {self.stream_id}: {e}")
+            await self.emit("companion_audio_error", {"streamId": self.stream_id, "message": "Speech synthesis failed"})
+        await self.emit("companion_audio_end", {
+            "streamId": self.stream_id,
+            "chunks": self.seq,
+            "bytes": self.bytes,
+            "firstChunkMs": self.first_chunk_ms
+        })
+
+class TTSRelay:
+    """Text-to-speech stage relaying audio chunks to the room as they are produced"""
+    
+    def __init__(self, provider: Optional[TTSProvider], cache_bytes: int = 32 * 1024 * 1024):
+        self.provider = provider
+        self.cache = AudioCache(cache_bytes)
+        self.first_chunk_ms: Deque[float] = deque(maxlen=1000)
+    
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+    
+    def open_stream(self, voice_id: str, emit: Emit, **details: Any) -> SpeechStream:
+        """Start a speech stream; details (e.g. replyId) are echoed in companion_audio_start"""
+        return SpeechStream(self, voice_id, emit, **details)
+    
+    async def speak(self, voice_id: str, text: str, emit: Emit, **details: Any) -> None:
+        """Speak a complete text"""
+        stream = self.open_stream(voice_id, emit, **details)
+        stream.feed(text)
+        await stream.finish()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Cache hit rate and first-chunk latency (ms) of recent streams"""
+        samples = sorted(self.first_chunk_ms)
+        return {
+            "provider": self.provider.name if self.provider else None,
+            "cache": self.cache.stats(),
+            "firstChunkMs": {
+                "p50": samples[len(samples) // 2] if samples else None,
+                "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))] if samples else None,
+                "samples": len(samples)
+            }
+        }
+    
+    async def close(self) -> None:
+        if self.provider is not None:
+            await self.provider.close()
+
+# Global TTS relay instance
+tts_relay = TTSRelay(create_provider(settings.TTS_PROVIDER), cache_bytes=settings.TTS_CACHE_MAX_BYTES)
@@ -1,33 +1,200 @@
+import hmac
+import json
+import time
+import base64
+import hashlib
 import logging
-from typing import Dict, Any, List
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from config import settings
 from models import ICEConfig
+from utils.ice_prober import IceServer, IceProber
 
 logger = logging.getLogger(__name__)
 
+def _dumps(value: Any) -> str:
+    """Compact JSON encoding used for pre-serialized responses"""
+    return json.dumps(value, separators=(",", ":"))
+
+def _load_ice_servers() -> List[IceServer]:
+    """Build the ICE server list from ICE_SERVERS, falling back to the legacy settings"""
+    servers: List[IceServer] = []
+    if settings.ICE_SERVERS:
+        try:
+            for entry in json.loads(settings.ICE_SERVERS):
+                urls = entry.get("urls") or [entry["url"]]
+                for url in ([urls] if isinstance(urls, str) else urls):
+                    servers.append(IceServer(
+                        url,
+                        region=entry.get("region", "global"),
+                        username=entry.get("username"),
+                        credential=entry.get("credential")
+                    ))
+            return servers
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.error(f"Invalid ICE_SERVERS, using the legacy STUN/TURN settings: {e}")
+            servers = []
+    
+    for url in ("stun:stun.l.google.com:19302", "stun:stun1.l.google.com:19302", "stun:stun2.l.google.com:19302"):
+        servers.append(IceServer(url))
+    if settings.TURN_SHARED_SECRET or (settings.TURN_USERNAME and settings.TURN_CREDENTIAL):
+        servers.append(IceServer(settings.TURN_SERVER_URL, username=settings.TURN_USERNAME, credential=settings.TURN_CREDENTIAL))
+    return servers
+
+class _Selection:
+    """Pre-serialized ICE servers chosen for one region at one probe generation"""
+    
+    def __init__(self, generation: int, stun: List[IceServer], turn: List[IceServer]):
+        self.generation = generation
+        self.stun_fragment = ",".join(_dumps({"urls": [server.url]}) for server in stun)
+        self.turn_urls = [server.url for server in turn]
+        static_turn = [
+            {"urls": [server.url], "username": server.username, "credential": server.credential}
+            for server in turn if server.username and server.credential
+        ]
+        self.static_response = (
+            '{"iceServers":[' + ",".join(filter(None, [self.stun_fragment] + [_dumps(entry) for entry in static_turn])) + "]}"
+        ).encode("utf-8")
+    
+    def with_turn_credentials(self, username: str, credential: str) -> bytes:
+        """Serialize the selection with per-user TURN credentials"""
+        parts = [self.stun_fragment] if self.stun_fragment else []
+        if self.turn_urls:
+            parts.append(_dumps({"urls": self.turn_urls, "username": username, "credential": credential}))
+        return ('{"iceServers":[' + ",".join(parts) + "]}").encode("utf-8")
+
 class WebRTCConfigService:
     def __init__(self):
-        self.stun_servers = [
-            {"urls": ["stun:stun.l.google.com:19302"]},
-            {"urls": ["stun:stun1.l.google.com:19302"]},
-            {"urls": ["stun:stun2.l.google.com:19302"]}
-        ]
+        self.servers = _load_ice_servers()
+        self.stun_servers = [server for server in self.servers if server.kind == "stun"]
+        self.turn_servers = [server for server in self.servers if server.kind == "turn"]
+        self.regions = sorted({server.region for server in self.servers})
+        
+        self.prober = IceProber(
+            self.servers,
+            interval=settings.ICE_PROBE_INTERVAL_SECONDS,
+            timeout=settings.ICE_PROBE_TIMEOUT_SECONDS,
+            on_update=self._invalidate_selections
+        )
+        
+        # Bumped after every probe round so region selections get re-ranked
+        self._generation = 0
+        self._selections: Dict[Optional[str], _Selection] = {}
+        # Per-user ephemeral TURN credentials: user id -> (reuse until, username, credential)
+        self._credential_cache: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()
+        # Per-user serialized responses: user id -> (generation, region, payload)
+        self._response_cache: Dict[str, Tuple[int, Optional[str], bytes]] = {}
+    
+    def start_prober(self) -> None:
+        """Start background reachability/RTT probing if enabled"""
+        if settings.ICE_PROBE_INTERVAL_SECONDS > 0 and self.servers:
+            self.prober.start()
+    
+    async def stop_prober(self) -> None:
+        """Stop background probing"""
+        await self.prober.stop()
+    
+    def _invalidate_selections(self) -> None:
+        self._generation += 1
+        self._selections.clear()
+    
+    def rank_servers(self, servers: List[IceServer], region: Optional[str]) -> List[IceServer]:
+        """Order servers by region match, then reachability, then smoothed RTT.
+        
+        Servers that failed their recent probes are dropped unless nothing else
+        is left, so clients never wait on ICE gathering against dead servers.
+        """
+        healthy = [server for server in servers if server.failures < settings.ICE_PROBE_MAX_FAILURES]
+        candidates = healthy or servers
+        
+        def sort_key(server: IceServer):
+            region_rank = 0 if region is None or server.region == region else 1
+            if server.rtt_ms is not None and server.failures == 0:
+                return (region_rank, 0, server.rtt_ms)
+            # Unprobed servers rank after measured ones
+            return (region_rank, 1, 0.0)
+        
+        ranked: List[IceServer] = []
+        seen_urls = set()
+        for server in sorted(candidates, key=sort_key):
+            # The same URL may be listed under several regions
+            if server.url not in seen_urls:
+                seen_urls.add(server.url)
+                ranked.append(server)
+        return ranked
+    
+    def _selection(self, region: Optional[str]) -> _Selection:
+        """Best-ranked STUN/TURN subset for a region hint, cached until the next probe round"""
+        if region not in self.regions:
+            region = None
+        selection = self._selections.get(region)
+        if selection is None:
+            selection = _Selection(
+                self._generation,
+                self.rank_servers(self.stun_servers, region)[:settings.ICE_MAX_STUN_SERVERS],
+                self.rank_servers(self.turn_servers, region)[:settings.ICE_MAX_TURN_SERVERS]
+            )
+            self._selections[region] = selection
+        return selection
+    
+    def server_status(self) -> List[Dict[str, Any]]:
+        """Latest probe results for every configured server"""
+        return [server.to_dict() for server in self.servers]
+    
+    @property
+    def uses_ephemeral_credentials(self) -> bool:
+        """Whether TURN credentials are minted per user from a shared secret"""
+        return bool(settings.TURN_SHARED_SECRET)
+    
+    def generate_turn_credentials(self, user_id: str, now: Optional[float] = None) -> Dict[str, Any]:
+        """Create time-limited TURN credentials (TURN REST API convention).
         
-        self.turn_servers = []
-        if settings.TURN_USERNAME and settings.TURN_CREDENTIAL:
-            self.turn_servers.append({
-                "urls": [settings.TURN_SERVER_URL],
-                "username": settings.TURN_USERNAME,
-                "credential": settings.TURN_CREDENTIAL
-            })
+        The username is "<expiry unix time>:<user id>" and the credential is
+        base64(HMAC-SHA1(shared secret, username)), which coturn and most
+        managed TURN services verify without any per-user state.
+        """
+        expires_at = int(now if now is not None else time.time()) + settings.TURN_CREDENTIAL_TTL_SECONDS
+        username = f"{expires_at}:{user_id}"
+        digest = hmac.new(settings.TURN_SHARED_SECRET.encode("utf-8"), username.encode("utf-8"), hashlib.sha1).digest()
+        return {
+            "urls": [server.url for server in self.turn_servers] or [settings.TURN_SERVER_URL],
+            "username": username,
+            "credential": base64.b64encode(digest).decode("ascii"),
+            "expiresAt": expires_at
+        }
     
-    def get_ice_config(self) -> ICEConfig:
+    def get_ice_config(self, user_id: Optional[str] = None, region: Optional[str] = None) -> ICEConfig:
         """Get ICE server configuration for WebRTC"""
-        ice_servers = self.stun_servers + self.turn_servers
+        return ICEConfig(**json.loads(self.get_ice_config_json(user_id, region)))
+    
+    def get_ice_config_json(self, user_id: Optional[str] = None, region: Optional[str] = None) -> bytes:
+        """Get the serialized ICE configuration, reusing cached per-user credentials"""
+        selection = self._selection(region)
+        if not self.uses_ephemeral_credentials or not user_id:
+            return selection.static_response
         
-        logger.info(f"Providing ICE configuration with {len(ice_servers)} servers")
+        now = time.time()
+        cached = self._credential_cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            self._credential_cache.move_to_end(user_id)
+            response = self._response_cache.get(user_id)
+            if response is not None and response[0] == selection.generation and response[1] == region:
+                return response[2]
+            _, username, credential = cached
+        else:
+            turn = self.generate_turn_credentials(user_id, now)
+            username, credential = turn["username"], turn["credential"]
+            # Hand out fresh credentials once the cached ones get close to expiry
+            reuse_until = turn["expiresAt"] - settings.TURN_CREDENTIAL_REFRESH_MARGIN_SECONDS
+            self._credential_cache[user_id] = (reuse_until, username, credential)
+            self._credential_cache.move_to_end(user_id)
+            while len(self._credential_cache) > settings.TURN_CREDENTIAL_CACHE_SIZE:
+                evicted, _ = self._credential_cache.popitem(last=False)
+                self._response_cache.pop(evicted, None)
         
-        return ICEConfig(iceServers=ice_servers)
+        payload = selection.with_turn_credentials(username, credential)
+        self._response_cache[user_id] = (selection.generation, region, payload)
+        return payload
     
     def get_media_constraints(self) -> Dict[str, Any]:
         """Get default media constraints for WebRTC"""
@@ -0,0 +1,269 @@
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import struct
+import ctypes
+import asyncio
+import logging
+import argparse
+import selectors
+import subprocess
+from typing import List, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+ROUTINGS = ("ip_hash", "reuseport")
+
+# setsockopt option attaching a classic BPF program that picks the socket of a SO_REUSEPORT group
+SO_ATTACH_REUSEPORT_CBPF = 51
+# Offset of the network header for BPF_ABS loads (SKF_NET_OFF)
+_NET_OFF = -0x100000
+
+def _ip_hash_program(workers: int, ipv6: bool) -> List[Tuple[int, int, int, int]]:
+    """Classic BPF returning hash(source address) % workers, the index of the listener to use"""
+    # Last 32 bits of the source address: bytes 12-15 of the IPv4 header, 20-23 of the IPv6 one
+    source = _NET_OFF + (20 if ipv6 else 12)
+    instructions = [
+        (0x20, 0, 0, source & 0xFFFFFFFF),  # ld [source]
+        (0x24, 0, 0, 0x9E3779B1),           # mul #golden ratio, spreads neighbouring addresses
+        (0x74, 0, 0, 16),                   # rsh #16
+        (0x94, 0, 0, workers),              # mod #workers
+        (0x16, 0, 0, 0)                     # ret a
+    ]
+    return instructions
+
+def create_listeners(host: str, port: int, workers: int, routing: str, backlog: int = 2048) -> List[socket.socket]:
+    """One listening socket per worker, all bound to host:port in one SO_REUSEPORT group.
+    
+    With ip_hash, a BPF program makes the kernel hand every connection from
+    one client address to the same socket, so Engine.IO long-polling
+    requests (each possibly a new TCP connection) keep reaching the worker
+    that holds their session. With reuseport the kernel spreads connections
+    by their 4-tuple, which only suits websocket-only clients.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listeners = []
+    for _ in range(workers):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if family == socket.AF_INET6:
+            # IPv4-mapped clients would be hashed on the wrong header bytes
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.bind((host, port))
+        # Listening in order fixes each socket's index in the group, which the program returns
+        sock.listen(backlog)
+        sock.set_inheritable(True)
+        listeners.append(sock)
+    if routing == "ip_hash":
+        program = _ip_hash_program(workers, family == socket.AF_INET6)
+        code = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in program))
+        # struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+        fprog = struct.pack("HL", len(program), ctypes.addressof(code))
+        listeners[0].setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+    return listeners
+
+class _Worker:
+    def __init__(self, index: int, listener: socket.socket):
+        self.index = index
+        self.listener = listener
+        self.process: Optional[subprocess.Popen] = None
+        self.heartbeat_fd: Optional[int] = None
+        self.started_at = 0.0
+        self.last_beat: Optional[float] = None
+        self.failures = 0
+        self.restart_at = 0.0
+
+class WorkerPool:
+    """Runs one uvicorn worker process per listener and keeps them alive.
+    
+    The listeners are created here and stay open for the pool's lifetime,
+    so a restarted worker takes over exactly the clients its predecessor
+    was routed. Each worker writes a heartbeat from its event loop once it
+    serves; a worker that exits, or whose loop stops beating, is replaced,
+    with exponential backoff when it keeps failing right after start.
+    SIGTERM/SIGINT are forwarded so every worker drains before exiting.
+    """
+    
+    def __init__(self, host: str, port: int, workers: int = 0, routing: str = "ip_hash",
+                 heartbeat_interval: float = 1.0, heartbeat_timeout: float = 10.0,
+                 startup_timeout: float = 60.0, backoff_max: float = 30.0, shutdown_timeout: float = 30.0):
+        if routing not in ROUTINGS:
+            raise ValueError(f"WORKER_ROUTING must be one of {ROUTINGS}, got {routing!r}")
+        self.host = host
+        self.port = port
+        self.size = workers or os.cpu_count() or 1
+        self.routing = routing
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.backoff_max = backoff_max
+        self.shutdown_timeout = shutdown_timeout
+        self.workers: List[_Worker] = []
+        self.selector = selectors.DefaultSelector()
+        self.stopping = False
+    
+    def run(self) -> int:
+        listeners = create_listeners(self.host, self.port, self.size, self.routing)
+        self.workers = [_Worker(index, listener) for index, listener in enumerate(listeners)]
+        logger.info(f"Starting {self.size} workers on {self.host}:{self.port} ({self.routing} routing)")
+        
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle_stop)
+        for worker in self.workers:
+            self._spawn(worker)
+        
+        while not self.stopping:
+            for key, _ in self.selector.select(timeout=min(0.5, self.heartbeat_interval)):
+                self._read_heartbeat(key.data)
+            now = time.monotonic()
+            for worker in self.workers:
+                self._supervise(worker, now)
+        
+        self._shutdown()
+        return 0
+    
+    def _spawn(self, worker: _Worker) -> None:
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        command = [
+            sys.executable, "-m", "utils.worker_pool",
+            "--fd", str(worker.listener.fileno()),
+            "--heartbeat-fd", str(write_fd),
+            "--heartbeat-interval", str(self.heartbeat_interval)
+        ]
+        env = dict(os.environ, WORKERS=str(self.size), WORKER_INDEX=str(worker.index))
+        worker.process = subprocess.Popen(
+            command,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env,
+            pass_fds=(worker.listener.fileno(), write_fd)
+        )
+        os.close(write_fd)
+        worker.heartbeat_fd = read_fd
+        worker.started_at = time.monotonic()
+        worker.last_beat = None
+        self.selector.register(read_fd, selectors.EVENT_READ, worker)
+        logger.info(f"Worker {worker.index} started (pid {worker.process.pid})")
+    
+    def _read_heartbeat(self, worker: _Worker) -> None:
+        try:
+            data = os.read(worker.heartbeat_fd, 1024)
+        except BlockingIOError:
+            return
+        if not data:
+            # The worker closed its end: it exited, which _supervise handles
+            self._close_heartbeat(worker)
+            return
+        if worker.last_beat is None:
+            logger.info(f"Worker {worker.index} ready in {time.monotonic() - worker.started_at:.1f}s")
+        worker.last_beat = time.monotonic()
+    
+    def _close_heartbeat(self, worker: _Worker) -> None:
+        if worker.heartbeat_fd is not None:
+            self.selector.unregister(worker.heartbeat_fd)
+            os.close(worker.heartbeat_fd)
+            worker.heartbeat_fd = None
+    
+    def _supervise(self, worker: _Worker, now: float) -> None:
+        process = worker.process
+        if process is None:
+            if now >= worker.restart_at:
+                self._spawn(worker)
+            return
+        
+        if process.poll() is None:
+            if worker.last_beat is None:
+                stalled = now - worker.started_at > self.startup_timeout
+            else:
+                stalled = now - worker.last_beat > self.heartbeat_timeout
+            if not stalled:
+                return
+            logger.error(f"Worker {worker.index} (pid {process.pid}) stopped responding, killing it")
+            process.kill()
+            process.wait()
+        else:
+            logger.error(f"Worker {worker.index} (pid {process.pid}) exited with code {process.returncode}")
+        
+        self._close_heartbeat(worker)
+        worker.process = None
+        # Back off while a worker keeps dying before it ever became ready
+        worker.failures = worker.failures + 1 if worker.last_beat is None else 0
+        delay = min(self.backoff_max, 0.5 * (2 ** worker.failures)) if worker.failures else 0.0
+        worker.restart_at = now + delay
+        if delay:
+            logger.warning(f"Restarting worker {worker.index} in {delay:.1f}s")
+    
+    def _handle_stop(self, signum, frame) -> None:
+        if self.stopping:
+            # A second signal skips the drain
+            for worker in self.workers:
+                if worker.process is not None and worker.process.poll() is None:
+                    worker.process.kill()
+            return
+        self.stopping = True
+        logger.info(f"Received {signal.Signals(signum).name}, stopping workers")
+    
+    def _shutdown(self) -> None:
+        running = [worker.process for worker in self.workers if worker.process is not None]
+        for process in running:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in running:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Worker pid {process.pid} did not stop in time, killing it")
+                process.kill()
+                process.wait()
+        for worker in self.workers:
+            self._close_heartbeat(worker)
+            worker.listener.close()
+        logger.info("All workers stopped")
+
+async def _heartbeat(server, fd: int, interval: float) -> None:
+    """Beat from the event loop, so a blocked loop is noticed as well as a dead process"""
+    while True:
+        if server.started:
+            try:
+                os.write(fd, b".")
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                if e.errno == errno.EPIPE:
+                    # The supervisor is gone; nothing will restart or stop this worker
+                    server.should_exit = True
+                    return
+                raise
+        await asyncio.sleep(interval)
+
+def serve_worker(fd: int, heartbeat_fd: int, heartbeat_interval: float) -> None:
+    """Serve the app on an inherited listener, reporting liveness on heartbeat_fd"""
+    import uvicorn
+    from utils.signaling_transport import websocket_options
+    
+    listener = socket.socket(fileno=fd)
+    os.set_blocking(heartbeat_fd, False)
+    server = uvicorn.Server(uvicorn.Config("main:socket_app", reload=False, **websocket_options()))
+    
+    async def serve() -> None:
+        heartbeat = asyncio.create_task(_heartbeat(server, heartbeat_fd, heartbeat_interval))
+        try:
+            await server.serve(sockets=[listener])
+        finally:
+            heartbeat.cancel()
+    
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker process of the pool (started by WorkerPool)")
+    parser.add_argument("--fd", type=int, required=True)
+    parser.add_argument("--heartbeat-fd", type=int, required=True)
+    parser.add_argument("--heartbeat-interval", type=float, default=settings.WORKER_HEARTBEAT_SECONDS)
+    args = parser.parse_args()
+    serve_worker(args.fd, args.heartbeat_fd, args.heartbeat_interval)
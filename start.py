@@ -5,15 +5,16 @@ Starts both backend and frontend services
 """
 
 import subprocess
+import argparse
 import sys
 import time
 import os
 from pathlib import Path
 
-def run_command(command, cwd=None, shell=True):
+def run_command(command, cwd=None, shell=True, env=None):
     """Run a command and return the process"""
     print(f"Running: {command}")
-    return subprocess.Popen(command, cwd=cwd, shell=shell)
+    return subprocess.Popen(command, cwd=cwd, shell=shell, env=env)
 
 def check_port(port):
     """Check if a port is available"""
@@ -24,6 +25,11 @@ def check_port(port):
     return result == 0
 
 def main():
+    parser = argparse.ArgumentParser(description="Start the backend and frontend")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Backend worker processes, 0 for one per CPU core (default: WORKERS from .env, else 1)")
+    args = parser.parse_args()
+    
     print("🚀 Starting AI Companion Video Call Platform")
     print("=" * 50)
     
@@ -57,7 +63,12 @@ def main():
         # Start Backend
         print("\n🔧 Starting Backend (FastAPI)...")
         backend_cmd = "python main.py"
-        backend_process = run_command(backend_cmd, cwd=backend_dir)
+        backend_env = dict(os.environ)
+        if args.workers is not None:
+            backend_env["WORKERS"] = str(args.workers)
+            if args.workers != 1:
+                print(f"   {args.workers or os.cpu_count()} worker processes, auto-reload off")
+        backend_process = run_command(backend_cmd, cwd=backend_dir, env=backend_env)
         processes.append(("Backend", backend_process))
         
         # Wait a bit for backend to start